@@ -0,0 +1,156 @@
+import datetime
+import threading
+from money import to_cents
+
+SIGNS = {'deposit': 1, 'transfer_in': 1, 'withdrawal': -1, 'transfer_out': -1}
+
+class Aggregates:
+    # System-wide figures for the admin dashboard: number of accounts,
+    # locked accounts, total balance held and, per day and transaction type,
+    # how many were posted and for how much. ATM.record() applies every
+    # change record as it is logged, at O(1) per posting, so reading them
+    # costs the same however many accounts there are. Amounts are kept in
+    # cents so the running total does not drift.
+    #
+    # Storage keeps them with its own durable state (Storage.aggregates()),
+    # so a start after a crash does not count anything. Where it cannot, the
+    # ATM counts them from the accounts the first time they are asked for
+    # (Recount), where the postings of accounts closed since are no longer
+    # to be found.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accounts = 0
+        self.balance = 0
+        self.locked = set()
+        self.volumes = {}  # 'YYYY-MM-DD' -> {type: [count, cents]}
+    
+    def apply(self, record, counted=None):
+        # With `counted`, only the parts of the record for accounts where
+        # counted(account number) is true; accounts opened by the record
+        # always count
+        op = record['op']
+        with self.lock:
+            if op == 'import':
+                self.accounts += len(record['accounts'])
+            if op in ('deposit', 'withdrawal', 'transfer', 'batch', 'import'):
+                for acc_num, transaction in record['postings']:
+                    if counted is None or counted(acc_num):
+                        cents = to_cents(transaction['amount'])
+                        self.balance += SIGNS.get(transaction['type'], 0) * cents
+                        self._count(transaction['date'], transaction['type'], cents)
+            elif op == 'open':
+                self.accounts += 1
+                self.balance += to_cents(record['balance'])
+            elif counted is not None and not counted(record.get('account')):
+                return
+            elif op == 'status':
+                if record['locked']:
+                    self.locked.add(record['account'])
+                else:
+                    self.locked.discard(record['account'])
+            elif op == 'close':
+                self.accounts -= 1
+                self.locked.discard(record['account'])
+    
+    def _count(self, date, type_, cents):
+        volume = self.volumes.setdefault(date[:10], {}).setdefault(type_, [0, 0])
+        volume[0] += 1
+        volume[1] += cents
+    
+    def add_account(self, account_number, cents, locked, transactions):
+        # One account and its whole history, counted from scratch
+        with self.lock:
+            self.accounts += 1
+            self.balance += cents
+            if locked:
+                self.locked.add(account_number)
+            for transaction in transactions:
+                try:
+                    self._count(transaction['date'], transaction['type'], to_cents(transaction['amount']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+    
+    def merge(self, other):
+        with self.lock:
+            self.accounts += other.accounts
+            self.balance += other.balance
+            self.locked |= other.locked
+            for day, types in other.volumes.items():
+                for type_, (count, cents) in types.items():
+                    volume = self.volumes.setdefault(day, {}).setdefault(type_, [0, 0])
+                    volume[0] += count
+                    volume[1] += cents
+    
+    @classmethod
+    def count(cls, accounts):
+        # From scratch: one pass over the accounts and their whole histories
+        aggregates = cls()
+        for account in accounts:
+            aggregates.add_account(account.account_number, account.cents, account.locked, account.transaction_history)
+        return aggregates
+    
+    @classmethod
+    def count_data(cls, accounts_data):
+        # The same from data in the accounts.json shape
+        aggregates = cls()
+        for acc_num, acc_data in accounts_data.items():
+            aggregates.add_account(acc_num, to_cents(acc_data['balance']), acc_data.get('locked', False),
+                                   acc_data.get('transaction_history', ()))
+        return aggregates
+    
+    def summary(self, today, days=7):
+        # The figures for the dashboard, with volumes for the `days` days up
+        # to `today` (a date), newest first, in currency units
+        with self.lock:
+            volumes = []
+            for offset in range(days):
+                day = (today - datetime.timedelta(days=offset)).isoformat()
+                volumes.append([day, {type_: [count, cents / 100]
+                                      for type_, (count, cents) in self.volumes.get(day, {}).items()}])
+            return {
+                'accounts': self.accounts,
+                'locked': len(self.locked),
+                'total_balance': self.balance / 100,
+                'volumes': volumes
+            }
+    
+    def state(self):
+        # For storage to keep, as JSON
+        with self.lock:
+            return {
+                'accounts': self.accounts,
+                'balance': self.balance,
+                'locked': sorted(self.locked),
+                'volumes': {day: {type_: list(volume) for type_, volume in types.items()}
+                            for day, types in self.volumes.items()}
+            }
+    
+    @classmethod
+    def from_state(cls, state):
+        aggregates = cls()
+        aggregates.accounts = state['accounts']
+        aggregates.balance = state['balance']
+        aggregates.locked = set(state['locked'])
+        aggregates.volumes = state['volumes']
+        return aggregates
+
+class Recount:
+    # Aggregates counted from the accounts while operations go on: each of
+    # `numbers` is counted under its own lock, and records logged meanwhile
+    # are applied only for the accounts counted already (or opened since),
+    # as the count of the others will include them
+    def __init__(self, numbers):
+        self.aggregates = Aggregates()
+        self.waiting = set(numbers)
+    
+    def counted(self, account_number):
+        return account_number not in self.waiting
+    
+    def apply(self, record):
+        self.aggregates.apply(record, self.counted)
+    
+    def add(self, account_number, aggregates):
+        # The account's own count, or None if it was closed before its turn
+        if aggregates is not None:
+            self.aggregates.merge(aggregates)
+        self.waiting.discard(account_number)
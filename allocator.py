@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+from storage import compact_json, write_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are coordinated
+    fcntl = None
+
+class AccountNumberAllocator:
+    # Hands out account number permute(0), permute(1), ... where permute is
+    # a keyed Feistel network over the `digits`-digit space: every number
+    # comes out at most once and consecutive ones look unrelated, at O(1)
+    # cost however full the space is. The secret key and the next free
+    # counter live in a small state file. Counters are reserved `block` at
+    # a time and the file is updated before any of them is used, so a
+    # restart or another process sharing the file never repeats a number;
+    # an unused rest of a block is simply skipped.
+    ROUNDS = 4
+    
+    def __init__(self, path=None, digits=8, block=100):
+        self.path = path
+        self.digits = digits
+        self.size = 10 ** digits
+        self.half = 10 ** ((digits + 1) // 2)
+        self.block = block
+        self.lock = threading.Lock()
+        self.next = 0
+        self.end = 0
+        state = self._read_state()
+        self._set_key(bytes.fromhex(state['key']) if state else os.urandom(16))
+    
+    def _set_key(self, key):
+        # One keyed hash per round, copied for each use: cheaper than keying
+        # a fresh one every time
+        self.key = key
+        self.round_hashes = [hashlib.blake2b(bytes([n]), key=key, digest_size=8) for n in range(self.ROUNDS)]
+    
+    def _read_state(self):
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        if state['digits'] != self.digits:
+            raise ValueError(f"{self.path} is for {state['digits']}-digit account numbers")
+        return state
+    
+    def permute(self, counter):
+        # Feistel rounds over half * half >= size numbers; results outside
+        # the space are encrypted again (cycle walking), which keeps this a
+        # permutation of 0..size-1. With an even number of digits
+        # half * half == size and no walking happens; with an odd number it
+        # takes 10 passes on average.
+        value = counter
+        while True:
+            left, right = divmod(value, self.half)
+            for round_hash in self.round_hashes:
+                digest = round_hash.copy()
+                digest.update(right.to_bytes(8, 'big'))
+                left, right = right, (left + int.from_bytes(digest.digest(), 'big')) % self.half
+            value = left * self.half + right
+            if value < self.size:
+                return value
+    
+    def allocate(self):
+        with self.lock:
+            if self.next == self.end:
+                self._reserve()
+            counter = self.next
+            self.next += 1
+        return f"{self.permute(counter):0{self.digits}d}"
+    
+    def allocate_many(self, count):
+        # For bulk imports: one state-file write for the whole run rather
+        # than one per block
+        counters = []
+        with self.lock:
+            while len(counters) < count:
+                if self.next == self.end:
+                    self._reserve(count - len(counters))
+                take = min(self.end - self.next, count - len(counters))
+                counters.extend(range(self.next, self.next + take))
+                self.next += take
+        return [f"{self.permute(counter):0{self.digits}d}" for counter in counters]
+    
+    def _reserve(self, minimum=0):
+        block = max(self.block, minimum)
+        if self.path is None:
+            start = self.end
+        else:
+            lock_file = open(self.path + '.lock', 'a')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # Re-read: another process may have reserved since
+                state = self._read_state()
+                if state is not None and state['key'] != self.key.hex():
+                    self._set_key(bytes.fromhex(state['key']))
+                start = state['next'] if state else 0
+                if start < self.size:
+                    write_atomic(self.path, compact_json({
+                        'digits': self.digits,
+                        'key': self.key.hex(),
+                        'next': min(start + block, self.size)
+                    }))
+            finally:
+                lock_file.close()
+        if start >= self.size:
+            raise RuntimeError("No account numbers left")
+        self.next = start
+        self.end = min(start + block, self.size)
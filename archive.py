@@ -0,0 +1,207 @@
+import argparse
+import datetime
+import functools
+import json
+import os
+import threading
+import zlib
+from history import format_timestamp, to_timestamp
+from storage import account_path, compact_json, write_atomic
+
+class Archive:
+    # Cold tier for old transactions. One append-only segment per month,
+    # YYYY-MM.seg, made of zlib-compressed blocks, each holding consecutive
+    # transactions of one account from that month as JSON lines, and per
+    # account an append-only table of its blocks, accounts/NN/<account>.idx,
+    # one JSON line per block:
+    #
+    #   [month, position, count, offset, length, first, last]
+    #
+    # with the block's position in the account's history, its byte range in
+    # the month's segment and the timestamps of its first and last
+    # transaction. A write appends to the segments and to the tables of the
+    # accounts it moves, so it costs what it writes; a read loads one
+    # account's table and decompresses only the blocks in the range asked
+    # for. Tables of recently read accounts are cached.
+    #
+    # Blocks are written before the 'archive' record that moves their
+    # transactions out of the live history, so readers pass `upto`, the
+    # account's archived count, and ignore blocks at or past it: those are
+    # left over from a write whose record never made it, and are replaced
+    # when those positions are archived again (a table line at position p
+    # drops the lines before it at p or later).
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.migrated = False
+        self.table = functools.lru_cache(maxsize=4096)(self._read_table)
+        self.block = functools.lru_cache(maxsize=256)(self._read_block)
+    
+    def table_path(self, account_number):
+        return account_path(os.path.join(self.directory, 'accounts'), account_number, '.idx')
+    
+    def _read_table(self, account_number):
+        # The account's blocks, ordered by position. A line cut short by a
+        # crash during a write is skipped: that write's record never made it
+        blocks = []
+        try:
+            with open(self.table_path(account_number), 'r') as f:
+                lines = f.read().split('\n')
+        except FileNotFoundError:
+            return ()
+        for line in lines[:-1]:
+            try:
+                month, position, count, offset, length, first, last = json.loads(line)
+            except ValueError:
+                continue
+            blocks = [block for block in blocks if block[0] < position]
+            blocks.append((position, count, month, offset, length, first, last))
+        return tuple(blocks)
+    
+    def _migrate(self):
+        # Archives written before the per-account tables kept one JSON index
+        # per month, {account: [[position, count, offset, length, first,
+        # last], ...]}; they are turned into tables once, and the month
+        # indexes removed after the marker says every table is written
+        if self.migrated:
+            return
+        self.migrated = True
+        legacy = sorted(entry for entry in os.listdir(self.directory) if entry.endswith('.idx')) \
+            if os.path.isdir(self.directory) else []
+        if not legacy:
+            return
+        marker = os.path.join(self.directory, 'accounts', 'migrated')
+        if not os.path.exists(marker):
+            tables = {}
+            for entry in legacy:
+                with open(os.path.join(self.directory, entry), 'r') as f:
+                    for account_number, blocks in json.load(f).items():
+                        tables.setdefault(account_number, []).extend([entry[:-len('.idx')]] + block
+                                                                     for block in blocks)
+            for account_number, rows in tables.items():
+                os.makedirs(os.path.dirname(self.table_path(account_number)), exist_ok=True)
+                rows.sort(key=lambda row: row[1])
+                write_atomic(self.table_path(account_number), ''.join(compact_json(row) + '\n' for row in rows))
+            write_atomic(marker, '')
+        for entry in legacy:
+            os.remove(os.path.join(self.directory, entry))
+        os.remove(marker)
+    
+    def blocks(self, account_number, upto):
+        # (position, count, month, offset, length, first, last) of the
+        # account's archived blocks below `upto`, oldest first
+        with self.lock:
+            self._migrate()
+            return [block for block in self.table(account_number) if block[0] + block[1] <= upto]
+    
+    def _read_block(self, month, offset, length):
+        with open(os.path.join(self.directory, month + '.seg'), 'rb') as f:
+            f.seek(offset)
+            data = zlib.decompress(f.read(length))
+        return [json.loads(line) for line in data.splitlines()]
+    
+    def read(self, account_number, start, stop, upto):
+        # Archived transactions [start, stop) of the account
+        transactions = []
+        for position, count, month, offset, length, first, last in self.blocks(account_number, upto):
+            if position + count > start and position < stop:
+                block = self.block(month, offset, length)
+                transactions += block[max(start - position, 0):stop - position]
+        return transactions
+    
+    def between(self, account_number, start, end, upto):
+        # Archived transactions with start <= timestamp < end, oldest first
+        transactions = []
+        for position, count, month, offset, length, first, last in self.blocks(account_number, upto):
+            if last >= start and first < end:
+                transactions += [t for t in self.block(month, offset, length)
+                                 if start <= self._timestamp(t) < end]
+        return transactions
+    
+    def last_before(self, account_number, timestamp, upto):
+        for position, count, month, offset, length, first, last in reversed(self.blocks(account_number, upto)):
+            if first < timestamp:
+                for transaction in reversed(self.block(month, offset, length)):
+                    if self._timestamp(transaction) < timestamp:
+                        return transaction
+        return None
+    
+    def write(self, moves):
+        # moves: [(account number, position of the first one, transactions)]
+        # Appends the transactions as blocks, split by month, and syncs the
+        # segments, then appends the blocks to the accounts' tables.
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            self._migrate()
+            rows = {}
+            segments = {}
+            try:
+                for account_number, position, transactions in moves:
+                    for month, run in self._runs(transactions):
+                        if month not in segments:
+                            segments[month] = open(os.path.join(self.directory, month + '.seg'), 'ab')
+                        f = segments[month]
+                        data = zlib.compress(''.join(compact_json(t) + '\n' for t in run).encode())
+                        offset = f.tell()
+                        f.write(data)
+                        times = [self._timestamp(t) for t in run]
+                        rows.setdefault(account_number, []).append(
+                            [month, position, len(run), offset, len(data), min(times), max(times)])
+                        position += len(run)
+                for f in segments.values():
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                for f in segments.values():
+                    f.close()
+            for account_number, account_rows in rows.items():
+                path = self.table_path(account_number)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'a+b') as f:
+                    # Start on a line of its own after a line cut short
+                    f.seek(0, os.SEEK_END)
+                    separator = b''
+                    if f.tell():
+                        f.seek(-1, os.SEEK_END)
+                        separator = b'' if f.read(1) == b'\n' else b'\n'
+                    f.write(separator + ''.join(compact_json(row) + '\n' for row in account_rows).encode())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.table.cache_clear()
+    
+    def _timestamp(self, transaction):
+        try:
+            return to_timestamp(transaction['date'])
+        except (KeyError, TypeError, ValueError):
+            return 0
+    
+    def _runs(self, transactions):
+        # Consecutive transactions of the same month; an undated one stays
+        # with the one before it
+        runs = []
+        month = None
+        for transaction in transactions:
+            timestamp = self._timestamp(transaction)
+            if timestamp or month is None:
+                month = format_timestamp(timestamp)[:7]
+            if runs and runs[-1][0] == month:
+                runs[-1][1].append(transaction)
+            else:
+                runs.append((month, [transaction]))
+        return runs
+
+if __name__ == "__main__":
+    from bank import ATM, add_storage_arguments, make_storage
+    parser = argparse.ArgumentParser(description="Move old transactions into the monthly archive")
+    add_storage_arguments(parser)
+    parser.add_argument('--older-than-days', type=float, default=365,
+                        help="archive transactions older than this many days")
+    parser.add_argument('--chunk', type=int, default=1000, help="accounts per archive write")
+    args = parser.parse_args()
+    atm_system = ATM(make_storage(args))
+    try:
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=args.older_than_days)
+        moved = atm_system.archive_history(cutoff, args.chunk)
+    finally:
+        atm_system.close()
+    print(f"Archived {moved} transaction(s) dated before {cutoff:%Y-%m-%d %H:%M:%S}")
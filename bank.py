@@ -0,0 +1,865 @@
+import contextlib
+import datetime
+import threading
+from aggregates import Aggregates, Recount
+from allocator import AccountNumberAllocator
+from archive import Archive
+from binstore import BinaryStorage
+from history import TYPES, History, datetime_timestamp
+from indexes import AccountIndex
+from journal import JournalStorage
+from metrics import METRICS, amount_failure
+from money import amount_cents, format_amount, from_cents, to_cents
+from storage import JsonStorage, ShardedStorage, SqliteStorage
+
+class BankAccount:
+    # The balance is kept in integer cents (self.cents); balance and the
+    # amounts taken and recorded are dollars, converted at the edges.
+    def __init__(self, account_number, pin, balance=0, transaction_history=None, is_active=True):
+        self.account_number = account_number
+        self.pin = pin
+        self.cents = to_cents(balance)
+        if not isinstance(transaction_history, History):
+            transaction_history = History(account_number, transaction_history if transaction_history else [])
+        self.transaction_history = transaction_history
+        self.is_active = is_active
+        self.pin_attempts = 0
+        self.locked = False
+        self.recorder = None
+        self.dirty = False
+        self.lock = threading.RLock()
+    
+    @property
+    def balance(self):
+        return from_cents(self.cents)
+    
+    @balance.setter
+    def balance(self, amount):
+        self.cents = to_cents(amount)
+    
+    def _record(self, record):
+        # Postings are reported before they are applied, so a failed
+        # journal write leaves the balance untouched.
+        if self.recorder is not None:
+            self.recorder(record)
+        self.dirty = True
+    
+    def record_status(self):
+        self._record({
+            'op': 'status',
+            'account': self.account_number,
+            'pin_attempts': self.pin_attempts,
+            'locked': self.locked
+        })
+    
+    @METRICS.timed('deposit', amount_failure)
+    def deposit(self, amount):
+        cents = amount_cents(amount)
+        with self.lock:
+            if cents is not None and cents > 0 and self.is_active and not self.locked:
+                transaction = {
+                    'type': 'deposit',
+                    'amount': from_cents(cents),
+                    'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    'balance_after': from_cents(self.cents + cents),
+                    'to_account': self.account_number
+                }
+                self._record({'op': 'deposit', 'postings': [[self.account_number, transaction]]})
+                self.cents += cents
+                self.transaction_history.append(transaction)
+                return True, "Deposit successful"
+            return False, "Invalid deposit amount or account locked/inactive"
+    
+    @METRICS.timed('withdraw', amount_failure)
+    def withdraw(self, amount):
+        cents = amount_cents(amount)
+        with self.lock:
+            if self.locked:
+                return False, "Account is locked. Please contact admin."
+            if not self.is_active:
+                return False, "Account is inactive."
+            if cents is not None and 0 < cents <= self.cents:
+                transaction = {
+                    'type': 'withdrawal',
+                    'amount': from_cents(cents),
+                    'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    'balance_after': from_cents(self.cents - cents),
+                    'from_account': self.account_number
+                }
+                self._record({'op': 'withdrawal', 'postings': [[self.account_number, transaction]]})
+                self.cents -= cents
+                self.transaction_history.append(transaction)
+                return True, "Withdrawal successful"
+            return False, "Invalid withdrawal amount or insufficient funds"
+    
+    @METRICS.timed('transfer', amount_failure)
+    def transfer(self, amount, recipient_account):
+        if recipient_account is self:
+            return False, "Cannot transfer to yourself"
+        # Both locks are always taken in account-number order, so two
+        # transfers in opposite directions cannot deadlock
+        first, second = sorted((self, recipient_account), key=lambda account: account.account_number)
+        with first.lock, second.lock:
+            return self._transfer(amount, recipient_account)
+    
+    def _transfer(self, amount, recipient_account):
+        if self.locked:
+            return False, "Account is locked. Please contact admin."
+        if not self.is_active:
+            return False, "Account is inactive."
+        if not recipient_account.is_active:
+            return False, "Recipient account is closed."
+        cents = amount_cents(amount)
+        if cents is not None and 0 < cents <= self.cents:
+            # Both sides carry the same date, so they can be matched up
+            date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            
+            # Create transaction for sender
+            sender_transaction = {
+                'type': 'transfer_out',
+                'amount': from_cents(cents),
+                'date': date,
+                'balance_after': from_cents(self.cents - cents),
+                'from_account': self.account_number,
+                'to_account': recipient_account.account_number
+            }
+            
+            # Create transaction for recipient
+            recipient_transaction = {
+                'type': 'transfer_in',
+                'amount': from_cents(cents),
+                'date': date,
+                'balance_after': from_cents(recipient_account.cents + cents),
+                'from_account': self.account_number,
+                'to_account': recipient_account.account_number
+            }
+            
+            # Both sides go into one record so a crash can never persist half a transfer
+            self._record({'op': 'transfer', 'postings': [
+                [self.account_number, sender_transaction],
+                [recipient_account.account_number, recipient_transaction]
+            ]})
+            self.cents -= cents
+            self.transaction_history.append(sender_transaction)
+            recipient_account.cents += cents
+            recipient_account.transaction_history.append(recipient_transaction)
+            recipient_account.dirty = True
+            
+            return True, "Transfer successful"
+        return False, "Invalid transfer amount or insufficient funds"
+    
+    def get_balance(self):
+        return self.balance if not self.locked and self.is_active else 0
+    
+    def get_transaction_history(self):
+        return self.transaction_history if not self.locked else []
+    
+    # History reads hold the account lock, so a save moving transactions
+    # from memory to storage (History.persisted) cannot happen halfway
+    def get_transaction_page(self, cursor=None, limit=10):
+        # Newest first; pass the returned cursor back to get the next page
+        with self.lock:
+            if self.locked:
+                return [], None
+            return self.transaction_history.page(cursor, limit)
+    
+    def get_transactions_between(self, start, end, types=None):
+        # Oldest first, start <= date < end; the history is in date order, so
+        # this is a bisect plus the matching transactions, not a full scan
+        with self.lock:
+            if self.locked:
+                return []
+            return self.transaction_history.between(datetime_timestamp(start), datetime_timestamp(end), types)
+    
+    def get_statement(self, year, month):
+        if self.locked:
+            return None
+        return self.statement(year, month)
+    
+    def statement(self, year, month):
+        # The month's statement whether or not the account is locked, for
+        # the bank's own use (end-of-day runs)
+        start = datetime.datetime(year, month, 1)
+        end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+        with self.lock:
+            transactions = self.transaction_history.between(datetime_timestamp(start), datetime_timestamp(end))
+            previous = self.transaction_history.last_before(datetime_timestamp(start))
+        opening = previous['balance_after'] if previous else 0
+        totals = {name: 0 for name in TYPES}
+        for t in transactions:
+            if t['type'] in totals:
+                totals[t['type']] += to_cents(t['amount'])
+        return {
+            'account_number': self.account_number,
+            'period': f"{year:04d}-{month:02d}",
+            'opening_balance': opening,
+            'closing_balance': transactions[-1]['balance_after'] if transactions else opening,
+            'totals': {name: from_cents(cents) for name, cents in totals.items()},
+            'transactions': transactions
+        }
+    
+    def change_pin(self, old_pin, new_pin):
+        with self.lock:
+            if self.locked:
+                return False, "Account is locked. Please contact admin."
+            if old_pin == self.pin:
+                if len(new_pin) == 4 and new_pin.isdigit():
+                    self._record({'op': 'pin', 'account': self.account_number, 'pin': new_pin})
+                    self.pin = new_pin
+                    self.pin_attempts = 0
+                    return True, "PIN changed successfully"
+                return False, "PIN must be 4 digits"
+            self.pin_attempts += 1
+            if self.pin_attempts >= 3:
+                self.locked = True
+                self.record_status()
+                return False, "Too many incorrect attempts. Account locked."
+            self.record_status()
+            return False, "Incorrect current PIN"
+    
+    def generate_receipt(self, transaction_type, amount, other_account=None):
+        receipt = f"""
+        {'='*40}
+        ATM TRANSACTION RECEIPT
+        {'='*40}
+        Date: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        Account: {self.account_number}
+        Transaction Type: {transaction_type.upper()}
+        Amount: ${amount:.2f}
+        """
+        
+        if other_account:
+            if transaction_type == 'transfer_out':
+                receipt += f"Recipient Account: {other_account}\n"
+            elif transaction_type == 'transfer_in':
+                receipt += f"Sender Account: {other_account}\n"
+        
+        receipt += f"""
+        Available Balance: ${format_amount(self.cents)}
+        {'='*40}
+        Thank you for banking with us!
+        """
+        return receipt
+
+class Session:
+    # One logged-in customer (account) or admin (username). The ATM keeps no
+    # per-user state, so any number of sessions can use it at once.
+    def __init__(self, account=None, admin=None):
+        self.account = account
+        self.admin = admin
+
+class AccountTable(dict):
+    # ATM.accounts for lazy storages: holds the accounts used so far and
+    # reads any other from storage the first time it is asked for, so
+    # startup costs nothing per account. Iterating lists every account but
+    # only loads those whose values are asked for.
+    def __init__(self, storage, load):
+        super().__init__()
+        self.storage = storage
+        self.load = load
+        self.lock = threading.Lock()
+    
+    def __missing__(self, acc_num):
+        acc_data = self.storage.lookup(acc_num)
+        if acc_data is None:
+            raise KeyError(acc_num)
+        with self.lock:
+            # Another thread may have loaded it meanwhile
+            if dict.__contains__(self, acc_num):
+                return dict.__getitem__(self, acc_num)
+            account = self.load(acc_num, acc_data)
+            dict.__setitem__(self, acc_num, account)
+            return account
+    
+    def get(self, acc_num, default=None):
+        try:
+            return self[acc_num]
+        except KeyError:
+            return default
+    
+    def __contains__(self, acc_num):
+        return self.get(acc_num) is not None
+    
+    def __iter__(self):
+        loaded = list(dict.keys(self))
+        seen = set(loaded)
+        return iter(loaded + [acc_num for acc_num in self.storage.account_numbers() if acc_num not in seen])
+    
+    def __len__(self):
+        return len(list(iter(self)))
+    
+    def keys(self):
+        return list(iter(self))
+    
+    def values(self):
+        return [account for account in map(self.get, self) if account is not None]
+    
+    def items(self):
+        return [(account.account_number, account) for account in self.values()]
+
+class ATM:
+    # Locking: an operation takes the locks of the accounts it touches, in
+    # account-number order, and then self.lock, which guards the storage,
+    # self.changed, self.index and adding/removing entries of self.accounts.
+    # Nothing takes an account lock while holding self.lock. Building the
+    # search index takes self.index_lock before any of those.
+    def __init__(self, storage=None, allocator=None, archive=None, aggregates=None, accounts=None):
+        self.accounts = {}
+        self.admin_users = {'admin': 'admin123'}  # In real system, use secure hashing
+        self.storage = storage if storage is not None else JsonStorage()
+        self.changed = set()  # accounts modified or closed since the last save
+        self.lock = threading.RLock()
+        self.index_lock = threading.Lock()
+        self.index = None  # AccountIndex, built on the first search
+        self.index_pending = None  # records logged while it is being built
+        self.recount_lock = threading.Lock()
+        self.recount = None  # Recount, while the aggregates are being counted
+        if archive is None and self.storage.sidecar_path('archive') is not None:
+            archive = Archive(self.storage.sidecar_path('archive'))
+        self.archive = archive
+        # Given aggregates are used as they are and never handed to storage:
+        # readers that never record anything (the end-of-day workers) pass
+        # empty ones, so they do not read the stored ones
+        self.given_aggregates = aggregates
+        # (first, last) opens only the accounts numbered first..last, through
+        # storage.load_range(), for readers of one range of a ranged storage
+        self.account_range = accounts
+        self.load_accounts()
+        if allocator is None:
+            allocator = AccountNumberAllocator(self.storage.sidecar_path('allocator.json'))
+        self.allocator = allocator
+    
+    @METRICS.timed('load')
+    def load_accounts(self):
+        if self.account_range is not None:
+            for acc_num, acc_data in self.storage.load_range(*self.account_range).items():
+                self.accounts[acc_num] = self._load_account(acc_num, acc_data)
+            self.aggregates = self.given_aggregates
+            return
+        if self.storage.lazy:
+            self.accounts = AccountTable(self.storage, self._load_account)
+        for acc_num, acc_data in self.storage.load().items():
+            self.accounts[acc_num] = self._load_account(acc_num, acc_data)
+        # Unknown (None) if storage did not keep them; dashboard() counts them
+        aggregates = self.given_aggregates
+        if aggregates is None:
+            aggregates = self.storage.aggregates()
+        for record in self.storage.replay():
+            self.apply_record(record)
+            if aggregates is not None and self.given_aggregates is None:
+                aggregates.apply(record)
+        self.aggregates = aggregates
+    
+    def new_account(self, acc_num, pin, balance=0, transactions=None, reader=None, stored=0, archived=0,
+                    is_active=True):
+        # Every account is built here, so its history always reads through
+        # to self.archive and its postings always reach self.record
+        history = History(acc_num, transactions, reader, stored, self.archive, archived)
+        account = BankAccount(acc_num, pin, balance, history, is_active)
+        account.recorder = self.record
+        return account
+    
+    def _load_account(self, acc_num, acc_data):
+        # Stored history stays in storage; only its length is kept in memory
+        reader = self.storage.history_reader(acc_num, acc_data)
+        if reader is not None:
+            transactions, stored = None, acc_data['history_count']
+        else:
+            transactions, stored = acc_data.get('transaction_history', []), 0
+        account = self.new_account(acc_num, acc_data['pin'], acc_data['balance'], transactions, reader, stored,
+                                   acc_data.get('history_archived', 0), acc_data.get('is_active', True))
+        account.pin_attempts = acc_data.get('pin_attempts', 0)
+        account.locked = acc_data.get('locked', False)
+        return account
+    
+    def apply_record(self, record):
+        op = record['op']
+        if op == 'import':
+            for acc_num, pin in record['accounts']:
+                self.accounts[acc_num] = self.new_account(acc_num, pin)
+        if op in ('deposit', 'withdrawal', 'transfer', 'batch', 'import'):
+            for acc_num, transaction in record['postings']:
+                account = self.accounts[acc_num]
+                account.balance = transaction['balance_after']
+                account.transaction_history.append(transaction)
+        elif op == 'open':
+            self.accounts[record['account']] = self.new_account(record['account'], record['pin'], record['balance'])
+        elif op == 'pin':
+            account = self.accounts[record['account']]
+            account.pin = record['pin']
+            account.pin_attempts = 0
+        elif op == 'status':
+            account = self.accounts[record['account']]
+            account.pin_attempts = record['pin_attempts']
+            account.locked = record['locked']
+        elif op == 'archive':
+            for acc_num, count in record['accounts']:
+                self.accounts[acc_num].transaction_history.move_to_archive(count)
+        elif op == 'close':
+            del self.accounts[record['account']]
+    
+    def record(self, record):
+        with self.lock:
+            commit = self.storage.append(record)
+            if self.aggregates is not None:
+                self.aggregates.apply(record)
+            elif self.recount is not None:
+                self.recount.apply(record)
+            if self.index is not None:
+                self.index.apply(record)
+            elif self.index_pending is not None:
+                self.index_pending.append(record)
+            if 'postings' in record:
+                self.changed.update(acc_num for acc_num, transaction in record['postings'])
+            if 'accounts' in record:
+                self.changed.update(acc_num for acc_num, pin in record['accounts'])
+            if 'account' in record:
+                self.changed.add(record['account'])
+        # Group commit: wait for the record to be durable without holding
+        # self.lock, so other operations can join the same write
+        if commit is not None:
+            commit.wait()
+    
+    def checkpoint(self, wait=False):
+        with self.lock:
+            self.storage.checkpoint(wait)
+    
+    def close(self):
+        with self.lock:
+            self.storage.close()
+    
+    def _settled(self):
+        # With self.lock held: storage holds everything recorded, so the
+        # aggregates can be kept with it
+        if not self.changed and self.aggregates is not None and self.given_aggregates is None:
+            self.storage.settled(self.aggregates)
+    
+    @METRICS.timed('save')
+    def save_accounts(self):
+        # Holding the changed accounts' locks means none of them is written
+        # halfway through an operation. Accounts changed meanwhile stay in
+        # self.changed for the next save. Afterwards the transactions storage
+        # now holds are dropped from memory.
+        with self.lock:
+            changed = set(self.changed)
+            if not self.storage.reads_accounts:
+                self.storage.save(self.accounts, changed)
+                self.changed = set()
+                for acc_num in changed:
+                    if acc_num in self.accounts:
+                        self.accounts[acc_num].dirty = False
+                self._settled()
+                saved = self.storage.saved_histories(changed)
+        if not self.storage.reads_accounts:
+            for acc_num, info in saved.items():
+                account = self.accounts.get(acc_num)
+                if account is not None:
+                    with account.lock:
+                        self._persisted(account, info)
+            return
+        with contextlib.ExitStack() as stack:
+            for acc_num in sorted(changed):
+                account = self.accounts.get(acc_num)
+                if account is not None:
+                    stack.enter_context(account.lock)
+            with self.lock:
+                self.storage.save(self.accounts, changed)
+                for acc_num in changed:
+                    if acc_num in self.accounts:
+                        self.accounts[acc_num].dirty = False
+                self.changed -= changed
+                self._settled()
+                for acc_num, info in self.storage.saved_histories(changed).items():
+                    account = self.accounts.get(acc_num)
+                    if account is not None:
+                        self._persisted(account, info)
+    
+    def _persisted(self, account, info):
+        saved = self.storage.saved_history(account.account_number, account.transaction_history, info)
+        if saved is not None:
+            account.transaction_history.persisted(*saved)
+    
+    @METRICS.timed('authenticate')
+    def authenticate(self, account_number, pin):
+        # Returns (Session, message) on success and (None, message) otherwise
+        account = self.accounts.get(account_number)
+        if account is None:
+            return None, "Invalid account number or account is locked"
+        with account.lock:
+            if account.locked:
+                return None, "Invalid account number or account is locked"
+            if account.pin == pin:
+                if account.pin_attempts:
+                    account.pin_attempts = 0
+                    account.record_status()
+                return Session(account=account), "Authentication successful"
+            account.pin_attempts += 1
+            if account.pin_attempts >= 3:
+                account.locked = True
+            account.record_status()
+            remaining = 3 - account.pin_attempts
+        if remaining <= 0:
+            self.save_accounts()
+            return None, "Too many incorrect attempts. Account locked."
+        return None, f"Incorrect PIN. {remaining} attempts remaining"
+    
+    def authenticate_admin(self, username, password):
+        if username in self.admin_users and self.admin_users[username] == password:
+            return Session(admin=username)
+        return None
+    
+    def get_account(self, account_number):
+        return self.accounts.get(account_number)
+    
+    def account_info(self, account_number):
+        account = self.accounts.get(account_number)
+        if account is None:
+            return None
+        return {
+            'account_number': account_number,
+            'balance': account.balance,
+            'is_active': account.is_active,
+            'locked': account.locked,
+            'pin_attempts': account.pin_attempts,
+            'transaction_count': len(account.transaction_history)
+        }
+    
+    def dashboard(self, days=7):
+        aggregates = self.aggregates
+        if aggregates is None:
+            aggregates = self.count_aggregates()
+        return aggregates.summary(datetime.date.today(), days)
+    
+    def count_aggregates(self):
+        # When storage did not keep them: counted from the accounts, each
+        # under its own lock while operations go on (see Recount), once
+        with self.recount_lock:
+            with self.lock:
+                if self.aggregates is not None:
+                    return self.aggregates
+                self.recount = Recount(self.accounts)
+            for acc_num in sorted(self.recount.waiting):
+                account = self.accounts.get(acc_num)
+                if account is None:
+                    with self.lock:
+                        self.recount.add(acc_num, None)
+                    continue
+                with account.lock:
+                    counted = None
+                    if self.accounts.get(acc_num) is account:
+                        counted = Aggregates.count([account])
+                    with self.lock:
+                        self.recount.add(acc_num, counted)
+            with self.lock:
+                self.aggregates, self.recount = self.recount.aggregates, None
+                self._settled()
+                return self.aggregates
+    
+    def list_accounts(self):
+        return [self.account_info(acc_num) for acc_num in list(self.accounts)]
+    
+    def account_index(self):
+        # Built on the first search rather than at startup. The accounts
+        # already in memory are read under their own locks, so none is
+        # caught halfway through an operation, the rest from what storage
+        # saved; records logged meanwhile are applied on top, and from then
+        # on record() keeps the index current.
+        with self.index_lock:
+            if self.index is None:
+                with self.lock:
+                    self.index_pending = []
+                    loaded = list(dict.items(self.accounts))
+                index = AccountIndex()
+                for acc_num, account in loaded:
+                    with account.lock:
+                        index.add(acc_num, account.balance, account.locked)
+                if self.storage.lazy:
+                    seen = set(acc_num for acc_num, account in loaded)
+                    for acc_num, balance, locked in self.storage.account_summaries():
+                        if acc_num not in seen:
+                            index.add(acc_num, balance, locked)
+                index.finish()
+                with self.lock:
+                    for record in self.index_pending:
+                        index.apply(record)
+                    self.index_pending = None
+                    self.index = index
+            return self.index
+    
+    def query_accounts(self, prefix=None, locked=None, min_balance=None, max_balance=None, sort='number',
+                       descending=False, cursor=None, limit=20):
+        # One page of the accounts matching every filter given, through the
+        # secondary indexes: (account infos, cursor for the next page, or
+        # None after the last one)
+        index = self.account_index()
+        with self.lock:
+            numbers, cursor = index.query(prefix, locked, min_balance, max_balance, sort, descending,
+                                          cursor, limit)
+        return [info for info in map(self.account_info, numbers) if info is not None], cursor
+    
+    def generate_account_number(self):
+        # The allocator never repeats a number; only numbers given out
+        # randomly before it existed can be taken already, and each of those
+        # is skipped at most once
+        while True:
+            acc_num = self.allocator.allocate()
+            if acc_num not in self.accounts:
+                return acc_num
+    
+    def create_account(self, name, pin, initial_deposit=0):
+        # ValueError for a PIN that is not 4 digits or a deposit that is not
+        # an amount of zero or more, before anything is recorded
+        if not isinstance(pin, str) or len(pin) != 4 or not pin.isdigit():
+            raise ValueError("PIN must be 4 digits")
+        cents = amount_cents(initial_deposit)
+        if cents is None or cents < 0:
+            raise ValueError("Invalid deposit amount")
+        with self.lock:
+            account_number = self.generate_account_number()
+            # The initial deposit is posted as a deposit below, not opened
+            # with, so it is counted once and shows up in the history
+            self.record({'op': 'open', 'account': account_number, 'pin': pin, 'balance': 0})
+            account = self.new_account(account_number, pin)
+            self.accounts[account_number] = account
+        if cents > 0:
+            account.deposit(from_cents(cents))
+        try:
+            self.save_accounts()
+        except Exception:
+            # Closed again rather than left in self.changed, where it would
+            # make every later save fail the same way
+            with account.lock:
+                if account.cents:
+                    account.withdraw(account.balance)
+                with self.lock:
+                    if self.accounts.get(account_number) is account:
+                        self.record({'op': 'close', 'account': account_number})
+                        account.is_active = False
+                        del self.accounts[account_number]
+            raise
+        return account_number
+    
+    def import_accounts(self, rows, chunk=10000, on_created=None):
+        # Onboarding from another system: rows are dicts with 'pin' and
+        # 'balance' (and optionally 'line'), read lazily, so only `chunk` of
+        # them are held at a time. Each chunk gets its numbers in one
+        # allocator call and goes to storage as a single 'import' record that
+        # opens the accounts and posts their opening balances as deposits;
+        # the accounts are saved once at the end. on_created(row, number) is
+        # called for each account once its chunk is durable.
+        # Returns (number created, [(line, message), ...]).
+        created = 0
+        errors = []
+        pending = []
+        for number, row in enumerate(rows, 1):
+            pin = row.get('pin')
+            balance = row.get('balance')
+            if not isinstance(pin, str) or len(pin) != 4 or not pin.isdigit():
+                errors.append((row.get('line', number), "PIN must be 4 digits"))
+            elif not isinstance(balance, (int, float)) or isinstance(balance, bool) or not 0 <= balance < float('inf'):
+                errors.append((row.get('line', number), "Invalid opening balance"))
+            else:
+                pending.append(row)
+            if len(pending) == chunk:
+                created += self._import_chunk(pending, on_created)
+                pending = []
+        if pending:
+            created += self._import_chunk(pending, on_created)
+        self.save_accounts()
+        return created, errors
+    
+    def _import_chunk(self, rows, on_created):
+        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            numbers = [n for n in self.allocator.allocate_many(len(rows)) if n not in self.accounts]
+            while len(numbers) < len(rows):
+                numbers.append(self.generate_account_number())
+            opening = [from_cents(to_cents(row['balance'])) for row in rows]
+            postings = [[acc_num, {'type': 'deposit', 'amount': balance, 'date': date,
+                                   'balance_after': balance, 'to_account': acc_num}]
+                        for acc_num, balance in zip(numbers, opening) if balance > 0]
+            record = {'op': 'import', 'accounts': [[acc_num, row['pin']] for acc_num, row in zip(numbers, rows)],
+                      'postings': postings}
+            self.record(record)
+            self.apply_record(record)
+            for acc_num in numbers:
+                self.accounts[acc_num].dirty = True
+        if on_created is not None:
+            for acc_num, row in zip(numbers, rows):
+                on_created(row, acc_num)
+        return len(rows)
+    
+    def archive_history(self, before, chunk=1000):
+        # Moves the transactions dated before `before` (a datetime) out of
+        # the live histories into self.archive, `chunk` accounts at a time:
+        # their archive blocks are written first, then one 'archive' record
+        # per chunk drops them from storage. History reads go through to the
+        # archive, so nothing disappears from the history screens.
+        # Returns the number of transactions moved.
+        if self.archive is None:
+            raise RuntimeError("This storage has no place for an archive")
+        cutoff = datetime_timestamp(before)
+        numbers = sorted(self.accounts)
+        moved = 0
+        for first in range(0, len(numbers), chunk):
+            accounts = [account for account in map(self.accounts.get, numbers[first:first + chunk])
+                        if account is not None]
+            with contextlib.ExitStack() as stack:
+                for account in accounts:
+                    stack.enter_context(account.lock)
+                moves = []
+                for account in accounts:
+                    # Skip accounts closed while waiting for their lock
+                    if self.accounts.get(account.account_number) is not account:
+                        continue
+                    old = account.transaction_history.live_before(cutoff)
+                    if old:
+                        moves.append((account.account_number, account.transaction_history.archived, old))
+                if not moves:
+                    continue
+                self.archive.write(moves)
+                record = {'op': 'archive', 'accounts': [[acc_num, len(old)] for acc_num, position, old in moves]}
+                with self.lock:
+                    self.record(record)
+                    self.apply_record(record)
+                moved += sum(len(old) for acc_num, position, old in moves)
+        self.save_accounts()
+        return moved
+    
+    def close_account(self, account_number, admin_username):
+        account = self.accounts.get(account_number)
+        if account is None or admin_username not in self.admin_users:
+            return False, "Invalid account number or admin credentials"
+        with account.lock:
+            if self.accounts.get(account_number) is not account:
+                return False, "Invalid account number or admin credentials"
+            if account.cents != 0:
+                return False, "Cannot close account with non-zero balance"
+            with self.lock:
+                self.record({'op': 'close', 'account': account_number})
+                # Sessions still holding the account can no longer use it
+                account.is_active = False
+                del self.accounts[account_number]
+        self.save_accounts()
+        return True, "Account closed successfully"
+    
+    def unlock_account(self, account_number, admin_username):
+        account = self.accounts.get(account_number)
+        if account is None or admin_username not in self.admin_users:
+            return False, "Invalid account number or admin credentials"
+        with account.lock:
+            account.locked = False
+            account.pin_attempts = 0
+            account.record_status()
+        self.save_accounts()
+        return True, "Account unlocked successfully"
+    
+    def post_batch(self, postings, atomic=True, chunk=10000, date=None, bank_initiated=False):
+        # Deposits, withdrawals and transfers from a payroll or settlement
+        # file: dicts with 'type', 'account', 'amount', 'to' for transfers and
+        # optionally 'line'. Every posting is validated up front against the
+        # balances the earlier ones leave. An atomic batch posts nothing if
+        # any posting fails; otherwise failing postings are skipped. The
+        # postings go to storage as 'batch' records (one for an atomic batch,
+        # one per `chunk` otherwise) and are saved once at the end. All the
+        # transactions are dated `date` ("YYYY-MM-DD HH:MM:SS", now if None).
+        # bank_initiated postings (interest, fees) also go to accounts that
+        # are locked after wrong PINs, as the lock only stops the customer.
+        # Returns (number posted, [(line, message), ...]).
+        postings = list(postings)
+        numbers = set()
+        for posting in postings:
+            numbers.add(posting.get('account'))
+            numbers.add(posting.get('to'))
+        accounts = {acc_num: self.accounts[acc_num] for acc_num in numbers if acc_num in self.accounts}
+        date = date or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        entries = []
+        errors = []
+        with contextlib.ExitStack() as stack:
+            for acc_num in sorted(accounts):
+                stack.enter_context(accounts[acc_num].lock)
+            balances = {}  # account number -> cents after the postings so far
+            for number, posting in enumerate(postings, 1):
+                try:
+                    entries.append(self._batch_entries(posting, accounts, balances, date, bank_initiated))
+                except ValueError as e:
+                    errors.append((posting.get('line', number), str(e)))
+            if atomic and errors:
+                return 0, errors
+            size = len(entries) if atomic else chunk
+            for start in range(0, len(entries), max(size, 1)):
+                record = {'op': 'batch', 'postings': [p for pair in entries[start:start + size] for p in pair]}
+                self.record(record)
+                self.apply_record(record)
+                for acc_num, transaction in record['postings']:
+                    accounts[acc_num].dirty = True
+        self.save_accounts()
+        return len(entries), errors
+    
+    def _batch_entries(self, posting, accounts, balances, date, bank_initiated=False):
+        kind = posting.get('type')
+        cents = amount_cents(posting.get('amount'))
+        if cents is None or cents <= 0:
+            raise ValueError("Invalid amount")
+        amount = from_cents(cents)
+        account = accounts.get(posting.get('account'))
+        if account is None or not account.is_active:
+            raise ValueError("Account not found")
+        if account.locked and not bank_initiated:
+            raise ValueError("Account is locked")
+        acc_num = account.account_number
+        balance = balances.get(acc_num, account.cents)
+        if kind == 'deposit':
+            balances[acc_num] = balance + cents
+            return [[acc_num, {'type': 'deposit', 'amount': amount, 'date': date,
+                               'balance_after': from_cents(balance + cents), 'to_account': acc_num}]]
+        if kind not in ('withdrawal', 'transfer'):
+            raise ValueError(f"Unknown posting type: {kind}")
+        if balance < cents:
+            raise ValueError("Insufficient funds")
+        if kind == 'withdrawal':
+            balances[acc_num] = balance - cents
+            return [[acc_num, {'type': 'withdrawal', 'amount': amount, 'date': date,
+                               'balance_after': from_cents(balance - cents), 'from_account': acc_num}]]
+        recipient = accounts.get(posting.get('to'))
+        if recipient is None or not recipient.is_active:
+            raise ValueError("Recipient account not found")
+        if recipient is account:
+            raise ValueError("Cannot transfer to yourself")
+        to_num = recipient.account_number
+        recipient_balance = balances.get(to_num, recipient.cents)
+        balances[acc_num] = balance - cents
+        balances[to_num] = recipient_balance + cents
+        return [
+            [acc_num, {'type': 'transfer_out', 'amount': amount, 'date': date,
+                       'balance_after': from_cents(balance - cents), 'from_account': acc_num, 'to_account': to_num}],
+            [to_num, {'type': 'transfer_in', 'amount': amount, 'date': date,
+                      'balance_after': from_cents(recipient_balance + cents), 'from_account': acc_num,
+                      'to_account': to_num}]
+        ]
+
+def add_storage_arguments(parser):
+    parser.add_argument('--storage', choices=['json', 'journal', 'sqlite', 'sharded', 'binary'], default='json',
+                        help="json rewrites accounts.json, journal appends each change to a journal, "
+                             "sqlite keeps accounts and transactions in accounts.db, "
+                             "sharded writes only changed accounts to files under accounts.d, "
+                             "binary keeps fixed-size account records in accounts.bin and reads them on demand")
+    parser.add_argument('--checkpoint-every', type=int, default=10000,
+                        help="journal records between snapshots in journal mode")
+    parser.add_argument('--commit-window-ms', type=float, default=0,
+                        help="journal mode: gather records arriving within this many ms into one fsync "
+                             "(group commit); 0 syncs every record on its own")
+    parser.add_argument('--commit-batch', type=int, default=256,
+                        help="journal mode: write a group as soon as it has this many records")
+
+def make_storage(args):
+    if args.storage == 'journal':
+        return JournalStorage(checkpoint_every=args.checkpoint_every,
+                              commit_window=args.commit_window_ms / 1000, commit_batch=args.commit_batch)
+    elif args.storage == 'sqlite':
+        return SqliteStorage()
+    elif args.storage == 'sharded':
+        return ShardedStorage()
+    elif args.storage == 'binary':
+        return BinaryStorage()
+    return JsonStorage()
@@ -0,0 +1,37 @@
+import argparse
+import sys
+import time
+from bank import ATM, add_storage_arguments, make_storage
+from rowfile import read_rows
+
+def read_postings(path):
+    # CSV with a type,account,amount,to header, or JSON lines with the same
+    # keys (see rowfile.read_rows)
+    for posting in read_rows(path, 'amount'):
+        posting['to'] = posting.get('to') or None
+        yield posting
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post a batch of deposits, withdrawals and transfers")
+    parser.add_argument('file', help="CSV (type,account,amount,to) or .jsonl file")
+    add_storage_arguments(parser)
+    parser.add_argument('--per-line', action='store_true',
+                        help="post the valid lines and report the others instead of rejecting the whole batch")
+    parser.add_argument('--chunk', type=int, default=10000, help="postings per storage write with --per-line")
+    args = parser.parse_args()
+    atm_system = ATM(make_storage(args))
+    try:
+        start = time.perf_counter()
+        posted, errors = atm_system.post_batch(read_postings(args.file), atomic=not args.per_line,
+                                               chunk=args.chunk)
+        elapsed = time.perf_counter() - start
+    finally:
+        atm_system.close()
+    for line, message in errors:
+        print(f"line {line}: {message}", file=sys.stderr)
+    if errors and not args.per_line:
+        print(f"Batch rejected: {len(errors)} invalid line(s), nothing posted")
+    else:
+        print(f"Posted {posted} posting(s) in {elapsed:.2f}s ({posted / max(elapsed, 1e-9):.0f}/s), "
+              f"{len(errors)} rejected")
+    sys.exit(1 if errors else 0)
\ No newline at end of file
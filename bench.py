@@ -0,0 +1,1032 @@
+import argparse
+import datetime
+import functools
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from aggregates import Aggregates
+from allocator import AccountNumberAllocator
+from bank import ATM, BankAccount
+from batch import read_postings
+from benchutil import SUITE_STORAGES, latency_stats, suite_storage, synthetic_number
+from binstore import BinaryStorage, import_json
+from onboard import read_customers
+from history import Transactions
+from journal import JournalStorage
+from metrics import Metrics
+from storage import JsonStorage, ShardedStorage, SqliteStorage, account_path, compact_json, write_atomic
+
+def make_dataset(data_file, accounts, history):
+    # Legacy accounts.json with `history` deposits per account
+    date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    accounts_data = {}
+    for i in range(accounts):
+        acc_num = synthetic_number(i)
+        transactions = [{
+            'type': 'deposit',
+            'amount': 10,
+            'date': date,
+            'balance_after': 10 * (n + 1),
+            'to_account': acc_num
+        } for n in range(history)]
+        accounts_data[acc_num] = {
+            'pin': '1234',
+            'balance': 10 * history,
+            'transaction_history': transactions,
+            'is_active': True,
+            'pin_attempts': 0,
+            'locked': False
+        }
+    with open(data_file, 'w') as f:
+        json.dump(accounts_data, f)
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def bench_startup(args):
+    # Cold start of the legacy JSON file versus snapshot + journal tail and
+    # SQLite, for the same accounts with growing lifetime history.
+    print(f"{'accounts':>9} {'history':>8} {'json':>9} {'snapshot':>9} {'sqlite':>9}")
+    for history in args.history:
+        directory = tempfile.mkdtemp()
+        try:
+            data_file = os.path.join(directory, 'accounts.json')
+            make_dataset(data_file, args.accounts, history)
+            json_time, atm = timed(ATM, JsonStorage(data_file))
+            
+            atm = ATM(JournalStorage(data_file))
+            atm.checkpoint(wait=True)
+            numbers = list(atm.accounts)
+            for _ in range(args.tail):
+                atm.accounts[random.choice(numbers)].deposit(1)
+            atm.close()
+            snapshot_time, atm = timed(ATM, JournalStorage(data_file))
+            atm.close()
+            
+            db_file = os.path.join(directory, 'accounts.db')
+            ATM(SqliteStorage(db_file, data_file)).close()
+            sqlite_time, atm = timed(ATM, SqliteStorage(db_file))
+            atm.close()
+            print(f"{args.accounts:>9} {history:>8} {json_time:>8.3f}s {snapshot_time:>8.3f}s {sqlite_time:>8.3f}s")
+        finally:
+            shutil.rmtree(directory)
+
+def make_sharded_dataset(directory, accounts):
+    # Same layout ShardedStorage writes, minus the per-file fsync, so that
+    # seeding a million accounts does not take an hour
+    for i in range(accounts):
+        path = account_path(directory, synthetic_number(i), '.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(compact_json({
+                'pin': '1234',
+                'balance': 1000,
+                'is_active': True,
+                'pin_attempts': 0,
+                'locked': False,
+                'history_bytes': 0
+            }))
+
+def bench_save(args):
+    # Cost of one transfer + save_accounts() as the number of accounts grows.
+    # JsonStorage rewrites everything; ShardedStorage writes the two changed
+    # accounts only.
+    print(f"{'accounts':>9} {'json':>10} {'sharded':>10}")
+    for size in args.sizes:
+        directory = tempfile.mkdtemp()
+        try:
+            results = []
+            for name in ('json', 'sharded'):
+                if name == 'json':
+                    if size > args.json_max:
+                        results.append(None)
+                        continue
+                    atm = ATM(JsonStorage(os.path.join(directory, 'accounts.json')))
+                    for i in range(size):
+                        acc_num = synthetic_number(i)
+                        atm.accounts[acc_num] = atm.new_account(acc_num, '1234', 1000)
+                    atm.changed.update(atm.accounts)
+                    atm.save_accounts()
+                else:
+                    make_sharded_dataset(os.path.join(directory, 'accounts.d'), size)
+                    atm = ATM(ShardedStorage(os.path.join(directory, 'accounts.d'), None))
+                numbers = list(atm.accounts)
+                times = []
+                for _ in range(args.repeat):
+                    sender, recipient = random.sample(numbers, 2)
+                    start = time.perf_counter()
+                    atm.accounts[sender].transfer(1, atm.accounts[recipient])
+                    atm.save_accounts()
+                    times.append(time.perf_counter() - start)
+                results.append(statistics.median(times))
+            cells = ['-' if t is None else f"{t * 1000:.2f}ms" for t in results]
+            print(f"{size:>9} {cells[0]:>10} {cells[1]:>10}")
+        finally:
+            shutil.rmtree(directory)
+
+def bench_memory(args):
+    # Bytes held per transaction: the original list of dicts versus the
+    # column store, for transfers between two synthetic accounts.
+    own, other = synthetic_number(1), synthetic_number(2)
+    date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    transactions = [{
+        'type': 'transfer_out',
+        'amount': 12.5,
+        'date': date,
+        'balance_after': 1000000 - 12.5 * (n + 1),
+        'from_account': own,
+        'to_account': other
+    } for n in range(args.transactions)]
+    encoded = [json.dumps(t) for t in transactions]
+    del transactions
+    
+    print(f"{'transactions':>12} {'dicts':>12} {'columns':>12}")
+    results = []
+    for build in (lambda: [json.loads(t) for t in encoded],
+                  lambda: Transactions(own, (json.loads(t) for t in encoded))):
+        tracemalloc.start()
+        kept = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        results.append(size / args.transactions)
+    print(f"{args.transactions:>12} {results[0]:>10.1f} B {results[1]:>10.1f} B")
+
+def bench_stress(args):
+    # Threads doing random transfers over a small set of accounts (so they
+    # overlap constantly, in both directions) while another thread saves.
+    # The total balance must never change, in memory and after reloading, and
+    # each history must add up: every balance_after is the previous one plus
+    # or minus the amount, ending at the account's balance.
+    sys.setswitchinterval(1e-5)
+    directory = tempfile.mkdtemp()
+    try:
+        data_file = os.path.join(directory, 'accounts.json')
+        atm = ATM(JsonStorage(data_file))
+        for i in range(args.accounts):
+            acc_num = synthetic_number(i)
+            atm.accounts[acc_num] = atm.new_account(acc_num, '1234')
+            atm.accounts[acc_num].deposit(1000)
+        numbers = list(atm.accounts)
+        expected = 1000 * args.accounts
+        done = threading.Event()
+        
+        def transfers(seed):
+            rng = random.Random(seed)
+            for _ in range(args.transfers):
+                sender, recipient = rng.sample(numbers, 2)
+                atm.accounts[sender].transfer(rng.randint(1, 50), atm.accounts[recipient])
+        
+        def saves():
+            while not done.wait(0.05):
+                atm.save_accounts()
+        
+        workers = [threading.Thread(target=transfers, args=(seed,)) for seed in range(args.threads)]
+        saver = threading.Thread(target=saves)
+        start = time.perf_counter()
+        saver.start()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        done.set()
+        saver.join()
+        elapsed = time.perf_counter() - start
+        atm.save_accounts()
+        
+        total = sum(account.balance for account in atm.accounts.values())
+        consistent = True
+        for account in atm.accounts.values():
+            balance = 0
+            for t in account.transaction_history:
+                balance += t['amount'] if t['type'] in ('deposit', 'transfer_in') else -t['amount']
+                consistent = consistent and balance == t['balance_after']
+            consistent = consistent and balance == account.balance
+        reloaded = ATM(JsonStorage(data_file))
+        saved_total = sum(account.balance for account in reloaded.accounts.values())
+        print(f"{args.threads} threads x {args.transfers} transfers over {args.accounts} accounts "
+              f"in {elapsed:.2f}s ({args.threads * args.transfers / elapsed:.0f}/s)")
+        print(f"total {total} (expected {expected}), saved total {saved_total}, "
+              f"histories add up: {consistent}")
+        if total != expected or saved_total != expected or not consistent:
+            sys.exit("FAILED")
+    finally:
+        shutil.rmtree(directory)
+
+def bench_commit(args):
+    # Deposits per second from concurrent clients in journal mode, each
+    # followed by save_accounts() as the GUI and server do: one fsync per
+    # record versus group commit. Every acknowledged deposit must be there
+    # after reopening.
+    print(f"{'clients':>8} {'per-op':>10} {'group':>10}")
+    for clients in args.clients:
+        results = []
+        for window in (0, args.window_ms / 1000):
+            directory = tempfile.mkdtemp()
+            try:
+                data_file = os.path.join(directory, 'accounts.json')
+                atm = ATM(JournalStorage(data_file, 10**9, window, args.batch))
+                accounts = [atm.accounts[atm.create_account('bench', '1234')] for _ in range(clients)]
+                counts = [0] * clients
+                deadline = time.perf_counter() + args.seconds
+                
+                def client(i):
+                    while time.perf_counter() < deadline:
+                        accounts[i].deposit(1)
+                        atm.save_accounts()
+                        counts[i] += 1
+                
+                threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+                atm.close()
+                reopened = ATM(JournalStorage(data_file))
+                if sum(account.balance for account in reopened.accounts.values()) != sum(counts):
+                    sys.exit("FAILED: acknowledged deposits missing after reopen")
+                reopened.close()
+                results.append(sum(counts) / elapsed)
+            finally:
+                shutil.rmtree(directory)
+        print(f"{clients:>8} {results[0]:>8.0f}/s {results[1]:>8.0f}/s")
+
+def bench_batch(args):
+    # Postings per second for a payroll-style file: read, validate, post and
+    # persist, one storage write per chunk. Balances are large enough that
+    # every line is valid. First, files with a fraction of a cent on one line
+    # (CSV and JSON lines) must be rejected at that line, nothing posted.
+    directory = tempfile.mkdtemp()
+    try:
+        data_file = os.path.join(directory, 'accounts.json')
+        make_dataset(data_file, args.accounts, 1)
+        batch_file = os.path.join(directory, 'batch.csv')
+        rng = random.Random(1)
+        numbers = [synthetic_number(i) for i in range(args.accounts)]
+        sub_cent = {
+            os.path.join(directory, 'sub_cent.csv'):
+                f"type,account,amount,to\ndeposit,{numbers[0]},10.25,\ndeposit,{numbers[1]},10.005,\n",
+            os.path.join(directory, 'sub_cent.jsonl'):
+                json.dumps({'type': 'deposit', 'account': numbers[0], 'amount': "10.25"}) + "\n" +
+                json.dumps({'type': 'deposit', 'account': numbers[1], 'amount': 10.005}) + "\n"
+        }
+        for path, text in sub_cent.items():
+            with open(path, 'w') as f:
+                f.write(text)
+        with open(batch_file, 'w') as f:
+            f.write("type,account,amount,to\n")
+            for _ in range(args.lines):
+                kind = rng.choice(('deposit', 'deposit', 'withdrawal', 'transfer'))
+                sender, recipient = rng.sample(numbers, 2)
+                f.write(f"{kind},{sender},0.25,{recipient if kind == 'transfer' else ''}\n")
+        print(f"{'storage':>8} {'lines':>9} {'time':>8} {'postings/s':>11}")
+        for name in args.storage:
+            if name == 'journal':
+                atm = ATM(JournalStorage(data_file))
+            else:
+                atm = ATM(SqliteStorage(os.path.join(directory, 'accounts.db'), data_file))
+            for path, text in sub_cent.items():
+                posted, errors = atm.post_batch(read_postings(path))
+                line = 3 if path.endswith('.csv') else 2
+                if posted or errors != [(line, "Invalid amount")]:
+                    sys.exit(f"FAILED: {os.path.basename(path)} gave {posted} posted, errors {errors}")
+            elapsed, (posted, errors) = timed(atm.post_batch, read_postings(batch_file), False, args.chunk)
+            atm.close()
+            if errors or posted != args.lines:
+                sys.exit(f"FAILED: {len(errors)} errors")
+            print(f"{name:>8} {args.lines:>9} {elapsed:>7.2f}s {posted / elapsed:>11.0f}")
+    finally:
+        shutil.rmtree(directory)
+
+class RandomNumbers:
+    # The old generate_account_number(): a random number, retried by the
+    # ATM until it is unused
+    def __init__(self, digits):
+        self.digits = digits
+    
+    def allocate(self):
+        return f"{random.randrange(10 ** self.digits):0{self.digits}d}"
+
+def bench_allocate(args):
+    # create_account() latency (and the number-allocation part of it) as the
+    # account-number space fills up, random retry versus the Feistel
+    # allocator. A smaller digit space stands in for a nearly full 10^8.
+    size = 10 ** args.digits
+    print(f"{'occupancy':>9} {'random alloc':>13} {'random create':>14} {'feistel alloc':>14} {'feistel create':>15}")
+    for occupancy in args.occupancy:
+        filled = int(size * occupancy)
+        if size - filled < 2 * args.creates:
+            sys.exit(f"occupancy {occupancy} leaves too few free numbers for {args.creates} creates")
+        cells = []
+        for name in ('random', 'feistel'):
+            directory = tempfile.mkdtemp()
+            try:
+                data_file = os.path.join(directory, 'accounts.json')
+                if name == 'random':
+                    allocator = RandomNumbers(args.digits)
+                    taken = random.sample(range(size), filled)
+                else:
+                    allocator = AccountNumberAllocator(os.path.join(directory, 'allocator.json'), args.digits, args.block)
+                    taken = [allocator.allocate() for _ in range(filled)]
+                atm = ATM(JournalStorage(data_file), allocator)
+                # Occupied numbers only need to be present for the lookups
+                atm.accounts.update(dict.fromkeys(f"{n:0{args.digits}d}" if isinstance(n, int) else n for n in taken))
+                allocations = []
+                creates = []
+                for _ in range(args.creates):
+                    elapsed, acc_num = timed(atm.generate_account_number)
+                    atm.accounts[acc_num] = None
+                    allocations.append(elapsed)
+                    creates.append(timed(atm.create_account, 'bench', '1234')[0])
+                atm.close()
+                cells += [f"{statistics.mean(allocations) * 1e6:.1f}us", f"{statistics.median(creates) * 1000:.2f}ms"]
+            finally:
+                shutil.rmtree(directory)
+        print(f"{occupancy:>9} {cells[0]:>13} {cells[1]:>14} {cells[2]:>14} {cells[3]:>15}")
+
+def bench_onboard(args):
+    # Bulk import of a customer file versus create_account() one at a time,
+    # per storage backend. The one-at-a-time rate is measured on a sample
+    # and extrapolated.
+    directory = tempfile.mkdtemp()
+    try:
+        customer_file = os.path.join(directory, 'customers.csv')
+        with open(customer_file, 'w') as f:
+            f.write("reference,pin,balance\n")
+            for i in range(args.customers):
+                f.write(f"C{i},{i % 10000:04d},{i % 5000}.25\n")
+        print(f"{'storage':>8} {'customers':>10} {'import':>9} {'accounts/s':>11} {'one by one':>11}")
+        for name in args.storage:
+            sub = os.path.join(directory, name)
+            os.mkdir(sub)
+            data_file = os.path.join(sub, 'accounts.json')
+            if name == 'journal':
+                storage = lambda: JournalStorage(data_file)
+            elif name == 'sqlite':
+                storage = lambda: SqliteStorage(os.path.join(sub, 'accounts.db'), None)
+            else:
+                storage = lambda: ShardedStorage(os.path.join(sub, 'accounts.d'), None)
+            atm = ATM(storage())
+            elapsed, (created, errors) = timed(atm.import_accounts, read_customers(customer_file), args.chunk)
+            atm.close()
+            if errors or created != args.customers:
+                sys.exit(f"FAILED: {len(errors)} errors")
+            atm = ATM(storage())
+            if len(atm.accounts) != args.customers:
+                sys.exit("FAILED: accounts missing after reopen")
+            single, _ = timed(lambda: [atm.create_account('bench', '1234', 10) for _ in range(args.sample)])
+            atm.close()
+            one_by_one = single / args.sample * args.customers
+            print(f"{name:>8} {args.customers:>10} {elapsed:>8.1f}s {created / elapsed:>11.0f} {one_by_one:>10.0f}s")
+    finally:
+        shutil.rmtree(directory)
+
+def bench_binary(args):
+    # accounts.json versus the mmap'd binary account file: ATM() startup,
+    # then authenticate + get_balance for random accounts (the first use of
+    # an account is a lookup in the binary file), then deposit +
+    # save_accounts() (a whole-file rewrite versus one record).
+    print(f"{'accounts':>9} {'store':>7} {'startup':>9} {'lookup':>9} {'save':>9}")
+    for size in args.sizes:
+        directory = tempfile.mkdtemp()
+        try:
+            data_file = os.path.join(directory, 'accounts.json')
+            make_dataset(data_file, size, args.history)
+            bin_file = os.path.join(directory, 'accounts.bin')
+            convert_time, _ = timed(import_json, data_file, bin_file)
+            rng = random.Random(1)
+            sample = [synthetic_number(rng.randrange(size)) for _ in range(args.lookups)]
+            for name, storage in (('json', lambda: JsonStorage(data_file)),
+                                  ('binary', lambda: BinaryStorage(bin_file, None))):
+                if name == 'json' and size > args.json_max:
+                    continue
+                startup, atm = timed(ATM, storage())
+                start = time.perf_counter()
+                for acc_num in sample:
+                    session, message = atm.authenticate(acc_num, '1234')
+                    session.account.get_balance()
+                lookup = (time.perf_counter() - start) / len(sample)
+                start = time.perf_counter()
+                for acc_num in sample[:args.saves]:
+                    atm.accounts[acc_num].deposit(1)
+                    atm.save_accounts()
+                save = (time.perf_counter() - start) / min(args.saves, len(sample))
+                atm.close()
+                print(f"{size:>9} {name:>7} {startup:>8.3f}s {lookup * 1e6:>7.1f}us {save * 1e3:>7.2f}ms")
+            print(f"{'':>9} {'(json -> binary conversion ' + format(convert_time, '.2f') + 's)'}")
+        finally:
+            shutil.rmtree(directory)
+
+# ru_maxrss of a child started by fork+exec can include the parent's peak,
+# so the peak is read from /proc where there is one (in kB either way)
+IMPORT_PROBE = '''
+import resource, sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+seconds = time.perf_counter() - start
+try:
+    with open('/proc/self/status') as f:
+        peak = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+except OSError:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(seconds, peak, 'tkinter' in sys.modules)
+'''
+
+def bench_imports(args):
+    # Import time and peak RSS of a fresh interpreter importing the
+    # headless core versus the GUI, best of `repeat` runs each
+    print(f"{'imports':>16} {'time':>9} {'peak RSS':>10} {'tkinter':>8}")
+    for name, modules in (('python', []), ('bank', ['bank']), ('bank + server', ['bank', 'server']),
+                          ('gui', ['bank', 'gui'])):
+        runs = []
+        for _ in range(args.repeat):
+            output = subprocess.run([sys.executable, '-c', IMPORT_PROBE] + modules, capture_output=True,
+                                    text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            seconds, rss, tk_loaded = output.split()
+            runs.append((float(seconds), int(rss), tk_loaded == 'True'))
+        seconds, rss, tk_loaded = min(runs)
+        print(f"{name:>16} {seconds * 1e3:>7.1f}ms {rss / 1024:>8.1f}MB {'yes' if tk_loaded else 'no':>8}")
+
+def bench_metrics(args):
+    # Cost of the metrics wrapper: instrumented deposit and withdraw against
+    # the same methods unwrapped, and the wrapper around a function that
+    # does nothing. Each round runs both, in alternating order, on fresh
+    # accounts with the garbage collector off; the best round counts.
+    def per_call(function, *arguments):
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            function(*arguments)
+        return (time.perf_counter() - start) / args.calls
+    
+    noop = lambda: None
+    wrapped_noop = Metrics().timed('noop')(noop)
+    print(f"{'operation':>10} {'plain':>9} {'timed':>9} {'overhead':>9}")
+    for name in ('noop', 'deposit', 'withdraw'):
+        plain_time = timed_time = float('inf')
+        gc.disable()
+        try:
+            for round_ in range(args.repeat):
+                if name == 'noop':
+                    plain, timed_ = (noop,), (wrapped_noop,)
+                else:
+                    plain = (getattr(BankAccount, name).__wrapped__, BankAccount('00000001', '1234', 10 ** 9), 1)
+                    timed_ = (getattr(BankAccount('00000002', '1234', 10 ** 9), name), 1)
+                if round_ % 2:
+                    timed_time = min(timed_time, per_call(*timed_))
+                    plain_time = min(plain_time, per_call(*plain))
+                else:
+                    plain_time = min(plain_time, per_call(*plain))
+                    timed_time = min(timed_time, per_call(*timed_))
+        finally:
+            gc.enable()
+        print(f"{name:>10} {plain_time * 1e9:>7.0f}ns {timed_time * 1e9:>7.0f}ns {(timed_time - plain_time) * 1e9:>7.0f}ns")
+
+def bench_reconcile(args):
+    # The reconciliation checks over synthetic ledgers built directly as
+    # arrays (deposits and transfer pairs, consistent throughout), then
+    # Ledger.from_atm() on a dataset loaded by the ATM, from accounts.json
+    # and from SQLite (the bulk query), followed by the checks. NumPy is
+    # only needed for this benchmark.
+    import numpy as np
+    from reconcile import Ledger
+    rng = np.random.default_rng(args.seed)
+    numbers = np.arange(args.accounts, dtype=np.int64) * 7919 % 10**8
+    print(f"{'transactions':>12} {'build':>8} {'check':>8} {'rate':>12}")
+    for total in args.transactions:
+        pairs = total // 4
+        deposits = total - 2 * pairs
+        senders = rng.integers(0, args.accounts, pairs)
+        # Offset by 1 .. accounts-1, so never the sender
+        recipients = (senders + rng.integers(1, args.accounts, pairs)) % args.accounts
+        transferred = rng.integers(1, 10000, pairs)
+        owners = np.concatenate((rng.integers(0, args.accounts, deposits), senders, recipients))
+        types = np.concatenate((np.zeros(deposits, np.int8), np.full(pairs, 3, np.int8), np.full(pairs, 2, np.int8)))
+        amounts = np.concatenate((rng.integers(1, 100000, deposits), transferred, transferred))
+        counterparties = np.concatenate((np.full(deposits, -1), numbers[recipients], numbers[senders]))
+        order = np.argsort(owners, kind='stable')
+        owners, types, amounts, counterparties = owners[order], types[order], amounts[order], counterparties[order]
+        counts = np.bincount(owners, minlength=args.accounts)
+        running = np.cumsum(np.where(types == 0, 1, np.where(types == 2, 1, -1)) * amounts)
+        opening = np.concatenate(([0], running))[np.concatenate(([0], np.cumsum(counts)[:-1]))]
+        after = running - opening[owners]
+        balances = np.concatenate(([0], running))[np.cumsum(counts)] - opening
+        start = time.perf_counter()
+        ledger = Ledger(numbers, balances, counts, types, amounts, after, counterparties)
+        built = time.perf_counter()
+        report = ledger.reconcile()
+        checked = time.perf_counter()
+        if report['balance_mismatches'] or report['chain_breaks'] or report['unmatched_transfers']:
+            raise RuntimeError(f"Synthetic ledger did not reconcile: {report}")
+        print(f"{total:>12} {built - start:>7.2f}s {checked - built:>7.2f}s "
+              f"{total / (checked - start) / 1e6:>8.1f}M/s")
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, 'accounts.json')
+        make_dataset(data_file, args.load_accounts, args.load_history)
+        print(f"{'storage':>8} {'transactions':>12} {'load':>8} {'check':>8} {'rate':>12}")
+        for name in ('json', 'sqlite'):
+            if name == 'json':
+                atm = ATM(JsonStorage(data_file))
+            else:
+                atm = ATM(SqliteStorage(os.path.join(tmp, 'accounts.db'), data_file))
+            loaded, ledger = timed(Ledger.from_atm, atm)
+            checked, report = timed(ledger.reconcile)
+            atm.close()
+            if report['balance_mismatches'] or report['chain_breaks'] or report['irregular']:
+                raise RuntimeError(f"Dataset did not reconcile: {report}")
+            print(f"{name:>8} {len(ledger.types):>12} {loaded:>7.2f}s {checked:>7.2f}s "
+                  f"{len(ledger.types) / (loaded + checked) / 1e6:>8.1f}M/s")
+
+def history_views(atm, numbers, month):
+    # Each account's history as paged newest first, as filtered by date and
+    # as listed on the month's statement, all oldest first
+    views = {}
+    for acc_num in numbers:
+        account = atm.accounts[acc_num]
+        paged, cursor = account.get_transaction_page(None, 3)
+        while cursor is not None:
+            page, cursor = account.get_transaction_page(cursor, 3)
+            paged += page
+        between = account.get_transactions_between(datetime.datetime(2000, 1, 1), datetime.datetime(2100, 1, 1))
+        views[acc_num] = (paged[::-1], between, account.statement(month.year, month.month)['transactions'])
+    return views
+
+def bench_archive(args):
+    # Accounts created in this process (one opened, some imported) have
+    # their history archived and read back at once, then after a restart:
+    # pages, date filters and statements must still show every transaction.
+    # Fails if any view differs from the history as it was written.
+    failed = False
+    for name in args.storage:
+        directory = tempfile.mkdtemp()
+        try:
+            source = os.path.join(directory, 'source.json')
+            with open(source, 'w') as f:
+                json.dump({}, f)
+            atm = ATM(suite_storage(name, directory, source))
+            numbers = [atm.create_account('', '1234', 100)]
+            atm.import_accounts([{'pin': '1234', 'balance': 50} for _ in range(args.imported)],
+                                on_created=lambda row, acc_num: numbers.append(acc_num))
+            for acc_num in numbers:
+                for amount in range(1, args.transactions):
+                    atm.accounts[acc_num].deposit(amount)
+            atm.save_accounts()
+            expected = {acc_num: list(atm.accounts[acc_num].transaction_history) for acc_num in numbers}
+            month = datetime.datetime.now()
+            moved = atm.archive_history(month + datetime.timedelta(seconds=1))
+            for acc_num in numbers:
+                atm.accounts[acc_num].deposit(1)
+                expected[acc_num].append(atm.accounts[acc_num].transaction_history[-1])
+            atm.save_accounts()
+            start = time.perf_counter()
+            views = history_views(atm, numbers, month)
+            elapsed = time.perf_counter() - start
+            atm.close()
+            atm = ATM(suite_storage(name, directory, source))
+            restarted = history_views(atm, numbers, month)
+            atm.close()
+            wrong = [acc_num for acc_num in numbers
+                     if any(view != expected[acc_num] for view in views[acc_num] + restarted[acc_num])]
+            print(f"{name:>8}: {moved} of {sum(map(len, expected.values()))} transactions archived, "
+                  f"read back in {elapsed * 1e3:.1f}ms; {len(wrong)} account(s) wrong")
+            failed = failed or bool(wrong) or moved != sum(map(len, expected.values())) - len(numbers)
+        finally:
+            shutil.rmtree(directory)
+    if failed:
+        sys.exit("FAILED")
+
+def bench_crash(args):
+    # Per backend, a process (crash-run) saves after every operation and is
+    # killed before close(). The next start must find the dashboard
+    # aggregates without counting the accounts, taking about as long as a
+    # start after a clean close, and they must equal a count from scratch
+    # (made after the timing). Fails otherwise.
+    failed = False
+    directory = tempfile.mkdtemp()
+    try:
+        source = os.path.join(directory, 'accounts.json')
+        make_dataset(source, args.accounts, args.history)
+        print(f"{'storage':>8} {'after crash':>12} {'after close':>12} {'known':>6} {'equal':>6}")
+        for name in args.storage:
+            storage_dir = os.path.join(directory, name)
+            os.makedirs(storage_dir)
+            # The first start imports the dataset; the dashboard counts the
+            # aggregates where nothing has kept them yet (accounts.json)
+            atm = ATM(suite_storage(name, storage_dir, source))
+            atm.dashboard()
+            atm.close()
+            run = subprocess.run([sys.executable, os.path.abspath(__file__), 'crash-run', '--storage', name,
+                                  '--directory', storage_dir, '--source', source, '--ops', str(args.ops)])
+            if run.returncode != -signal.SIGKILL:
+                raise RuntimeError(f"crash-run for {name} exited with {run.returncode}")
+            crashed, atm = timed(ATM, suite_storage(name, storage_dir, source))
+            known = atm.aggregates is not None
+            today = datetime.date.today()
+            equal = atm.dashboard() == Aggregates.count(atm.accounts.values()).summary(today)
+            atm.close()
+            clean, atm = timed(ATM, suite_storage(name, storage_dir, source))
+            atm.close()
+            print(f"{name:>8} {crashed:>11.3f}s {clean:>11.3f}s {str(known):>6} {str(equal):>6}")
+            failed = failed or not known or not equal or crashed > 2 * clean + 0.05
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        sys.exit("FAILED")
+
+def bench_crash_run(args):
+    # Deposits and transfers on the first accounts, each saved, with a
+    # checkpoint halfway; then an account locked, one opened and closed and
+    # one opened with a deposit, and the process kills itself
+    atm = ATM(suite_storage(args.storage, args.directory, args.source))
+    numbers = sorted(atm.accounts)[:args.ops]
+    for i, acc_num in enumerate(numbers):
+        atm.accounts[acc_num].deposit(5)
+        atm.save_accounts()
+        atm.accounts[acc_num].transfer(2, atm.accounts[numbers[i - 1]])
+        atm.save_accounts()
+        if i == len(numbers) // 2:
+            atm.checkpoint(wait=True)
+    for _ in range(3):
+        atm.authenticate(numbers[0], '0000')
+    atm.close_account(atm.create_account('', '1234'), 'admin')
+    atm.create_account('', '1234', 10)
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def bench_eod(args):
+    # Phase 1 of the end-of-day run (interest, fees and statements per
+    # shard) for each worker count, against the JSON file and the SQLite
+    # database and binary file made from it. Every JSON worker loads the
+    # whole file, so its parse is paid once per worker; SQLite and binary
+    # workers read only their shards' accounts (a range query, a slice of
+    # the index). Every account must be processed exactly once. The merge
+    # is timed once per store (JSON rewrites its whole file for each shard
+    # merged); afterwards every history must still be in time order, and a
+    # new run for the day before must be refused. Then a second run is
+    # merged by a process killed between posting a shard and marking it
+    # merged (eod-crash-run), with one account locked by PIN attempts, and
+    # merged again: every account must have its postings exactly once.
+    from eod import check_date, merge, read_postings, run_shards, shard_prefix
+    print(f"{'store':>7} {'workers':>8} {'shards':>7} {'compute':>9} {'accounts/s':>11}")
+    directory = tempfile.mkdtemp()
+    try:
+        data_file = os.path.join(directory, 'accounts.json')
+        make_dataset(data_file, args.accounts, args.history)
+        bin_file = os.path.join(directory, 'accounts.bin')
+        import_json(data_file, bin_file)
+        db_file = os.path.join(directory, 'accounts.db')
+        ATM(SqliteStorage(db_file, data_file)).close()
+        for name, path in (('json', data_file), ('sqlite', db_file), ('binary', bin_file)):
+            storage = functools.partial(EOD_STORAGES[name], path)
+            for workers in args.workers:
+                params = {'date': datetime.date.today().isoformat(), 'rate': 0.02, 'fee': 500,
+                          'fee_below': 100000, 'month_end': True, 'shards': args.shards_per_worker * workers}
+                run_dir = os.path.join(directory, f"{name}-{workers}")
+                os.makedirs(run_dir)
+                elapsed, (summaries, failures) = timed(run_shards, storage, params, run_dir, workers)
+                if failures:
+                    raise RuntimeError(f"Shards failed: {failures}")
+                accounts = sum(summary['accounts'] for summary in summaries)
+                if accounts != args.accounts:
+                    raise RuntimeError(f"{accounts} accounts processed, not {args.accounts}")
+                print(f"{name:>7} {workers:>8} {params['shards']:>7} {elapsed:>8.2f}s {accounts / elapsed:>11.0f}")
+            atm = ATM(storage())
+            elapsed, (posted, errors) = timed(merge, atm, run_dir, params)
+            unordered = [account.account_number for account in atm.accounts.values()
+                         if [t['date'] for t in account.transaction_history] !=
+                         sorted(t['date'] for t in account.transaction_history)]
+            yesterday = dict(params, date=(datetime.date.today() - datetime.timedelta(days=1)).isoformat())
+            try:
+                check_date(atm, yesterday)
+                refused = False
+            except ValueError:
+                refused = True
+            atm.close()
+            if unordered or not refused:
+                raise RuntimeError(f"{len(unordered)} histories out of time order, backdated run refused: {refused}")
+            print(f"{name:>7} merge: {posted} postings in {elapsed:.2f}s")
+            run_dir = os.path.join(directory, f"{name}-restart")
+            os.makedirs(run_dir)
+            write_atomic(os.path.join(run_dir, 'run.json'), json.dumps(params))
+            summaries, failures = run_shards(storage, params, run_dir, 1)
+            expected = {}
+            for shard in range(params['shards']):
+                for posting in read_postings(shard_prefix(run_dir, shard) + '.postings.jsonl'):
+                    expected[posting['account']] = expected.get(posting['account'], 0) + 1
+            atm = ATM(storage())
+            locked = max(expected)
+            for _ in range(3):
+                atm.authenticate(locked, '0000' if atm.accounts[locked].pin != '0000' else '1111')
+            before = {acc_num: len(atm.accounts[acc_num].transaction_history) for acc_num in expected}
+            atm.close()
+            run = subprocess.run([sys.executable, os.path.abspath(__file__), 'eod-crash-run', '--storage', name,
+                                  '--path', path, '--run-dir', run_dir])
+            if run.returncode != -signal.SIGKILL:
+                raise RuntimeError(f"eod-crash-run for {name} exited with {run.returncode}")
+            atm = ATM(storage())
+            posted, errors = merge(atm, run_dir, params)
+            wrong = [acc_num for acc_num, count in expected.items()
+                     if len(atm.accounts[acc_num].transaction_history) - before[acc_num] != count]
+            still_locked = atm.accounts[locked].locked
+            atm.close()
+            if wrong or errors or not still_locked:
+                raise RuntimeError(f"Restarted merge: {len(wrong)} accounts with postings missing or doubled, "
+                                   f"errors {errors[:3]}, locked account still locked: {still_locked}")
+            print(f"{name:>7} restart: {sum(expected.values())} postings, each applied once")
+    finally:
+        shutil.rmtree(directory)
+
+def bench_eod_crash_run(args):
+    # Merges the run in args.run_dir and is killed as soon as the first
+    # shard with postings is posted, before it is marked merged (run by eod)
+    import eod
+    write_atomic = eod.write_atomic
+    
+    def crash(path, data):
+        if path.endswith('.merged') and json.loads(data)['posted']:
+            os.kill(os.getpid(), signal.SIGKILL)
+        write_atomic(path, data)
+    
+    eod.write_atomic = crash
+    with open(os.path.join(args.run_dir, 'run.json'), 'r') as f:
+        params = json.load(f)
+    eod.merge(ATM(EOD_STORAGES[args.storage](args.path)), args.run_dir, params)
+
+# Partials rather than lambdas, as the worker processes are handed them
+EOD_STORAGES = {
+    'json': JsonStorage,
+    'sqlite': functools.partial(SqliteStorage, import_file=None),
+    'binary': functools.partial(BinaryStorage, import_file=None)
+}
+
+def peak_rss():
+    # In kB; VmHWM starts afresh at exec, ru_maxrss may not
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, dirs, files in os.walk(directory) for name in files)
+
+def measure(operation, arguments):
+    # Operations answering (False or None, message) count as failed
+    times = []
+    failed = 0
+    for args in arguments:
+        start = time.perf_counter()
+        result = operation(*args)
+        times.append(time.perf_counter() - start)
+        if isinstance(result, tuple) and not result[0]:
+            failed += 1
+    return latency_stats(times, failed)
+
+def bench_suite_run(args):
+    # One configuration of the suite, in a process of its own so that its
+    # peak RSS is its own; prints the result as JSON. With --import-only it
+    # just has the backend import the dataset, which is left out of the
+    # measured run.
+    directory = os.path.join(args.directory, args.storage)
+    os.makedirs(directory, exist_ok=True)
+    source = os.path.join(args.directory, 'accounts.json')
+    if args.import_only:
+        import_time, atm = timed(ATM, suite_storage(args.storage, directory, source))
+        atm.close()
+        print(compact_json({'import_seconds': import_time}))
+        return
+    rng = random.Random(args.seed)
+    sample = [synthetic_number(rng.randrange(args.size)) for _ in range(args.ops)]
+    pairs = [(a, b) for a, b in zip(sample, sample[1:] + sample[:1]) if a != b]
+    
+    operations = {}
+    load_time, atm = timed(ATM, suite_storage(args.storage, directory, source))
+    operations['load_accounts'] = latency_stats([load_time])
+    operations['authenticate'] = measure(atm.authenticate, [(acc_num, '1234') for acc_num in sample])
+    accounts = {acc_num: atm.accounts[acc_num] for acc_num in sample}
+    # Deposits of 2 and withdrawals of 1 leave every sampled account enough
+    # for the transfers out of it
+    operations['deposit'] = measure(lambda acc_num: accounts[acc_num].deposit(2), [(n,) for n in sample])
+    operations['withdraw'] = measure(lambda acc_num: accounts[acc_num].withdraw(1), [(n,) for n in sample])
+    operations['transfer'] = measure(lambda a, b: accounts[a].transfer(1, accounts[b]), pairs)
+    
+    def save_one(acc_num):
+        accounts[acc_num].deposit(1)
+        atm.save_accounts()
+    
+    atm.save_accounts()  # what the operations above left unsaved
+    operations['deposit_and_save'] = measure(save_one, [(n,) for n in sample[:args.saves]])
+    # create_account saves as part of the operation
+    operations['create_account'] = measure(atm.create_account, [('bench', '1234', 10)] * args.saves)
+    # close() may rewrite a whole file (the binary store's index), so the
+    # peak is taken before and after it
+    rss = peak_rss()
+    atm.close()
+    print(compact_json({
+        'accounts': args.size,
+        'history': args.history,
+        'storage': args.storage,
+        'operations': operations,
+        'peak_rss_kb': rss,
+        'peak_rss_with_close_kb': peak_rss(),
+        'bytes_on_disk': directory_size(directory)
+    }))
+
+def bench_suite(args):
+    # Core operations and persistence for each dataset size and backend:
+    # ops/sec and p50/p99 latency, peak RSS and bytes on disk, written as
+    # JSON to compare between runs. load_accounts is one cold ATM() after
+    # the backend imported the dataset; deposit/withdraw/transfer include
+    # whatever each backend does per record, deposit_and_save and
+    # create_account a save_accounts() as well.
+    report = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'history': args.history,
+        'runs': []
+    }
+    print(f"{'accounts':>9} {'storage':>8} {'load':>9} {'auth/s':>9} {'deposit/s':>10} {'transfer/s':>10} "
+          f"{'save p50':>10} {'save p99':>10} {'RSS':>8} {'disk':>9}", file=sys.stderr)
+    for size in args.sizes:
+        directory = tempfile.mkdtemp()
+        try:
+            make_dataset(os.path.join(directory, 'accounts.json'), size, args.history)
+            for storage in args.storage:
+                if storage == 'json' and size > args.json_max:
+                    continue
+                command = [sys.executable, os.path.abspath(__file__), 'suite-run', '--size', str(size),
+                           '--history', str(args.history), '--storage', storage, '--directory', directory,
+                           '--ops', str(args.ops), '--saves', str(args.saves), '--seed', str(args.seed)]
+                setup = json.loads(subprocess.run(command + ['--import-only'], capture_output=True, text=True,
+                                                  check=True).stdout)
+                run = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout)
+                run.update(setup)
+                report['runs'].append(run)
+                ops = run['operations']
+                print(f"{size:>9} {storage:>8} {ops['load_accounts']['p50_ms'] / 1e3:>8.2f}s "
+                      f"{ops['authenticate']['ops_per_sec']:>9.0f} {ops['deposit']['ops_per_sec']:>10.0f} "
+                      f"{ops['transfer']['ops_per_sec']:>10.0f} {ops['deposit_and_save']['p50_ms']:>8.2f}ms "
+                      f"{ops['deposit_and_save']['p99_ms']:>8.2f}ms {run['peak_rss_kb'] / 1024:>6.0f}MB "
+                      f"{run['bytes_on_disk'] / 2**20:>7.1f}MB", file=sys.stderr)
+        finally:
+            shutil.rmtree(directory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ATM benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    startup = commands.add_parser('startup', help="ATM() load time per storage backend")
+    startup.add_argument('--accounts', type=int, default=10000)
+    startup.add_argument('--history', type=int, nargs='+', default=[0, 10, 100])
+    startup.add_argument('--tail', type=int, default=1000, help="journal records left unfolded")
+    startup.set_defaults(run=bench_startup)
+    
+    save = commands.add_parser('save', help="transfer + save_accounts() latency, JSON vs dirty-only sharded files")
+    save.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    save.add_argument('--json-max', type=int, default=100000, help="skip the JSON column above this size")
+    save.add_argument('--repeat', type=int, default=20)
+    save.set_defaults(run=bench_save)
+    
+    memory = commands.add_parser('memory', help="bytes per transaction, dicts vs column store")
+    memory.add_argument('--transactions', type=int, default=200000)
+    memory.set_defaults(run=bench_memory)
+    
+    stress = commands.add_parser('stress', help="concurrent overlapping transfers; checks money is conserved")
+    stress.add_argument('--accounts', type=int, default=10)
+    stress.add_argument('--threads', type=int, default=16)
+    stress.add_argument('--transfers', type=int, default=2000)
+    stress.set_defaults(run=bench_stress)
+    
+    commit = commands.add_parser('commit', help="journal throughput, fsync per record vs group commit")
+    commit.add_argument('--clients', type=int, nargs='+', default=[1, 10, 100])
+    commit.add_argument('--seconds', type=float, default=3)
+    commit.add_argument('--window-ms', type=float, default=2)
+    commit.add_argument('--batch', type=int, default=256)
+    commit.set_defaults(run=bench_commit)
+    
+    batch = commands.add_parser('batch', help="postings per second for a CSV batch file")
+    batch.add_argument('--accounts', type=int, default=10000)
+    batch.add_argument('--lines', type=int, default=1000000)
+    batch.add_argument('--chunk', type=int, default=10000)
+    batch.add_argument('--storage', nargs='+', choices=['journal', 'sqlite'], default=['journal', 'sqlite'])
+    batch.set_defaults(run=bench_batch)
+    
+    allocate = commands.add_parser('allocate', help="create_account latency as the number space fills up")
+    allocate.add_argument('--digits', type=int, default=6)
+    allocate.add_argument('--occupancy', type=float, nargs='+', default=[0, 0.5, 0.9, 0.99, 0.999])
+    allocate.add_argument('--creates', type=int, default=200)
+    allocate.add_argument('--block', type=int, default=1000)
+    allocate.set_defaults(run=bench_allocate)
+    
+    onboard = commands.add_parser('onboard', help="bulk account import vs create_account() per account")
+    onboard.add_argument('--customers', type=int, default=500000)
+    onboard.add_argument('--chunk', type=int, default=10000)
+    onboard.add_argument('--sample', type=int, default=200, help="create_account() calls timed for the comparison")
+    onboard.add_argument('--storage', nargs='+', choices=['journal', 'sqlite', 'sharded'], default=['journal', 'sqlite'])
+    onboard.set_defaults(run=bench_onboard)
+    
+    binary = commands.add_parser('binary', help="startup and lookup latency, accounts.json vs mmap'd binary file")
+    binary.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    binary.add_argument('--history', type=int, default=0, help="transactions per account in the dataset")
+    binary.add_argument('--lookups', type=int, default=10000)
+    binary.add_argument('--saves', type=int, default=100)
+    binary.add_argument('--json-max', type=int, default=100000, help="skip JSON above this many accounts")
+    binary.set_defaults(run=bench_binary)
+    
+    imports = commands.add_parser('imports', help="import time and RSS, headless core vs GUI")
+    imports.add_argument('--repeat', type=int, default=5)
+    imports.set_defaults(run=bench_imports)
+    
+    metrics = commands.add_parser('metrics', help="per-call overhead of the metrics instrumentation")
+    metrics.add_argument('--calls', type=int, default=20000)
+    metrics.add_argument('--repeat', type=int, default=25)
+    metrics.set_defaults(run=bench_metrics)
+    
+    reconcile = commands.add_parser('reconcile', help="vectorized ledger reconciliation throughput (needs numpy)")
+    reconcile.add_argument('--accounts', type=int, default=1000000)
+    reconcile.add_argument('--transactions', type=int, nargs='+', default=[1000000, 10000000, 30000000])
+    reconcile.add_argument('--load-accounts', type=int, default=10000, help="accounts in the from_atm dataset")
+    reconcile.add_argument('--load-history', type=int, default=100, help="transactions per account there")
+    reconcile.add_argument('--seed', type=int, default=1)
+    reconcile.set_defaults(run=bench_reconcile)
+    
+    archive = commands.add_parser('archive', help="archived history of accounts created in the same process")
+    archive.add_argument('--storage', nargs='+', choices=SUITE_STORAGES, default=SUITE_STORAGES)
+    archive.add_argument('--imported', type=int, default=3, help="accounts opened by import_accounts()")
+    archive.add_argument('--transactions', type=int, default=20, help="per account, archived")
+    archive.set_defaults(run=bench_archive)
+    
+    crash = commands.add_parser('crash', help="startup and dashboard totals after a process is killed before close()")
+    crash.add_argument('--storage', nargs='+', choices=SUITE_STORAGES, default=SUITE_STORAGES)
+    crash.add_argument('--accounts', type=int, default=20000)
+    crash.add_argument('--history', type=int, default=5)
+    crash.add_argument('--ops', type=int, default=50, help="accounts given a deposit and a transfer, each saved")
+    crash.set_defaults(run=bench_crash)
+    
+    crash_run = commands.add_parser('crash-run', help="the process crash kills (run by crash)")
+    crash_run.add_argument('--storage', choices=SUITE_STORAGES, required=True)
+    crash_run.add_argument('--directory', required=True)
+    crash_run.add_argument('--source', required=True)
+    crash_run.add_argument('--ops', type=int, default=50)
+    crash_run.set_defaults(run=bench_crash_run)
+    
+    eod = commands.add_parser('eod', help="end-of-day shard processing time per worker count")
+    eod.add_argument('--accounts', type=int, default=100000)
+    eod.add_argument('--history', type=int, default=20)
+    eod.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    eod.add_argument('--shards-per-worker', type=int, default=4)
+    eod.set_defaults(run=bench_eod)
+    
+    eod_crash_run = commands.add_parser('eod-crash-run', help="the merge eod kills (run by eod)")
+    eod_crash_run.add_argument('--storage', choices=sorted(EOD_STORAGES), required=True)
+    eod_crash_run.add_argument('--path', required=True)
+    eod_crash_run.add_argument('--run-dir', required=True)
+    eod_crash_run.set_defaults(run=bench_eod_crash_run)
+    
+    suite = commands.add_parser('suite', help="core operations and persistence per size and backend, as JSON")
+    suite.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    suite.add_argument('--history', type=int, default=0, help="transactions per account in the dataset")
+    suite.add_argument('--storage', nargs='+', choices=SUITE_STORAGES, default=['json', 'sqlite', 'binary'])
+    suite.add_argument('--ops', type=int, default=2000, help="calls timed per in-memory operation")
+    suite.add_argument('--saves', type=int, default=20, help="calls timed per saving operation")
+    suite.add_argument('--json-max', type=int, default=100000, help="skip the json backend above this size")
+    suite.add_argument('--seed', type=int, default=1)
+    suite.add_argument('--output', help="write the JSON report here instead of stdout")
+    suite.set_defaults(run=bench_suite)
+    
+    suite_run = commands.add_parser('suite-run', help="one configuration of the suite (run by suite)")
+    suite_run.add_argument('--size', type=int, required=True)
+    suite_run.add_argument('--history', type=int, default=0)
+    suite_run.add_argument('--storage', choices=SUITE_STORAGES, required=True)
+    suite_run.add_argument('--directory', required=True)
+    suite_run.add_argument('--ops', type=int, default=2000)
+    suite_run.add_argument('--saves', type=int, default=20)
+    suite_run.add_argument('--seed', type=int, default=1)
+    suite_run.add_argument('--import-only', action='store_true')
+    suite_run.set_defaults(run=bench_suite_run)
+    
+    args = parser.parse_args()
+    args.run(args)
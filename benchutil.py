@@ -0,0 +1,40 @@
+import os
+import shutil
+from binstore import BinaryStorage
+from journal import JournalStorage
+from storage import JsonStorage, ShardedStorage, SqliteStorage
+
+# Datasets, backends and latency figures shared by bench.py and workload.py
+
+def synthetic_number(i):
+    # 7919 is coprime to 10**8, so this is a bijection that spreads numbers
+    # across all the account-number prefixes
+    return f"{i * 7919 % 10**8:08d}"
+
+SUITE_STORAGES = ['json', 'journal', 'sqlite', 'sharded', 'binary']
+
+def suite_storage(name, directory, source):
+    # The backend's files go in `directory`; the ones that import do so from
+    # the dataset, the others start from a copy of it
+    if name in ('json', 'journal') and not os.path.exists(os.path.join(directory, 'accounts.json')):
+        shutil.copy(source, os.path.join(directory, 'accounts.json'))
+    if name == 'json':
+        return JsonStorage(os.path.join(directory, 'accounts.json'))
+    elif name == 'journal':
+        return JournalStorage(os.path.join(directory, 'accounts.json'))
+    elif name == 'sqlite':
+        return SqliteStorage(os.path.join(directory, 'accounts.db'), source)
+    elif name == 'sharded':
+        return ShardedStorage(os.path.join(directory, 'accounts.d'), source)
+    return BinaryStorage(os.path.join(directory, 'accounts.bin'), source)
+
+def latency_stats(times, failed=0):
+    times = sorted(times)
+    return {
+        'ops': len(times),
+        'failed': failed,
+        'ops_per_sec': len(times) / sum(times) if sum(times) else None,
+        'p50_ms': times[len(times) // 2] * 1e3,
+        'p99_ms': times[min(len(times) * 99 // 100, len(times) - 1)] * 1e3,
+        'max_ms': times[-1] * 1e3
+    }
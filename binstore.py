@@ -0,0 +1,406 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+from aggregates import Aggregates
+from metrics import METRICS
+from storage import (FileHistoryReader, JsonStorage, Storage, account_path, append_lines, read_aggregates,
+                     saved_file_history, write_aggregates, write_atomic)
+
+class BinaryStorage(Storage):
+    # accounts.bin: a header and then one fixed-size record per account,
+    # read and updated in place through mmap, plus accounts.bin.idx, the
+    # (account number, record slot) pairs sorted by number. Looking up an
+    # account is a binary search of the index and one record read, so
+    # startup does not read the accounts at all and a save rewrites only
+    # the records of the accounts that changed. Histories are JSON-lines
+    # files under accounts.bin.history/, as in ShardedStorage.
+    #
+    # Accounts opened since the index was written are found by their slot
+    # in self.added; the index is rewritten once there are many of them
+    # and on close(). Closed accounts keep their slot, flagged CLOSED.
+    #
+    # Each save takes a new generation, written to the header (and synced)
+    # before any record; the aggregates in accounts.aggregates.json are
+    # valid only for the generation in the header.
+    MAGIC = b'ATMB'
+    INDEX_MAGIC = b'ATMI'
+    VERSION = 1
+    # magic, version, record size, slots used, open accounts, generation
+    # (zero in files written before it was kept)
+    HEADER = struct.Struct('<4sHHQQQ')
+    # number, pin, balance, pin_attempts, flags, archived transactions, live
+    # history lines, history bytes, archived lines at the start of the file
+    RECORD = struct.Struct('<8s16sdBBxxIQQQ')
+    FLAGS = 33  # offset of the flags byte in a record
+    INDEX_HEADER = struct.Struct('<4sQ')  # magic, slots covered by the index
+    ENTRY = struct.Struct('<8sI')  # number, slot
+    ACTIVE, LOCKED, CLOSED = 1, 2, 4
+    reads_accounts = True
+    lazy = True
+    ranged = True
+    
+    def __init__(self, path='accounts.bin', import_file='accounts.json'):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.history_dir = path + '.history'
+        self.import_file = import_file
+        self.lock = threading.RLock()
+        self.file = None
+        self.map = None
+        self.index = None
+        self.slots = {}  # account number -> slot, for the accounts looked up or opened
+        self.saved = {}  # account number -> (bytes, live lines, archived lines) of history on disk
+        self.unsaved = {}  # account number -> transactions recorded since the last save
+        self.dropped = {}  # account number -> lines archived since the last save
+        self.added = {}  # account number -> slot, for records not in the index yet
+        self.closed = set()  # closed since the last save
+        self.generation = 0
+        self.loaded_aggregates = None
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            accounts_data = {}
+            if self.import_file and os.path.exists(self.import_file):
+                accounts_data = JsonStorage(self.import_file).load()
+            self._create(accounts_data)
+        self._open()
+        self.loaded_aggregates = read_aggregates(self.sidecar_path('aggregates.json'),
+                                                 lambda generation: generation == self.generation)
+        return {}
+    
+    def aggregates(self):
+        return self.loaded_aggregates
+    
+    def settled(self, aggregates):
+        with self.lock:
+            write_aggregates(self.sidecar_path('aggregates.json'), aggregates, self.generation)
+    
+    def _create(self, accounts_data):
+        # Writes accounts.bin, its index and the histories from data in the
+        # accounts.json shape, and the aggregates counted from that data
+        write_aggregates(self.sidecar_path('aggregates.json'), Aggregates.count_data(accounts_data), 1)
+        records = []
+        entries = []
+        for slot, (acc_num, acc_data) in enumerate(sorted(accounts_data.items())):
+            transactions = acc_data.get('transaction_history', [])
+            size = 0
+            if transactions:
+                path = account_path(self.history_dir, acc_num, '.jsonl')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                size = append_lines(path, 0, transactions)
+            records.append(self._pack(acc_num, acc_data['pin'], acc_data['balance'],
+                                      acc_data.get('pin_attempts', 0),
+                                      self._flags(acc_data.get('is_active', True), acc_data.get('locked', False)),
+                                      acc_data.get('history_archived', 0), len(transactions), size, 0))
+            entries.append(self.ENTRY.pack(acc_num.encode(), slot))
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD.size, len(records), len(records), 1)
+        write_atomic(self.path, header.ljust(self.RECORD.size, b'\0') + b''.join(records))
+        write_atomic(self.index_path, self.INDEX_HEADER.pack(self.INDEX_MAGIC, len(entries)) + b''.join(entries))
+    
+    def _flags(self, is_active, locked):
+        return (self.ACTIVE if is_active else 0) | (self.LOCKED if locked else 0)
+    
+    def _pack(self, acc_num, pin, balance, pin_attempts, flags, archived, count, size, skip):
+        number = acc_num.encode()
+        if len(number) != 8:
+            raise ValueError(f"Account number {acc_num!r} is not 8 characters")
+        pin = pin.encode()
+        if len(pin) > 16:
+            raise ValueError(f"PIN of account {acc_num} is longer than 16 bytes")
+        return self.RECORD.pack(number, pin, balance, pin_attempts, flags, archived, count, size, skip)
+    
+    def _open(self):
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version, record_size, self.used, self.count, self.generation = self.HEADER.unpack_from(self.map)
+        if magic != self.MAGIC or version != self.VERSION or record_size != self.RECORD.size:
+            raise ValueError(f"{self.path} is not a version {self.VERSION} account file")
+        covered = 0
+        if os.path.exists(self.index_path):
+            self._map_index()
+            magic, covered = self.INDEX_HEADER.unpack_from(self.index)
+            if magic != self.INDEX_MAGIC:
+                raise ValueError(f"{self.index_path} is not an account index")
+        # Records written after the index was (a crash before close())
+        for slot in range(covered, self.used):
+            number = self.map[self._offset(slot):self._offset(slot) + 8]
+            if number.strip(b'\0') and not self.map[self._offset(slot) + self.FLAGS] & self.CLOSED:
+                self.added[number.decode()] = slot
+    
+    def _map_index(self):
+        if self.index is not None:
+            self.index.close()
+        with open(self.index_path, 'rb') as f:
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def _offset(self, slot):
+        # The header takes the first record-sized block
+        return (slot + 1) * self.RECORD.size
+    
+    def _find(self, number):
+        if self.index is None:
+            return None
+        position = self._search(number)
+        if position < len(self.index) and self.index[position:position + 8] == number:
+            return self.ENTRY.unpack_from(self.index, position)[1]
+        return None
+    
+    def _search(self, number):
+        # Binary search of the index, comparing the 8-byte numbers in place:
+        # the position of the first entry not below `number`
+        low = 0
+        high = (len(self.index) - self.INDEX_HEADER.size) // self.ENTRY.size
+        while low < high:
+            middle = (low + high) // 2
+            position = self.INDEX_HEADER.size + middle * self.ENTRY.size
+            if self.index[position:position + 8] < number:
+                low = middle + 1
+            else:
+                high = middle
+        return self.INDEX_HEADER.size + low * self.ENTRY.size
+    
+    def lookup(self, account_number):
+        with self.lock:
+            if not isinstance(account_number, str) or account_number in self.closed:
+                return None
+            number = account_number.encode()
+            slot = self.added.get(account_number)
+            if slot is None:
+                slot = self._find(number)
+            if slot is None:
+                return None
+            number, pin, balance, pin_attempts, flags, archived, count, size, skip = self.RECORD.unpack_from(
+                self.map, self._offset(slot))
+            if flags & self.CLOSED:
+                return None
+            self.slots[account_number] = slot
+            self.saved.setdefault(account_number, (size, count, skip))
+            return {
+                'pin': pin.rstrip(b'\0').decode(),
+                'balance': balance,
+                'is_active': bool(flags & self.ACTIVE),
+                'pin_attempts': pin_attempts,
+                'locked': bool(flags & self.LOCKED),
+                'history_count': self.saved[account_number][1],
+                'history_archived': archived
+            }
+    
+    def account_numbers(self):
+        with self.lock:
+            numbers = []
+            if self.index is not None:
+                for number, slot in self.ENTRY.iter_unpack(self.index[self.INDEX_HEADER.size:]):
+                    if not self.map[self._offset(slot) + self.FLAGS] & self.CLOSED:
+                        numbers.append(number.decode())
+            numbers.extend(self.added)
+            return [acc_num for acc_num in numbers if acc_num not in self.closed]
+    
+    def load_range(self, first, last):
+        # The slice of the index between the two numbers, and any records
+        # added since it was written
+        with self.lock:
+            if self.map is None:
+                self._open()
+            numbers = []
+            if self.index is not None:
+                start = self._search(first.encode())
+                stop = self._search(last.encode())
+                if self.index[stop:stop + 8] == last.encode():
+                    stop += self.ENTRY.size
+                numbers = [number.decode() for number, slot in self.ENTRY.iter_unpack(self.index[start:stop])]
+            numbers.extend(acc_num for acc_num in self.added if first <= acc_num <= last)
+            accounts_data = {}
+            for acc_num in numbers:
+                acc_data = self.lookup(acc_num)
+                if acc_data is not None:
+                    accounts_data[acc_num] = acc_data
+            return accounts_data
+    
+    def account_summaries(self):
+        # One pass over the records in file order
+        with self.lock:
+            records = self.map[self.RECORD.size:self._offset(self.used)]
+            summaries = []
+            for number, pin, balance, pin_attempts, flags, *rest in self.RECORD.iter_unpack(records):
+                if number.strip(b'\0') and not flags & self.CLOSED:
+                    summaries.append((number.decode(), balance, bool(flags & self.LOCKED)))
+            return [summary for summary in summaries if summary[0] not in self.closed]
+    
+    def history_reader(self, account_number, acc_data):
+        size, count, skip = self.saved[account_number]
+        return FileHistoryReader(account_path(self.history_dir, account_number, '.jsonl'), size, count, skip=skip)
+    
+    def saved_history(self, account_number, history, saved):
+        with self.lock:
+            if account_number not in self.saved:
+                return None
+            size, count, skip = self.saved[account_number]
+            return saved_file_history(history, account_path(self.history_dir, account_number, '.jsonl'),
+                                      size, count, skip)
+    
+    def sidecar_path(self, name):
+        return os.path.splitext(self.path)[0] + '.' + name
+    
+    def append(self, record):
+        op = record['op']
+        with self.lock:
+            if op == 'import':
+                for acc_num, pin in record['accounts']:
+                    self.saved[acc_num] = (0, 0, 0)
+                    self.unsaved.pop(acc_num, None)
+                    self.dropped.pop(acc_num, None)
+                    self.closed.discard(acc_num)
+            if op in ('deposit', 'withdrawal', 'transfer', 'batch', 'import'):
+                for acc_num, transaction in record['postings']:
+                    self.unsaved.setdefault(acc_num, []).append(transaction)
+            elif op == 'open':
+                self.saved[record['account']] = (0, 0, 0)
+                self.unsaved.pop(record['account'], None)
+                self.dropped.pop(record['account'], None)
+                self.closed.discard(record['account'])
+            elif op == 'archive':
+                # The lines stay in the history file and are skipped
+                for acc_num, count in record['accounts']:
+                    self.dropped[acc_num] = self.dropped.get(acc_num, 0) + count
+            elif op == 'close':
+                self.unsaved.pop(record['account'], None)
+                self.dropped.pop(record['account'], None)
+                self.closed.add(record['account'])
+    
+    def save(self, accounts, changed):
+        # History first, records last, as in ShardedStorage; the header
+        # (slots used) goes after the records it covers
+        with self.lock:
+            if not changed:
+                return
+            self.generation += 1
+            self._write_header()
+            self.map.flush(0, self.HEADER.size)
+            for acc_num in changed:
+                account = accounts.get(acc_num)
+                if account is None:
+                    self._remove(acc_num)
+                    continue
+                size, count, skip = self.saved.get(acc_num, (0, 0, 0))
+                transactions = self.unsaved.pop(acc_num, None)
+                if transactions:
+                    path = account_path(self.history_dir, acc_num, '.jsonl')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    size = append_lines(path, size, transactions)
+                    count += len(transactions)
+                dropped = self.dropped.pop(acc_num, 0)
+                count -= dropped
+                skip += dropped
+                self.saved[acc_num] = (size, count, skip)
+                record = self._pack(acc_num, account.pin, account.balance, account.pin_attempts,
+                                    self._flags(account.is_active, account.locked),
+                                    account.transaction_history.archived, count, size, skip)
+                slot = self.slots.get(acc_num)
+                if slot is None:
+                    slot = self._new_slot()
+                    self.slots[acc_num] = slot
+                    self.added[acc_num] = slot
+                    self.count += 1
+                self.map[self._offset(slot):self._offset(slot + 1)] = record
+                METRICS.wrote('record', len(record))
+            self.map.flush()
+            self._write_header()
+            self.map.flush()
+            if len(self.added) > max(1024, self.count // 16):
+                self._write_index()
+    
+    def _write_header(self):
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION, self.RECORD.size, self.used, self.count,
+                              self.generation)
+    
+    def _remove(self, acc_num):
+        slot = self.slots.pop(acc_num, None)
+        if slot is not None:
+            self.map[self._offset(slot) + self.FLAGS] |= self.CLOSED
+            self.count -= 1
+        self.added.pop(acc_num, None)
+        self.saved.pop(acc_num, None)
+        self.dropped.pop(acc_num, None)
+        self.closed.discard(acc_num)
+        path = account_path(self.history_dir, acc_num, '.jsonl')
+        if os.path.exists(path):
+            os.remove(path)
+    
+    def _new_slot(self):
+        # The file grows by doubling, so appends stay amortized O(1)
+        if self._offset(self.used + 1) > len(self.map):
+            self.map.flush()
+            self.map.close()
+            self.file.truncate(self._offset(max(2 * self.used, 1024)))
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        self.used += 1
+        return self.used - 1
+    
+    def _write_index(self):
+        entries = []
+        if self.index is not None:
+            for number, slot in self.ENTRY.iter_unpack(self.index[self.INDEX_HEADER.size:]):
+                if not self.map[self._offset(slot) + self.FLAGS] & self.CLOSED:
+                    entries.append((number, slot))
+        entries.extend((acc_num.encode(), slot) for acc_num, slot in self.added.items())
+        entries.sort()
+        write_atomic(self.index_path, self.INDEX_HEADER.pack(self.INDEX_MAGIC, self.used) +
+                     b''.join(self.ENTRY.pack(number, slot) for number, slot in entries))
+        self.added = {}
+        self._map_index()
+    
+    def close(self):
+        with self.lock:
+            if self.map is None:
+                return
+            if self.added:
+                self._write_index()
+            self.map.close()
+            self.file.close()
+            if self.index is not None:
+                self.index.close()
+            self.map = self.index = None
+
+def export_json(path, json_file):
+    # The inverse of importing: accounts.bin back to the accounts.json shape
+    storage = BinaryStorage(path, None)
+    storage.load()
+    try:
+        accounts_data = {}
+        for acc_num in sorted(storage.account_numbers()):
+            acc_data = storage.lookup(acc_num)
+            count = acc_data.pop('history_count')
+            acc_data['transaction_history'] = storage.history_reader(acc_num, acc_data)(0, count)
+            accounts_data[acc_num] = acc_data
+    finally:
+        storage.close()
+    with open(json_file, 'w') as f:
+        json.dump(accounts_data, f, indent=2)
+    return len(accounts_data)
+
+def import_json(json_file, path):
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+    storage = BinaryStorage(path, json_file)
+    storage.load()
+    count = storage.count
+    storage.close()
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert between accounts.json and the binary account file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    to_binary = commands.add_parser('import', help="accounts.json -> accounts.bin")
+    to_binary.add_argument('json_file', nargs='?', default='accounts.json')
+    to_binary.add_argument('path', nargs='?', default='accounts.bin')
+    to_json = commands.add_parser('export', help="accounts.bin -> accounts.json")
+    to_json.add_argument('path', nargs='?', default='accounts.bin')
+    to_json.add_argument('json_file', nargs='?', default='accounts.json')
+    args = parser.parse_args()
+    if args.command == 'import':
+        print(f"Wrote {import_json(args.json_file, args.path)} account(s) to {args.path}")
+    else:
+        print(f"Wrote {export_json(args.path, args.json_file)} account(s) to {args.json_file}")
@@ -0,0 +1,158 @@
+import datetime
+import json
+import socket
+import threading
+from bank import Session
+from storage import compact_json
+
+class RemoteATM:
+    # Talks to server.py and offers the calls ATMGUI makes on a local ATM,
+    # so the GUI can run as a terminal of a shared backend. One connection
+    # carries one session, like one physical terminal.
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.sock = socket.create_connection((host, port))
+        self.file = self.sock.makefile('rwb')
+        self.lock = threading.Lock()
+        self.next_id = 0
+    
+    def request(self, op, **params):
+        with self.lock:
+            self.next_id += 1
+            params['op'] = op
+            params['id'] = self.next_id
+            self.file.write((compact_json(params) + '\n').encode())
+            self.file.flush()
+            line = self.file.readline()
+        if not line:
+            raise ConnectionError("ATM server closed the connection")
+        return json.loads(line)
+    
+    def authenticate(self, account_number, pin):
+        response = self.request('login', account=account_number, pin=pin)
+        if not response['ok']:
+            return None, response['message']
+        return Session(account=RemoteAccount(self, account_number, own=True)), response['message']
+    
+    def authenticate_admin(self, username, password):
+        if not self.request('admin_login', username=username, password=password)['ok']:
+            return None
+        return Session(admin=username)
+    
+    def create_account(self, name, pin, initial_deposit=0):
+        # The account number, or (None, message) if the server refused
+        response = self.request('create_account', name=name, pin=pin, initial_deposit=initial_deposit)
+        if not response['ok']:
+            return None, response['message']
+        return response['account']
+    
+    def get_account(self, account_number):
+        # Existence is checked by the server when the account is used
+        return RemoteAccount(self, account_number)
+    
+    def account_info(self, account_number):
+        return self.request('account_info', account=account_number).get('account')
+    
+    def dashboard(self, days=7):
+        return self.request('dashboard', days=days)['dashboard']
+    
+    def metrics(self):
+        # Prometheus text snapshot of the server's metrics
+        return self.request('metrics')['metrics']
+    
+    def list_accounts(self):
+        # The server answers a page at a time
+        accounts, cursor = [], None
+        while True:
+            response = self.request('accounts', cursor=cursor)
+            accounts += response.get('accounts', [])
+            cursor = response.get('cursor')
+            if cursor is None:
+                return accounts
+    
+    def query_accounts(self, prefix=None, locked=None, min_balance=None, max_balance=None, sort='number',
+                       descending=False, cursor=None, limit=20):
+        response = self.request('query_accounts', prefix=prefix, locked=locked, min_balance=min_balance,
+                                max_balance=max_balance, sort=sort, descending=descending,
+                                cursor=cursor, limit=limit)
+        return response['accounts'], response['cursor']
+    
+    def unlock_account(self, account_number, admin_username):
+        response = self.request('unlock', account=account_number)
+        return response['ok'], response['message']
+    
+    def close_account(self, account_number, admin_username):
+        response = self.request('close', account=account_number)
+        return response['ok'], response['message']
+    
+    def save_accounts(self):
+        # The server persists every operation before answering
+        pass
+    
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+class RemoteAccount:
+    # The BankAccount methods the GUI uses, answered by the server for the
+    # session's own account (own=True) or, for admins, any account
+    def __init__(self, atm, account_number, own=False):
+        self.atm = atm
+        self.account_number = account_number
+        self.own = own
+    
+    def _target(self):
+        return {} if self.own else {'account': self.account_number}
+    
+    def get_balance(self):
+        return self.atm.request('balance').get('balance', 0)
+    
+    def deposit(self, amount):
+        response = self.atm.request('deposit', amount=amount)
+        return response['ok'], response['message']
+    
+    def withdraw(self, amount):
+        response = self.atm.request('withdraw', amount=amount)
+        return response['ok'], response['message']
+    
+    def transfer(self, amount, recipient_account):
+        if recipient_account.account_number == self.account_number:
+            return False, "Cannot transfer to yourself"
+        response = self.atm.request('transfer', amount=amount, to=recipient_account.account_number)
+        return response['ok'], response['message']
+    
+    def change_pin(self, old_pin, new_pin):
+        response = self.atm.request('change_pin', old_pin=old_pin, new_pin=new_pin)
+        return response['ok'], response['message']
+    
+    def generate_receipt(self, transaction_type, amount, other_account=None):
+        return self.atm.request('receipt', type=transaction_type, amount=amount, other=other_account)['receipt']
+    
+    def get_transaction_page(self, cursor=None, limit=10):
+        response = self.atm.request('history', cursor=cursor, limit=limit, **self._target())
+        return response.get('transactions', []), response.get('cursor')
+    
+    def get_transactions_between(self, start, end, types=None):
+        return self._between(start, end, types)
+    
+    def _between(self, start, end, types=None, cursor=None):
+        # Every page from the server, from `cursor` on
+        transactions = []
+        while True:
+            response = self.atm.request('between', start=start.isoformat(), end=end.isoformat(),
+                                        types=list(types) if types is not None else None, cursor=cursor,
+                                        **self._target())
+            transactions += response.get('transactions', [])
+            cursor = response.get('cursor')
+            if cursor is None:
+                return transactions
+    
+    def get_statement(self, year, month):
+        # The statement carries the month's first page of transactions; the
+        # rest come from 'between'
+        response = self.atm.request('statement', year=year, month=month, **self._target())
+        statement = response.get('statement')
+        if statement is not None and response.get('cursor') is not None:
+            start = datetime.datetime(year, month, 1)
+            end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+            statement['transactions'] += self._between(start, end, cursor=response['cursor'])
+        return statement
@@ -0,0 +1,291 @@
+import argparse
+import calendar
+import concurrent.futures
+import datetime
+import functools
+import json
+import os
+import sys
+import time
+from aggregates import Aggregates
+from bank import ATM, add_storage_arguments, make_storage
+from money import format_amount, from_cents, parse_amount
+from storage import compact_json, write_atomic
+
+# End-of-day run, in two phases:
+#
+#   1. Accounts are split into shards by account-number range, and a
+#      process pool works through the shards. Each worker reads its
+#      shard's accounts from storage itself (only those, where storage is
+#      ranged) and writes, under the run directory, shard-NNNN.postings.jsonl (interest deposits and fee
+#      withdrawals, in post_batch form), shard-NNNN.statements.txt and
+#      last shard-NNNN.done. Shards with a .done marker are skipped when the
+#      run is started again, so a crash only costs the unfinished shards.
+#   2. The parent posts each finished shard as one batch record, dated at
+#      the end of the business day or now, whichever is later. Before
+#      posting it writes shard-NNNN.merging with that date and the
+#      accounts' history lengths, and after it shard-NNNN.merged. A shard
+#      found .merging but not .merged after a crash is only posted again if
+#      none of its transactions (with that date) are there.
+#
+# A new run needs its business day to be over, with no transaction dated
+# after it: the charges are worked out on the balances at its end, and
+# histories must stay in time order (history.py bisects on dates).
+#
+# Interest is daily, balance * rate / 365 rounded to the cent, on the
+# balance at the cutoff. The maintenance fee is charged at month end on
+# balances below a minimum, and never takes a balance below zero.
+
+def shard_prefix(run_dir, shard):
+    return os.path.join(run_dir, f"shard-{shard:04d}")
+
+def day_end(params):
+    return f"{params['date']} 23:59:59"
+
+def newest_transaction(atm):
+    # The date of the newest transaction in any account ('' if none)
+    newest = ''
+    for account in atm.accounts.values():
+        history = account.transaction_history
+        if len(history):
+            newest = max(newest, history[-1].get('date', ''))
+    return newest
+
+def check_date(atm, params):
+    end = day_end(params)
+    if datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") <= end:
+        raise ValueError(f"The business day {params['date']} is not over yet")
+    newest = newest_transaction(atm)
+    if newest > end:
+        raise ValueError(f"There are transactions dated after the business day {params['date']}, up to {newest}")
+
+def shard_range(shard, shards):
+    # The first and last account numbers of a shard: an equal share of the
+    # 8-digit numbers, which the allocator spreads evenly
+    return f"{shard * 10**8 // shards:08d}", f"{(shard + 1) * 10**8 // shards - 1:08d}"
+
+def charges(cents, params):
+    # (interest, fee) in cents for an account holding `cents` at the cutoff
+    interest = round(cents * params['rate'] / 365) if cents > 0 else 0
+    fee = 0
+    if params['month_end'] and cents < params['fee_below']:
+        fee = max(min(params['fee'], cents + interest), 0)
+    return interest, fee
+
+def render_statement(statement, interest, fee):
+    lines = [
+        f"Statement for {statement['period']}",
+        f"Account: {statement['account_number']}",
+        f"Opening Balance: ${statement['opening_balance']:.2f}"
+    ]
+    for name, total in statement['totals'].items():
+        lines.append(f"{name.replace('_', ' ').title()}: ${total:.2f}")
+    lines.append(f"Closing Balance: ${statement['closing_balance']:.2f}")
+    if interest:
+        lines.append(f"Interest (posted tonight): ${format_amount(interest)}")
+    if fee:
+        lines.append(f"Maintenance fee (posted tonight): ${format_amount(fee)}")
+    lines.append("=" * 50)
+    for t in statement['transactions']:
+        lines.append(f"{t['date']} - {t['type'].upper()}: ${t['amount']:.2f}  Balance: ${t['balance_after']:.2f}")
+    return "\n".join(lines) + "\n\n"
+
+# The worker process's storage, opened once by open_worker() for all the
+# shards the process is given, and the ATM over all of it where storage is
+# not ranged
+worker_storage = None
+worker_atm = None
+
+def open_worker(storage_factory):
+    # Worker ATMs only read: they are never closed or saved, and they never
+    # show a dashboard, so they are given empty aggregates instead of
+    # reading the stored ones.
+    global worker_storage, worker_atm
+    worker_storage = storage_factory()
+    if not worker_storage.ranged:
+        worker_atm = ATM(worker_storage, aggregates=Aggregates())
+
+def shard_accounts(params, shard):
+    # The shard's accounts in number order: read on their own from a ranged
+    # storage, picked out of the worker's whole ATM otherwise
+    first, last = shard_range(shard, params['shards'])
+    if worker_storage.ranged:
+        accounts = ATM(worker_storage, aggregates=Aggregates(), accounts=(first, last)).accounts
+    else:
+        accounts = worker_atm.accounts
+    return [(acc_num, accounts.get(acc_num)) for acc_num in sorted(accounts) if first <= acc_num <= last]
+
+def process_shard(params, run_dir, shard):
+    # Phase 1 for one shard, in a worker process
+    start = time.perf_counter()
+    date = datetime.date.fromisoformat(params['date'])
+    prefix = shard_prefix(run_dir, shard)
+    summary = {'shard': shard, 'accounts': 0, 'postings': 0, 'interest': 0, 'fees': 0}
+    with open(prefix + '.postings.jsonl.tmp', 'w') as postings, open(prefix + '.statements.txt.tmp', 'w') as statements:
+        for acc_num, account in shard_accounts(params, shard):
+            if account is None or not account.is_active:
+                continue
+            interest, fee = charges(account.cents, params)
+            for kind, type_, cents in (('interest', 'deposit', interest), ('fee', 'withdrawal', fee)):
+                if cents:
+                    summary['postings'] += 1
+                    postings.write(compact_json({'type': type_, 'account': acc_num, 'amount': from_cents(cents),
+                                                 'kind': kind, 'line': summary['postings']}) + '\n')
+            statements.write(render_statement(account.statement(date.year, date.month), interest, fee))
+            summary['accounts'] += 1
+            summary['interest'] += interest
+            summary['fees'] += fee
+        for f in (postings, statements):
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(prefix + '.postings.jsonl.tmp', prefix + '.postings.jsonl')
+    os.replace(prefix + '.statements.txt.tmp', prefix + '.statements.txt')
+    summary['seconds'] = time.perf_counter() - start
+    write_atomic(prefix + '.done', json.dumps(summary))
+    return summary
+
+def run_shards(storage_factory, params, run_dir, workers):
+    # Phase 1: the shards without a .done marker, `workers` at a time.
+    # Returns (summaries, {shard: error}).
+    pending = [shard for shard in range(params['shards']) if not os.path.exists(shard_prefix(run_dir, shard) + '.done')]
+    summaries = []
+    failures = {}
+    if not pending:
+        return summaries, failures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=open_worker,
+                                                initargs=(storage_factory,)) as pool:
+        futures = {pool.submit(process_shard, params, run_dir, shard): shard for shard in pending}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                failures[futures[future]] = f"{type(e).__name__}: {e}"
+    return summaries, failures
+
+def read_postings(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def landed(atm, postings, marker):
+    # Whether a batch begun before a crash was written: any of its
+    # transactions after the recorded history lengths, with the merge date
+    for posting in postings:
+        account = atm.accounts.get(posting['account'])
+        start = marker['lengths'].get(posting['account'])
+        if account is None or start is None:
+            continue
+        for t in account.transaction_history[start:]:
+            if t.get('date') == marker['date'] and t.get('type') == posting['type'] and t.get('amount') == posting['amount']:
+                return True
+    return False
+
+def merge(atm, run_dir, params):
+    # Phase 2: posts every finished shard not merged yet, in shard order,
+    # dated at the end of the business day, or now if that is later.
+    # Returns (postings posted, [(shard, line, message), ...]).
+    posted = 0
+    errors = []
+    date = max(day_end(params), datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    for shard in range(params['shards']):
+        prefix = shard_prefix(run_dir, shard)
+        if os.path.exists(prefix + '.merged') or not os.path.exists(prefix + '.done'):
+            continue
+        postings = read_postings(prefix + '.postings.jsonl')
+        if os.path.exists(prefix + '.merging'):
+            with open(prefix + '.merging', 'r') as f:
+                if landed(atm, postings, json.load(f)):
+                    write_atomic(prefix + '.merged', json.dumps({'posted': None, 'recovered': True}))
+                    continue
+        lengths = {}
+        for posting in postings:
+            account = atm.accounts.get(posting['account'])
+            if account is not None:
+                lengths[posting['account']] = len(account.transaction_history)
+        write_atomic(prefix + '.merging', json.dumps({'date': date, 'lengths': lengths}))
+        # Not atomic, so a fee the balance no longer covers is skipped on
+        # its own; the chunk still makes the shard a single record. The bank
+        # posts these itself, so accounts locked by PIN attempts get them.
+        count, failed = atm.post_batch(postings, atomic=False, chunk=max(len(postings), 1), date=date,
+                                       bank_initiated=True)
+        write_atomic(prefix + '.merged', json.dumps({'posted': count, 'errors': failed}))
+        posted += count
+        errors += [(shard, line, message) for line, message in failed]
+    return posted, errors
+
+def start_run(out, params, atm):
+    # The run directory for params['date'], checking that a run started
+    # there before used the same parameters, or else that the business day
+    # can be run (check_date)
+    run_dir = os.path.join(out, params['date'])
+    os.makedirs(run_dir, exist_ok=True)
+    path = os.path.join(run_dir, 'run.json')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            started = json.load(f)
+        if started != params:
+            raise ValueError(f"{run_dir} holds a run with other parameters: {started}")
+    else:
+        check_date(atm, params)
+        write_atomic(path, json.dumps(params))
+    return run_dir
+
+def worker_storage_factory(args):
+    # Workers read with the parent's storage options, except that a journal
+    # is never checkpointed from a worker
+    worker_args = argparse.Namespace(**vars(args))
+    worker_args.checkpoint_every = sys.maxsize
+    return make_storage(worker_args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-of-day run: interest, maintenance fees and statements")
+    add_storage_arguments(parser)
+    parser.add_argument('--date', default=(datetime.date.today() - datetime.timedelta(days=1)).isoformat(),
+                        help="business date, YYYY-MM-DD (default yesterday)")
+    parser.add_argument('--rate', type=float, default=0.0, help="annual interest rate, e.g. 0.02")
+    parser.add_argument('--fee', type=parse_amount, default=0, help="monthly maintenance fee")
+    parser.add_argument('--fee-below', type=parse_amount, default=0,
+                        help="charge the fee on balances below this at month end")
+    parser.add_argument('--month-end', action='store_true',
+                        help="charge fees even if --date is not the last day of its month")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shards', type=int, help="default 4 per worker; fixed once a date's run has started")
+    parser.add_argument('--out', default='eod', help="run directories go here, one per date")
+    parser.add_argument('--no-merge', action='store_true', help="write the shard outputs only")
+    args = parser.parse_args()
+    date = datetime.date.fromisoformat(args.date)
+    params = {
+        'date': date.isoformat(),
+        'rate': args.rate,
+        'fee': args.fee,
+        'fee_below': args.fee_below,
+        'month_end': args.month_end or date.day == calendar.monthrange(date.year, date.month)[1],
+        'shards': args.shards or 4 * args.workers
+    }
+    # Open once first, so any import or crash recovery is done before the
+    # workers read
+    atm_system = ATM(make_storage(args))
+    try:
+        run_dir = start_run(args.out, params, atm_system)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        atm_system.close()
+    start = time.perf_counter()
+    summaries, failures = run_shards(functools.partial(worker_storage_factory, args), params, run_dir, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"{len(summaries)} shard(s) in {elapsed:.2f}s with {args.workers} worker(s): "
+          f"{sum(s['accounts'] for s in summaries)} account(s), {sum(s['postings'] for s in summaries)} posting(s), "
+          f"interest {format_amount(sum(s['interest'] for s in summaries))}, "
+          f"fees {format_amount(sum(s['fees'] for s in summaries))}")
+    for shard, error in sorted(failures.items()):
+        print(f"shard {shard}: {error}", file=sys.stderr)
+    if not args.no_merge:
+        atm_system = ATM(make_storage(args))
+        try:
+            posted, errors = merge(atm_system, run_dir, params)
+        finally:
+            atm_system.close()
+        for shard, line, message in errors:
+            print(f"shard {shard} line {line}: {message}", file=sys.stderr)
+        print(f"Posted {posted} posting(s), {len(errors)} rejected")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,696 @@
+import datetime
+import queue
+import threading
+import tkinter as tk
+from tkinter import messagebox, simpledialog, scrolledtext, ttk
+from history import TYPES
+from money import from_cents, parse_amount
+
+class PagedList:
+    # A ttk.Treeview fed by fetch(cursor, count) -> (rows, next cursor or
+    # None at the end), rows being tuples of column values. Opening shows
+    # one page; the next is fetched when the view is scrolled near the
+    # bottom, so the screen opens in the same time however long the list.
+    def __init__(self, parent, columns, fetch, page_size=50, height=15, empty="Nothing to show."):
+        self.fetch = fetch
+        self.page_size = page_size
+        self.empty = empty
+        self.frame = tk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=[name for name, width in columns], show='headings',
+                                 height=height)
+        for name, width in columns:
+            self.tree.heading(name, text=name)
+            self.tree.column(name, width=width, anchor=tk.W)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.scrolled)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.reset(fetch)
+    
+    def pack(self, **options):
+        self.frame.pack(**options)
+    
+    def reset(self, fetch):
+        # Starts over with another data source, e.g. after new filters
+        self.fetch = fetch
+        self.tree.delete(*self.tree.get_children())
+        self.cursor = None
+        self.more = True
+        self.pending = False
+        self.load_more()
+    
+    def load_more(self):
+        self.pending = False
+        if not self.more or not self.tree.winfo_exists():
+            return
+        rows, self.cursor = self.fetch(self.cursor, self.page_size)
+        self.more = self.cursor is not None
+        for row in rows:
+            self.tree.insert('', tk.END, values=row)
+        if not self.tree.get_children():
+            self.tree.insert('', tk.END, values=(self.empty,))
+    
+    def scrolled(self, first, last):
+        self.scrollbar.set(first, last)
+        # Also fires when a page does not fill the view, which fetches
+        # until it does
+        if float(last) > 0.9 and self.more and not self.pending:
+            self.pending = True
+            self.tree.after_idle(self.load_more)
+
+class PersistenceWorker:
+    # Runs the GUI's operations and the saves that follow them on one
+    # background thread, in the order submitted, so the Tk event loop never
+    # waits for the disk. The results come back through a queue polled with
+    # root.after: on_done(result) or on_error(exception) then runs on the Tk
+    # thread, once the job (save included) has finished.
+    POLL_MS = 50
+    
+    def __init__(self, root):
+        self.root = root
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.work, name="persistence", daemon=True)
+        self.thread.start()
+        self.root.after(self.POLL_MS, self.poll)
+    
+    def submit(self, job, on_done, on_error):
+        self.jobs.put((job, on_done, on_error))
+    
+    def work(self):
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                return
+            job, on_done, on_error = item
+            try:
+                result = job()
+            except Exception as e:
+                self.results.put((on_error, e))
+            else:
+                self.results.put((on_done, result))
+    
+    def poll(self):
+        try:
+            while True:
+                try:
+                    callback, value = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                callback(value)
+        finally:
+            self.root.after(self.POLL_MS, self.poll)
+    
+    def stop(self):
+        # Lets the jobs already queued finish writing
+        self.jobs.put(None)
+        self.thread.join()
+
+class ATMGUI:
+    def __init__(self, atm):
+        self.atm = atm
+        self.session = None
+        self.root = tk.Tk()
+        self.root.title("ATM Banking System")
+        self.root.geometry("600x500")
+        self.worker = PersistenceWorker(self.root)
+        
+        self.create_main_menu()
+    
+    def clear_frame(self):
+        for widget in self.root.winfo_children():
+            widget.destroy()
+    
+    def run_pending(self, text, job, on_done, back_command):
+        # Shows `text` while job() runs on the persistence worker; a job that
+        # raises (a failed write) is reported and leads back to back_command
+        self.clear_frame()
+        tk.Label(self.root, text=text, font=("Arial", 14)).pack(pady=40)
+        tk.Label(self.root, text="Please wait while your transaction is saved.").pack()
+        
+        def failed(error):
+            messagebox.showerror("Error", f"The transaction could not be saved: {error}")
+            back_command()
+        
+        self.worker.submit(job, on_done, failed)
+    
+    def finish_operation(self, result, back_command):
+        # result: (success, message, receipt or None) from a job below
+        success, message, receipt = result
+        if success:
+            messagebox.showinfo("Success", f"{message}\n\n{receipt}" if receipt else message)
+        else:
+            messagebox.showerror("Error", message)
+        back_command()
+    
+    def create_main_menu(self):
+        self.clear_frame()
+        
+        tk.Label(self.root, text="Welcome to ATM Banking System", font=("Arial", 16)).pack(pady=20)
+        
+        tk.Button(self.root, text="Customer Login", command=self.create_customer_login, width=20).pack(pady=10)
+        tk.Button(self.root, text="Admin Login", command=self.create_admin_login, width=20).pack(pady=10)
+        tk.Button(self.root, text="Create New Account", command=self.create_new_account, width=20).pack(pady=10)
+        tk.Button(self.root, text="Exit", command=self.root.quit, width=20).pack(pady=10)
+    
+    def create_customer_login(self):
+        self.clear_frame()
+        
+        tk.Label(self.root, text="Customer Login", font=("Arial", 14)).pack(pady=10)
+        
+        tk.Label(self.root, text="Account Number:").pack()
+        self.acc_num_entry = tk.Entry(self.root)
+        self.acc_num_entry.pack()
+        
+        tk.Label(self.root, text="PIN:").pack()
+        self.pin_entry = tk.Entry(self.root, show="*")
+        self.pin_entry.pack()
+        
+        tk.Button(self.root, text="Login", command=self.handle_customer_login).pack(pady=10)
+        tk.Button(self.root, text="Back", command=self.create_main_menu).pack(pady=5)
+    
+    def handle_customer_login(self):
+        account_number = self.acc_num_entry.get()
+        pin = self.pin_entry.get()
+        
+        # A lockout is saved by authenticate, so it runs on the worker too
+        def logged_in(result):
+            self.session, message = result
+            if self.session:
+                self.create_customer_menu()
+            else:
+                messagebox.showerror("Login Failed", message)
+                self.create_customer_login()
+        
+        self.run_pending("Logging in...", lambda: self.atm.authenticate(account_number, pin), logged_in,
+                         self.create_customer_login)
+    
+    def create_admin_login(self):
+        self.clear_frame()
+        
+        tk.Label(self.root, text="Admin Login", font=("Arial", 14)).pack(pady=10)
+        
+        tk.Label(self.root, text="Username:").pack()
+        self.admin_user_entry = tk.Entry(self.root)
+        self.admin_user_entry.pack()
+        
+        tk.Label(self.root, text="Password:").pack()
+        self.admin_pass_entry = tk.Entry(self.root, show="*")
+        self.admin_pass_entry.pack()
+        
+        tk.Button(self.root, text="Login", command=self.handle_admin_login).pack(pady=10)
+        tk.Button(self.root, text="Back", command=self.create_main_menu).pack(pady=5)
+    
+    def handle_admin_login(self):
+        username = self.admin_user_entry.get()
+        password = self.admin_pass_entry.get()
+        
+        self.session = self.atm.authenticate_admin(username, password)
+        if self.session:
+            self.create_admin_menu()
+        else:
+            messagebox.showerror("Login Failed", "Invalid admin credentials")
+    
+    def create_new_account(self):
+        self.clear_frame()
+        
+        tk.Label(self.root, text="Create New Account", font=("Arial", 14)).pack(pady=10)
+        
+        tk.Label(self.root, text="Full Name:").pack()
+        self.name_entry = tk.Entry(self.root)
+        self.name_entry.pack()
+        
+        tk.Label(self.root, text="PIN (4 digits):").pack()
+        self.new_pin_entry = tk.Entry(self.root, show="*")
+        self.new_pin_entry.pack()
+        
+        tk.Label(self.root, text="Confirm PIN:").pack()
+        self.confirm_pin_entry = tk.Entry(self.root, show="*")
+        self.confirm_pin_entry.pack()
+        
+        tk.Label(self.root, text="Initial Deposit (optional):").pack()
+        self.deposit_entry = tk.Entry(self.root)
+        self.deposit_entry.pack()
+        
+        tk.Button(self.root, text="Create Account", command=self.handle_create_account).pack(pady=10)
+        tk.Button(self.root, text="Back", command=self.create_main_menu).pack(pady=5)
+    
+    def handle_create_account(self):
+        name = self.name_entry.get()
+        pin = self.new_pin_entry.get()
+        confirm_pin = self.confirm_pin_entry.get()
+        deposit = self.deposit_entry.get()
+        
+        if not name:
+            messagebox.showerror("Error", "Name is required")
+            return
+        
+        if len(pin) != 4 or not pin.isdigit():
+            messagebox.showerror("Error", "PIN must be 4 digits")
+            return
+        
+        if pin != confirm_pin:
+            messagebox.showerror("Error", "PINs do not match")
+            return
+        
+        try:
+            initial_deposit = from_cents(parse_amount(deposit)) if deposit else 0
+            if initial_deposit < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Invalid deposit amount")
+            return
+        
+        def created(account_number):
+            # A RemoteATM answers (None, message) when the server refuses
+            if isinstance(account_number, tuple):
+                messagebox.showerror("Error", account_number[1])
+                self.create_main_menu()
+                return
+            messagebox.showinfo("Success", f"Account created successfully!\nYour account number is: {account_number}")
+            self.create_main_menu()
+        
+        self.run_pending("Creating account...", lambda: self.atm.create_account(name, pin, initial_deposit),
+                         created, self.create_main_menu)
+    
+    def create_customer_menu(self):
+        self.clear_frame()
+        
+        tk.Label(self.root, text=f"Welcome, Account {self.session.account.account_number}", font=("Arial", 14)).pack(pady=10)
+        
+        buttons = [
+            ("Check Balance", self.show_balance),
+            ("Deposit Money", self.create_deposit),
+            ("Withdraw Money", self.create_withdraw),
+            ("Transfer Money", self.create_transfer),
+            ("Transaction History", self.show_transaction_history),
+            ("Monthly Statement", self.show_statement),
+            ("Change PIN", self.create_change_pin),
+            ("Print Receipt", self.print_receipt),
+            ("Logout", self.logout)
+        ]
+        
+        for text, command in buttons:
+            tk.Button(self.root, text=text, command=command, width=20).pack(pady=5)
+    
+    def show_balance(self):
+        balance = self.session.account.get_balance()
+        messagebox.showinfo("Account Balance", f"Your current balance is: ${balance:.2f}")
+    
+    def ask_amount(self, title, prompt):
+        # Typed amounts are read as exact cents; None if cancelled or invalid
+        text = simpledialog.askstring(title, prompt)
+        if text is None:
+            return None
+        try:
+            return from_cents(parse_amount(text))
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid amount: {e}")
+            return None
+    
+    def create_deposit(self):
+        amount = self.ask_amount("Deposit", "Enter amount to deposit:")
+        if amount is not None:
+            account = self.session.account
+            
+            def deposit():
+                success, message = account.deposit(amount)
+                if not success:
+                    return False, message, None
+                self.atm.save_accounts()
+                return True, message, account.generate_receipt('deposit', amount)
+            
+            self.run_pending("Processing deposit...", deposit,
+                             lambda result: self.finish_operation(result, self.create_customer_menu),
+                             self.create_customer_menu)
+    
+    def create_withdraw(self):
+        amount = self.ask_amount("Withdraw", "Enter amount to withdraw:")
+        if amount is not None:
+            account = self.session.account
+            
+            def withdraw():
+                success, message = account.withdraw(amount)
+                if not success:
+                    return False, message, None
+                self.atm.save_accounts()
+                return True, message, account.generate_receipt('withdrawal', amount)
+            
+            self.run_pending("Processing withdrawal...", withdraw,
+                             lambda result: self.finish_operation(result, self.create_customer_menu),
+                             self.create_customer_menu)
+    
+    def create_transfer(self):
+        self.clear_frame()
+        
+        tk.Label(self.root, text="Transfer Money", font=("Arial", 14)).pack(pady=10)
+        
+        tk.Label(self.root, text="Recipient Account Number:").pack()
+        self.recipient_entry = tk.Entry(self.root)
+        self.recipient_entry.pack()
+        
+        tk.Label(self.root, text="Amount:").pack()
+        self.transfer_amount_entry = tk.Entry(self.root)
+        self.transfer_amount_entry.pack()
+        
+        tk.Button(self.root, text="Transfer", command=self.handle_transfer).pack(pady=10)
+        tk.Button(self.root, text="Back", command=self.create_customer_menu).pack(pady=5)
+    
+    def handle_transfer(self):
+        recipient_number = self.recipient_entry.get()
+        amount_str = self.transfer_amount_entry.get()
+        
+        try:
+            amount = from_cents(parse_amount(amount_str))
+            if amount <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Invalid amount")
+            return
+        
+        recipient_account = self.atm.get_account(recipient_number)
+        if recipient_account is None:
+            messagebox.showerror("Error", "Recipient account not found")
+            return
+        
+        if recipient_number == self.session.account.account_number:
+            messagebox.showerror("Error", "Cannot transfer to yourself")
+            return
+        
+        account = self.session.account
+        
+        def transfer():
+            success, message = account.transfer(amount, recipient_account)
+            if not success:
+                return False, message, None
+            self.atm.save_accounts()
+            return True, message, account.generate_receipt('transfer_out', amount, recipient_number)
+        
+        self.run_pending("Processing transfer...", transfer,
+                         lambda result: self.finish_operation(result, self.create_customer_menu),
+                         self.create_customer_menu)
+    
+    def show_transaction_history(self):
+        self.show_history_pages("Transaction History", self.session.account, self.create_customer_menu)
+    
+    def insert_transaction(self, text_area, t):
+        text_area.insert(tk.END, 
+            f"{t['date']} - {t['type'].upper()}: ${t['amount']:.2f}\n"
+            f"Balance: ${t['balance_after']:.2f}\n")
+        if 'to_account' in t:
+            text_area.insert(tk.END, f"To: {t['to_account']}\n")
+        if 'from_account' in t:
+            text_area.insert(tk.END, f"From: {t['from_account']}\n")
+        text_area.insert(tk.END, "-"*50 + "\n")
+    
+    def transaction_row(self, t):
+        return (t['date'], t['type'].replace('_', ' ').title(), f"${t['amount']:.2f}",
+                f"${t['balance_after']:.2f}", t.get('to_account', t.get('from_account', '')))
+    
+    def show_history_pages(self, title, account, back_command, page_size=50, filters=False):
+        # Newest transactions first in a PagedList: older pages are only read
+        # from storage as the list is scrolled down to them. With filters, a
+        # date range and type can be applied instead.
+        self.clear_frame()
+        
+        tk.Label(self.root, text=title, font=("Arial", 14)).pack(pady=10)
+        
+        if filters:
+            filter_row = tk.Frame(self.root)
+            filter_row.pack()
+            tk.Label(filter_row, text="From (YYYY-MM-DD):").pack(side=tk.LEFT)
+            from_entry = tk.Entry(filter_row, width=12)
+            from_entry.pack(side=tk.LEFT)
+            tk.Label(filter_row, text="To:").pack(side=tk.LEFT)
+            to_entry = tk.Entry(filter_row, width=12)
+            to_entry.pack(side=tk.LEFT)
+            type_choice = tk.StringVar(value="all")
+            tk.OptionMenu(filter_row, type_choice, "all", *TYPES).pack(side=tk.LEFT)
+        
+        def fetch(cursor, count):
+            history, cursor = account.get_transaction_page(cursor, count)
+            return [self.transaction_row(t) for t in history], cursor
+        
+        columns = [("Date", 150), ("Type", 100), ("Amount", 90), ("Balance", 90), ("Account", 90)]
+        transactions = PagedList(self.root, columns, fetch, page_size, empty="No transactions yet.")
+        transactions.pack(pady=10, fill=tk.BOTH, expand=True)
+        
+        def apply_filters():
+            try:
+                start = datetime.datetime.strptime(from_entry.get() or "1970-01-01", "%Y-%m-%d")
+                end = datetime.datetime.strptime(to_entry.get() or "9999-12-30", "%Y-%m-%d") + datetime.timedelta(days=1)
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be YYYY-MM-DD")
+                return
+            types = None if type_choice.get() == "all" else (type_choice.get(),)
+            rows = [self.transaction_row(t) for t in reversed(account.get_transactions_between(start, end, types))]
+            
+            def fetch_filtered(cursor, count):
+                start = cursor or 0
+                return rows[start:start + count], (start + count if start + count < len(rows) else None)
+            
+            transactions.empty = "No matching transactions."
+            transactions.reset(fetch_filtered)
+        
+        if filters:
+            tk.Button(filter_row, text="Apply", command=apply_filters).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.root, text="Back", command=back_command).pack(pady=5)
+    
+    def show_statement(self):
+        period = simpledialog.askstring("Monthly Statement", "Enter month (YYYY-MM):")
+        if not period:
+            return
+        try:
+            month = datetime.datetime.strptime(period, "%Y-%m")
+        except ValueError:
+            messagebox.showerror("Error", "Month must be YYYY-MM")
+            return
+        statement = self.session.account.get_statement(month.year, month.month)
+        if statement is None:
+            messagebox.showerror("Error", "Account is locked. Please contact admin.")
+            return
+        self.clear_frame()
+        
+        tk.Label(self.root, text=f"Statement for {statement['period']}", font=("Arial", 14)).pack(pady=10)
+        
+        text_area = scrolledtext.ScrolledText(self.root, width=70, height=20)
+        text_area.pack(pady=10)
+        text_area.insert(tk.END,
+            f"Account: {statement['account_number']}\n"
+            f"Opening Balance: ${statement['opening_balance']:.2f}\n")
+        for name, total in statement['totals'].items():
+            text_area.insert(tk.END, f"{name.replace('_', ' ').title()}: ${total:.2f}\n")
+        text_area.insert(tk.END, f"Closing Balance: ${statement['closing_balance']:.2f}\n" + "="*50 + "\n")
+        for t in statement['transactions']:
+            self.insert_transaction(text_area, t)
+        text_area.config(state=tk.DISABLED)
+        tk.Button(self.root, text="Back", command=self.create_customer_menu).pack(pady=5)
+    
+    def create_change_pin(self):
+        old_pin = simpledialog.askstring("Change PIN", "Enter current PIN:", show='*')
+        if old_pin is None:
+            return
+        
+        new_pin = simpledialog.askstring("Change PIN", "Enter new PIN (4 digits):", show='*')
+        if new_pin is None:
+            return
+        
+        confirm_pin = simpledialog.askstring("Change PIN", "Confirm new PIN:", show='*')
+        if confirm_pin is None:
+            return
+        
+        if new_pin != confirm_pin:
+            messagebox.showerror("Error", "PINs do not match")
+            return
+        
+        account = self.session.account
+        
+        def change_pin():
+            success, message = account.change_pin(old_pin, new_pin)
+            if success:
+                self.atm.save_accounts()
+            return success, message, None
+        
+        self.run_pending("Changing PIN...", change_pin,
+                         lambda result: self.finish_operation(result, self.create_customer_menu),
+                         self.create_customer_menu)
+    
+    def print_receipt(self):
+        # In a real system, this would connect to a receipt printer
+        # For this demo, we'll just show the last transaction
+        history, cursor = self.session.account.get_transaction_page(limit=1)
+        if not history:
+            messagebox.showinfo("Receipt", "No transactions to print")
+            return
+        
+        last_trans = history[0]
+        receipt = self.session.account.generate_receipt(
+            last_trans['type'],
+            last_trans['amount'],
+            last_trans.get('to_account', last_trans.get('from_account', None))
+        )
+        messagebox.showinfo("Receipt", receipt)
+    
+    def create_admin_menu(self):
+        self.clear_frame()
+        
+        tk.Label(self.root, text=f"Admin Panel - Logged in as {self.session.admin}", font=("Arial", 14)).pack(pady=10)
+        
+        buttons = [
+            ("Dashboard", self.show_dashboard),
+            ("Search Accounts", self.show_all_accounts),
+            ("Unlock Account", self.unlock_account),
+            ("Close Account", self.close_account),
+            ("View Account Details", self.view_account_details),
+            ("Logout", self.admin_logout)
+        ]
+        
+        for text, command in buttons:
+            tk.Button(self.root, text=text, command=command, width=20).pack(pady=5)
+    
+    def show_dashboard(self):
+        summary = self.atm.dashboard()
+        self.clear_frame()
+        
+        tk.Label(self.root, text="Dashboard", font=("Arial", 14)).pack(pady=10)
+        tk.Label(self.root, text=f"Accounts: {summary['accounts']}    Locked: {summary['locked']}    "
+                                 f"Total held: ${summary['total_balance']:.2f}").pack(pady=5)
+        
+        text_area = scrolledtext.ScrolledText(self.root, width=70, height=12)
+        text_area.pack(pady=10)
+        text_area.insert(tk.END, f"{'Date':<12}" + "".join(f"{name.replace('_', ' ').title():>14}" for name in TYPES) + "\n")
+        for day, volumes in summary['volumes']:
+            cells = []
+            for name in TYPES:
+                count, amount = volumes.get(name, (0, 0))
+                cells.append(f"{count:>4} ${amount:>8.2f}")
+            text_area.insert(tk.END, f"{day:<12}" + "".join(f"{cell:>14}" for cell in cells) + "\n")
+        text_area.config(state=tk.DISABLED)
+        
+        tk.Button(self.root, text="Refresh", command=self.show_dashboard).pack(pady=5)
+        tk.Button(self.root, text="Back", command=self.create_admin_menu).pack(pady=5)
+    
+    def show_all_accounts(self, page_size=50):
+        # Search by number prefix, status and balance range, sorted by number
+        # or balance, in a PagedList fed from the ATM's account indexes
+        self.clear_frame()
+        
+        tk.Label(self.root, text="Accounts", font=("Arial", 14)).pack(pady=10)
+        
+        filter_row = tk.Frame(self.root)
+        filter_row.pack()
+        tk.Label(filter_row, text="Number starts with:").pack(side=tk.LEFT)
+        prefix_entry = tk.Entry(filter_row, width=10)
+        prefix_entry.pack(side=tk.LEFT)
+        status_choice = tk.StringVar(value="any")
+        tk.OptionMenu(filter_row, status_choice, "any", "locked", "unlocked").pack(side=tk.LEFT)
+        tk.Label(filter_row, text="Balance from:").pack(side=tk.LEFT)
+        min_entry = tk.Entry(filter_row, width=8)
+        min_entry.pack(side=tk.LEFT)
+        tk.Label(filter_row, text="to:").pack(side=tk.LEFT)
+        max_entry = tk.Entry(filter_row, width=8)
+        max_entry.pack(side=tk.LEFT)
+        
+        sort_row = tk.Frame(self.root)
+        sort_row.pack(pady=5)
+        tk.Label(sort_row, text="Sort by:").pack(side=tk.LEFT)
+        sort_choice = tk.StringVar(value="number")
+        tk.OptionMenu(sort_row, sort_choice, "number", "balance").pack(side=tk.LEFT)
+        descending = tk.BooleanVar(value=False)
+        tk.Checkbutton(sort_row, text="Descending", variable=descending).pack(side=tk.LEFT)
+        
+        def rows(query):
+            def fetch(cursor, count):
+                accounts, cursor = self.atm.query_accounts(cursor=cursor, limit=count, **query)
+                return [(account['account_number'], f"${account['balance']:.2f}",
+                         ("Active" if account['is_active'] else "Inactive") + (" (Locked)" if account['locked'] else ""),
+                         account['transaction_count']) for account in accounts], cursor
+            return fetch
+        
+        columns = [("Account", 110), ("Balance", 110), ("Status", 140), ("Transactions", 100)]
+        accounts = PagedList(self.root, columns, rows({}), page_size, empty="No accounts found.")
+        accounts.pack(pady=10, fill=tk.BOTH, expand=True)
+        
+        def search():
+            try:
+                min_balance = from_cents(parse_amount(min_entry.get())) if min_entry.get().strip() else None
+                max_balance = from_cents(parse_amount(max_entry.get())) if max_entry.get().strip() else None
+            except ValueError:
+                messagebox.showerror("Error", "Invalid balance")
+                return
+            accounts.reset(rows({
+                'prefix': prefix_entry.get().strip() or None,
+                'locked': {'any': None, 'locked': True, 'unlocked': False}[status_choice.get()],
+                'min_balance': min_balance,
+                'max_balance': max_balance,
+                'sort': sort_choice.get(),
+                'descending': descending.get()
+            }))
+        
+        tk.Button(sort_row, text="Search", command=search).pack(side=tk.LEFT, padx=5)
+        tk.Button(self.root, text="Back", command=self.create_admin_menu).pack(pady=5)
+    
+    def unlock_account(self):
+        account_number = simpledialog.askstring("Unlock Account", "Enter account number to unlock:")
+        if account_number:
+            admin = self.session.admin
+            self.run_pending("Unlocking account...",
+                             lambda: self.atm.unlock_account(account_number, admin) + (None,),
+                             lambda result: self.finish_operation(result, self.create_admin_menu),
+                             self.create_admin_menu)
+    
+    def close_account(self):
+        account_number = simpledialog.askstring("Close Account", "Enter account number to close:")
+        if account_number:
+            admin = self.session.admin
+            self.run_pending("Closing account...",
+                             lambda: self.atm.close_account(account_number, admin) + (None,),
+                             lambda result: self.finish_operation(result, self.create_admin_menu),
+                             self.create_admin_menu)
+    
+    def view_account_details(self):
+        account_number = simpledialog.askstring("Account Details", "Enter account number:")
+        account = self.atm.account_info(account_number) if account_number else None
+        if account is not None:
+            self.clear_frame()
+            
+            tk.Label(self.root, text=f"Account Details: {account_number}", font=("Arial", 14)).pack(pady=10)
+            
+            status = "Active" if account['is_active'] else "Inactive"
+            locked = " (Locked)" if account['locked'] else ""
+            
+            info = f"""
+            Account Number: {account_number}
+            Balance: ${account['balance']:.2f}
+            Status: {status}{locked}
+            PIN Attempts: {account['pin_attempts']}
+            Transaction Count: {account['transaction_count']}
+            """
+            
+            tk.Label(self.root, text=info).pack(pady=10)
+            
+            tk.Button(self.root, text="View Transactions", 
+                     command=lambda: self.show_account_transactions(account_number)).pack(pady=5)
+            tk.Button(self.root, text="Back", command=self.create_admin_menu).pack(pady=5)
+        elif account_number:
+            messagebox.showerror("Error", "Account not found")
+    
+    def show_account_transactions(self, account_number):
+        account = self.atm.get_account(account_number)
+        if account is None:
+            messagebox.showerror("Error", "Account not found")
+            return
+        self.show_history_pages(f"Transactions for Account {account_number}", account, self.create_admin_menu,
+                                filters=True)
+    
+    def logout(self):
+        self.session = None
+        self.create_main_menu()
+    
+    def admin_logout(self):
+        self.session = None
+        self.create_main_menu()
+    
+    def run(self):
+        self.root.mainloop()
+        self.worker.stop()
@@ -0,0 +1,279 @@
+import array
+import bisect
+import datetime
+from money import to_cents
+
+TYPES = ('deposit', 'withdrawal', 'transfer_in', 'transfer_out')
+TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+NO_ACCOUNT = -1
+
+def to_timestamp(date):
+    # Dates are naive local wall-clock strings; they are stored as seconds
+    # since 1970-01-01 on that same clock, so the round trip is exact.
+    if len(date) == 19:
+        days = datetime.date(int(date[0:4]), int(date[5:7]), int(date[8:10])).toordinal() - EPOCH_ORDINAL
+        return days * 86400 + int(date[11:13]) * 3600 + int(date[14:16]) * 60 + int(date[17:19])
+    return datetime_timestamp(datetime.datetime.strptime(date, DATE_FORMAT))
+
+def datetime_timestamp(moment):
+    return (moment.toordinal() - EPOCH_ORDINAL) * 86400 + moment.hour * 3600 + moment.minute * 60 + moment.second
+
+def format_timestamp(timestamp):
+    days, seconds = divmod(timestamp, 86400)
+    day = datetime.date.fromordinal(days + EPOCH_ORDINAL)
+    return f"{day.isoformat()} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+class Transactions:
+    # One account's transactions kept as parallel arrays instead of a dict
+    # per entry: type code, amount and balance in integer cents, timestamp
+    # and the other account of a transfer. Indexing returns the same dicts
+    # BankAccount creates. Anything the columns cannot hold exactly (an
+    # unknown type, fractions of a cent, extra keys) is kept as its original
+    # dict in `irregular`.
+    __slots__ = ('account_number', 'types', 'amounts', 'times', 'counterparties', 'balances', 'irregular')
+    
+    def __init__(self, account_number, transactions=()):
+        self.account_number = account_number
+        self.types = array.array('b')
+        self.amounts = array.array('q')
+        self.times = array.array('q')
+        self.counterparties = array.array('q')
+        self.balances = array.array('q')
+        self.irregular = None
+        for transaction in transactions:
+            self.append(transaction)
+    
+    def __len__(self):
+        return len(self.types)
+    
+    def append(self, transaction):
+        columns = self._columns(transaction)
+        if columns is None:
+            if self.irregular is None:
+                self.irregular = {}
+            self.irregular[len(self.types)] = dict(transaction)
+            # Keep the times column sorted so date lookups can bisect it
+            try:
+                timestamp = to_timestamp(transaction['date'])
+            except (KeyError, TypeError, ValueError):
+                timestamp = self.times[-1] if self.times else 0
+            columns = (NO_ACCOUNT, 0, timestamp, NO_ACCOUNT, 0)
+        type_code, amount, timestamp, counterparty, balance = columns
+        self.types.append(type_code)
+        self.amounts.append(amount)
+        self.times.append(timestamp)
+        self.counterparties.append(counterparty)
+        self.balances.append(balance)
+    
+    def drop(self, count):
+        # Removes the first `count` transactions
+        for column in (self.types, self.amounts, self.times, self.counterparties, self.balances):
+            del column[:count]
+        if self.irregular is not None:
+            self.irregular = {index - count: transaction for index, transaction in self.irregular.items()
+                              if index >= count} or None
+    
+    def _columns(self, transaction):
+        type_code = TYPE_CODES.get(transaction.get('type'))
+        if type_code is None:
+            return None
+        if type_code == 0:
+            own_key, other_key = 'to_account', None
+        elif type_code == 1:
+            own_key, other_key = 'from_account', None
+        elif type_code == 2:
+            own_key, other_key = 'to_account', 'from_account'
+        else:
+            own_key, other_key = 'from_account', 'to_account'
+        if len(transaction) != (5 if other_key is None else 6):
+            return None
+        if transaction.get(own_key) != self.account_number:
+            return None
+        counterparty = NO_ACCOUNT
+        if other_key is not None:
+            other = transaction.get(other_key)
+            if not isinstance(other, str) or len(other) != 8 or not other.isdigit():
+                return None
+            counterparty = int(other)
+        try:
+            amount = to_cents(transaction['amount'])
+            balance = to_cents(transaction['balance_after'])
+            timestamp = to_timestamp(transaction['date'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if amount / 100 != transaction['amount'] or balance / 100 != transaction['balance_after']:
+            return None
+        return type_code, amount, timestamp, counterparty, balance
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.transaction(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transaction index out of range")
+        return self.transaction(index)
+    
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.transaction(index)
+    
+    def transaction(self, index):
+        if self.irregular is not None and index in self.irregular:
+            return dict(self.irregular[index])
+        type_code = self.types[index]
+        transaction = {
+            'type': TYPES[type_code],
+            'amount': self.amounts[index] / 100,
+            'date': format_timestamp(self.times[index]),
+            'balance_after': self.balances[index] / 100
+        }
+        if type_code == 0:
+            transaction['to_account'] = self.account_number
+        elif type_code == 1:
+            transaction['from_account'] = self.account_number
+        elif type_code == 2:
+            transaction['from_account'] = f"{self.counterparties[index]:08d}"
+            transaction['to_account'] = self.account_number
+        else:
+            transaction['from_account'] = self.account_number
+            transaction['to_account'] = f"{self.counterparties[index]:08d}"
+        return transaction
+
+class History:
+    # One account's transactions, oldest first, in three tiers: the first
+    # `archived` were moved to the archive (an archive.Archive), the next
+    # `stored` stay in storage and are read on demand through
+    # reader(start, stop), and only the ones added since startup are kept
+    # in memory, in columns. Positions count from the oldest archived one,
+    # so they do not change when transactions are archived or saved.
+    def __init__(self, account_number, transactions=None, reader=None, stored=0, archive=None, archived=0):
+        self.reader = reader
+        self.stored = stored if reader is not None else 0
+        self.recent = Transactions(account_number, transactions if transactions is not None else ())
+        self.archive = archive
+        self.archived = archived
+    
+    def __len__(self):
+        return self.archived + self.stored + len(self.recent)
+    
+    def append(self, transaction):
+        self.recent.append(transaction)
+    
+    def persisted(self, reader, count):
+        # Storage now holds the first `count` live transactions, read through
+        # `reader` from here on; those still in memory are dropped
+        if self.stored < count <= self.stored + len(self.recent):
+            self.recent.drop(count - self.stored)
+            self.reader = reader
+            self.stored = count
+    
+    def move_to_archive(self, count):
+        # The oldest `count` live transactions are in the archive now
+        self.archived += count
+        from_stored = min(count, self.stored)
+        if from_stored:
+            self.reader.drop(from_stored)
+            self.stored -= from_stored
+        self.recent.drop(count - from_stored)
+    
+    def slice(self, start, stop):
+        start = max(start, 0)
+        stop = min(stop, len(self))
+        if start >= stop:
+            return []
+        transactions = []
+        if start < self.archived:
+            if self.archive is not None:
+                transactions = self.archive.read(self.recent.account_number, start, min(stop, self.archived),
+                                                 self.archived)
+            start = self.archived
+        live = self.stored + self.archived
+        if start < live and stop > start:
+            transactions += self.reader(start - self.archived, min(stop, live) - self.archived)
+        if stop > live:
+            transactions += self.recent[max(start - live, 0):stop - live]
+        return transactions
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            return self.slice(start, stop)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transaction index out of range")
+        return self.slice(index, index + 1)[0]
+    
+    def __iter__(self):
+        for start in range(0, self.archived, 1000):
+            yield from self.slice(start, min(start + 1000, self.archived))
+        yield from self.live()
+    
+    def live(self):
+        # The transactions not archived
+        for start in range(0, self.stored, 1000):
+            yield from self.reader(start, min(start + 1000, self.stored))
+        yield from self.recent
+    
+    def page(self, cursor=None, limit=10):
+        # Newest first. The cursor is the position just before the oldest
+        # transaction returned so far, so new transactions arriving while
+        # someone is paging do not shift the pages.
+        stop = len(self) if cursor is None else cursor
+        start = max(stop - limit, 0)
+        transactions = self.slice(start, stop)
+        transactions.reverse()
+        return transactions, (start if start > 0 else None)
+    
+    # Date lookups take timestamps from to_timestamp() and rely on
+    # transactions being appended in time order, which holds as long as the
+    # wall clock does not step backwards.
+    def between(self, start, end, types=None):
+        # Transactions with start <= timestamp < end, oldest first, optionally
+        # only those whose type is in `types`
+        transactions = []
+        if self.archived and self.archive is not None:
+            transactions = self.archive.between(self.recent.account_number, start, end, self.archived)
+        if self.stored:
+            transactions += self.reader.between(start, end)
+        if types is not None:
+            transactions = [t for t in transactions if t['type'] in types]
+        recent = self.recent
+        first = bisect.bisect_left(recent.times, start)
+        last = bisect.bisect_left(recent.times, end, first)
+        codes = None if types is None else {TYPE_CODES.get(name, NO_ACCOUNT) for name in types}
+        for index in range(first, last):
+            if codes is not None:
+                if recent.irregular is not None and index in recent.irregular:
+                    if recent.irregular[index].get('type') not in types:
+                        continue
+                elif recent.types[index] not in codes:
+                    continue
+            transactions.append(recent.transaction(index))
+        return transactions
+    
+    def last_before(self, timestamp):
+        # Latest transaction strictly before `timestamp`, or None
+        index = bisect.bisect_left(self.recent.times, timestamp)
+        if index:
+            return self.recent.transaction(index - 1)
+        if self.stored:
+            transaction = self.reader.last_before(timestamp)
+            if transaction is not None:
+                return transaction
+        if self.archived and self.archive is not None:
+            return self.archive.last_before(self.recent.account_number, timestamp, self.archived)
+        return None
+    
+    def live_before(self, timestamp):
+        # The live transactions older than `timestamp`, which come first
+        transactions = []
+        if self.stored:
+            transactions = self.reader.between(datetime_timestamp(datetime.datetime.min), timestamp)
+        index = bisect.bisect_left(self.recent.times, timestamp)
+        return transactions + self.recent[0:index]
@@ -0,0 +1,221 @@
+import bisect
+import itertools
+from money import to_cents
+
+class SortedList:
+    # Sorted, distinct items kept in blocks of up to 2 * LOAD, with each
+    # block's last item in `maxes`, so adding or removing one moves the
+    # items of one block instead of the whole list: O(log n + LOAD) per
+    # update. Positions count across the blocks; the first position of
+    # each block is worked out again only when a query needs it after an
+    # update.
+    LOAD = 500
+    
+    def __init__(self, items=()):
+        items = sorted(items)
+        self.blocks = [items[start:start + self.LOAD] for start in range(0, len(items), self.LOAD)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(items)
+        self.starts = None
+    
+    def __len__(self):
+        return self.size
+    
+    def add(self, item):
+        self.size += 1
+        self.starts = None
+        if not self.blocks:
+            self.blocks.append([item])
+            self.maxes.append(item)
+            return
+        index = min(bisect.bisect_left(self.maxes, item), len(self.blocks) - 1)
+        block = self.blocks[index]
+        bisect.insort(block, item)
+        self.maxes[index] = block[-1]
+        if len(block) > 2 * self.LOAD:
+            self.blocks[index:index + 1] = [block[:self.LOAD], block[self.LOAD:]]
+            self.maxes[index:index + 1] = [block[self.LOAD - 1], block[-1]]
+    
+    def remove(self, item):
+        index = bisect.bisect_left(self.maxes, item)
+        block = self.blocks[index]
+        del block[bisect.bisect_left(block, item)]
+        self.size -= 1
+        self.starts = None
+        if block:
+            self.maxes[index] = block[-1]
+        else:
+            del self.blocks[index]
+            del self.maxes[index]
+    
+    def _starts(self):
+        if self.starts is None:
+            self.starts = list(itertools.accumulate((len(block) for block in self.blocks), initial=0))
+        return self.starts
+    
+    def bisect_left(self, item):
+        index = bisect.bisect_left(self.maxes, item)
+        if index == len(self.blocks):
+            return self.size
+        return self._starts()[index] + bisect.bisect_left(self.blocks[index], item)
+    
+    def bisect_right(self, item):
+        index = bisect.bisect_right(self.maxes, item)
+        if index == len(self.blocks):
+            return self.size
+        return self._starts()[index] + bisect.bisect_right(self.blocks[index], item)
+    
+    def items(self, start, stop, descending=False):
+        # The items at positions start .. stop - 1, in order or in reverse
+        if start >= stop:
+            return
+        starts = self._starts()
+        if descending:
+            index = bisect.bisect_right(starts, stop - 1) - 1
+            end = stop - starts[index]
+            while index >= 0 and starts[index] + end > start:
+                block = self.blocks[index]
+                yield from reversed(block[max(start - starts[index], 0):end])
+                index -= 1
+                end = len(self.blocks[index]) if index >= 0 else 0
+        else:
+            index = bisect.bisect_right(starts, start) - 1
+            offset = start - starts[index]
+            while index < len(self.blocks) and starts[index] < stop:
+                yield from self.blocks[index][offset:stop - starts[index]]
+                index += 1
+                offset = 0
+
+class AccountIndex:
+    # Secondary indexes over the accounts for admin searches:
+    #
+    #   numbers   sorted account numbers, for number prefixes
+    #   balances  sorted (balance in cents, number) pairs, for balance ranges
+    #   locked    the locked account numbers
+    #
+    # kept up to date from the change records like Aggregates. Balances are
+    # set from each posting's balance_after rather than adjusted, so
+    # applying a record twice does no harm. Queries walk whichever index
+    # gives the requested order and return one page plus a cursor (the
+    # sort key of the last row) to continue after it, so a page costs
+    # O(log n + rows looked at) however many accounts there are. Both sorted
+    # indexes are SortedLists, so the update record() makes for each
+    # posting stays cheap at millions of accounts.
+    def __init__(self):
+        self.numbers = SortedList()
+        self.balances = SortedList()
+        self.balance_of = {}  # number -> cents
+        self.locked = set()
+    
+    def add(self, number, balance, locked):
+        # Bulk loading; finish() sorts once at the end
+        self.balance_of[number] = to_cents(balance)
+        if locked:
+            self.locked.add(number)
+    
+    def finish(self):
+        self.numbers = SortedList(self.balance_of)
+        self.balances = SortedList((cents, number) for number, cents in self.balance_of.items())
+    
+    def _set_balance(self, number, cents):
+        old = self.balance_of.get(number)
+        if old == cents:
+            return
+        if old is None:
+            self.numbers.add(number)
+        else:
+            self.balances.remove((old, number))
+        self.balances.add((cents, number))
+        self.balance_of[number] = cents
+    
+    def _remove(self, number):
+        old = self.balance_of.pop(number, None)
+        if old is not None:
+            self.balances.remove((old, number))
+            self.numbers.remove(number)
+        self.locked.discard(number)
+    
+    def apply(self, record):
+        op = record['op']
+        if op == 'import':
+            for acc_num, pin in record['accounts']:
+                self._set_balance(acc_num, 0)
+        if op in ('deposit', 'withdrawal', 'transfer', 'batch', 'import'):
+            for acc_num, transaction in record['postings']:
+                self._set_balance(acc_num, to_cents(transaction['balance_after']))
+        elif op == 'open':
+            self._set_balance(record['account'], to_cents(record['balance']))
+        elif op == 'status':
+            if record['locked']:
+                self.locked.add(record['account'])
+            else:
+                self.locked.discard(record['account'])
+        elif op == 'close':
+            self._remove(record['account'])
+    
+    def query(self, prefix=None, locked=None, min_balance=None, max_balance=None, sort='number',
+              descending=False, cursor=None, limit=20):
+        # Account numbers matching every filter given, in `sort` order
+        # ('number' or 'balance'), at most `limit` of them, and the cursor
+        # for the next page (None after the last one)
+        low = to_cents(min_balance) if min_balance is not None else None
+        high = to_cents(max_balance) if max_balance is not None else None
+        if sort == 'balance':
+            keys = self.balances
+            first, last = self._balance_range(keys, low, high)
+            if cursor is not None:
+                cursor = tuple(cursor)
+        elif sort == 'number':
+            keys = self.numbers
+            first, last = self._prefix_range(keys, prefix)
+            if low is not None or high is not None:
+                start, stop = self._balance_range(self.balances, low, high)
+                if stop - start < last - first:
+                    # Fewer accounts in the balance range: their numbers,
+                    # sorted for this query
+                    keys = SortedList(number for cents, number in self.balances.items(start, stop)
+                                      if prefix is None or number.startswith(prefix))
+                    first, last = 0, len(keys)
+        else:
+            raise ValueError(f"Unknown sort key: {sort}")
+        if locked and len(self.locked) < last - first:
+            # Few locked accounts: walk those instead
+            if sort == 'balance':
+                keys = SortedList((self.balance_of[number], number) for number in self.locked)
+                first, last = self._balance_range(keys, low, high)
+            else:
+                keys = SortedList(self.locked)
+                first, last = self._prefix_range(keys, prefix)
+        if cursor is not None:
+            if descending:
+                last = min(last, keys.bisect_left(cursor))
+            else:
+                first = max(first, keys.bisect_right(cursor))
+        page = []
+        for key in keys.items(first, last, descending):
+            number = key[1] if sort == 'balance' else key
+            if prefix is not None and not number.startswith(prefix):
+                continue
+            if locked is not None and (number in self.locked) != locked:
+                continue
+            if sort == 'number' and (low is not None or high is not None):
+                cents = self.balance_of[number]
+                if (low is not None and cents < low) or (high is not None and cents > high):
+                    continue
+            if len(page) == limit:
+                return page, self._cursor(page[-1], sort)
+            page.append(number)
+        return page, None
+    
+    def _prefix_range(self, keys, prefix):
+        if prefix is None:
+            return 0, len(keys)
+        return keys.bisect_left(prefix), keys.bisect_left(prefix + '\uffff')
+    
+    def _balance_range(self, keys, low, high):
+        first = 0 if low is None else keys.bisect_left((low, ''))
+        last = len(keys) if high is None else keys.bisect_right((high, '\uffff'))
+        return first, last
+    
+    def _cursor(self, number, sort):
+        return [self.balance_of[number], number] if sort == 'balance' else number
@@ -0,0 +1,465 @@
+import json
+import os
+import threading
+import time
+from aggregates import Aggregates
+from metrics import METRICS
+from money import to_cents
+from storage import FileHistoryReader, Storage, account_path, compact_json, saved_file_history, write_atomic
+
+def folded_transaction(line):
+    # History file lines are [seq, transaction]
+    return json.loads(line)[1]
+
+class Journal:
+    # Append-only log of account mutations. Each record is one JSON line that
+    # is fsync'd before append() returns, so an acknowledged operation
+    # survives a crash without rewriting accounts.json.
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.count = 0
+    
+    def append(self, record):
+        data = (compact_json(record) + '\n').encode()
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        METRICS.wrote('journal', len(data))
+        self.count += 1
+    
+    def replay(self):
+        if not os.path.exists(self.path):
+            return
+        good = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good += len(line)
+                yield record
+        # A crash in the middle of append() leaves a torn last line; cut it
+        # off so new records are not glued onto it.
+        if good != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good)
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class Commit:
+    # Handed to everyone whose records went into the same group commit;
+    # wait() returns once the group is on disk and raises if writing it failed
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+    
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+
+class GroupCommitJournal(Journal):
+    # Journal whose append() only queues the record. A writer thread waits
+    # up to `window` seconds (or until `max_batch` records are queued), then
+    # writes the whole group with one fsync and releases everyone waiting on
+    # its Commit. Under load that turns N fsyncs into one. Records queued
+    # while an fsync is running form the next group anyway; the wait also
+    # ends once as many records are queued as went into the last group, and
+    # is skipped when that group had a single record, so a lone caller does
+    # not pay for the window.
+    def __init__(self, path, window=0.002, max_batch=256):
+        super().__init__(path)
+        self.window = window
+        self.max_batch = max_batch
+        self.condition = threading.Condition()
+        self.queue = []
+        self.commit = Commit()
+        self.closing = False
+        self.writer = None
+        self.stopped = None
+        self.last_group = 0
+    
+    def append(self, record):
+        data = (compact_json(record) + '\n').encode()
+        with self.condition:
+            if self.stopped is not None:
+                raise self.stopped
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.write_groups, daemon=True)
+                self.writer.start()
+            self.queue.append(data)
+            self.count += 1
+            self.condition.notify()
+            return self.commit
+    
+    def write_groups(self):
+        # A group that fails to write fails its Commit. If the thread itself
+        # stops, every commit still waiting fails with it and append()
+        # refuses records from then on, so no wait() is left hanging.
+        commit = None
+        try:
+            while True:
+                with self.condition:
+                    while not self.queue and not self.closing:
+                        self.condition.wait()
+                    if not self.queue:
+                        return
+                    deadline = time.monotonic() + (self.window if self.last_group > 1 else 0)
+                    target = min(self.max_batch, max(self.last_group, 1))
+                    while len(self.queue) < target and not self.closing:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    group, self.queue = self.queue, []
+                    commit, self.commit = self.commit, Commit()
+                    self.last_group = len(group)
+                try:
+                    if self.file is None:
+                        self.file = open(self.path, 'ab')
+                    data = b''.join(group)
+                    self.file.write(data)
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    METRICS.wrote('journal', len(data))
+                except Exception as e:
+                    commit.error = e
+                commit.event.set()
+                commit = None
+        except BaseException as e:
+            with self.condition:
+                self.stopped = OSError(f"Journal writer stopped: {e!r}")
+                self.queue = []
+                for waiting in (commit, self.commit):
+                    if waiting is not None:
+                        waiting.error = self.stopped
+                        waiting.event.set()
+            raise
+    
+    def close(self):
+        # Flush whatever is queued before the segment is closed
+        if self.writer is not None:
+            with self.condition:
+                self.closing = True
+                self.condition.notify()
+            self.writer.join()
+            self.writer = None
+            self.closing = False
+        super().close()
+
+class JournalStorage(Storage):
+    # Snapshot + journal layout used by journal mode, next to data_file:
+    #
+    #   accounts.snapshot.json    balances and status only, the dashboard
+    #                             aggregates, and the number of the last
+    #                             journal segment folded into it
+    #   accounts.journal.<seq>    journal segments not yet folded
+    #   accounts.history/         one JSON-lines file per account holding its
+    #                             folded transactions as [seq, transaction]
+    #
+    # Startup reads the snapshot and replays the unfolded segments, so it
+    # costs O(accounts + tail) no matter how long the histories are. Older
+    # transactions are read from the history files only when an account's
+    # history is actually needed.
+    #
+    # With commit_window > 0 the segments are GroupCommitJournals and
+    # append() returns the Commit to wait on instead of syncing itself.
+    def __init__(self, data_file='accounts.json', checkpoint_every=10000, commit_window=0, commit_batch=256):
+        base = os.path.splitext(data_file)[0]
+        self.data_file = data_file
+        self.snapshot_file = base + '.snapshot.json'
+        self.journal_prefix = base + '.journal.'
+        self.history_dir = base + '.history'
+        self.undo_file = os.path.join(self.history_dir, 'undo.json')
+        self.checkpoint_every = checkpoint_every
+        self.commit_window = commit_window
+        self.commit_batch = commit_batch
+        self.snapshot_seq = 0
+        self.seq = 0
+        self.tail = 0
+        self.journal = None
+        self.compactor = None
+        self.compact_failed = False
+        self.folded_lock = threading.Lock()
+        self.folded = {}  # account number -> its snapshot data, for histories compactions appended to
+        self.loaded_aggregates = None
+    
+    def segments(self):
+        directory = os.path.dirname(self.journal_prefix) or '.'
+        name = os.path.basename(self.journal_prefix)
+        seqs = []
+        for entry in os.listdir(directory):
+            if entry.startswith(name) and entry[len(name):].isdigit():
+                seqs.append(int(entry[len(name):]))
+        return sorted(seqs)
+    
+    def segment_path(self, seq):
+        return self.journal_prefix + str(seq)
+    
+    def open_segment(self, seq):
+        if self.commit_window > 0:
+            return GroupCommitJournal(self.segment_path(seq), self.commit_window, self.commit_batch)
+        return Journal(self.segment_path(seq))
+    
+    def history_path(self, account_number):
+        return account_path(self.history_dir, account_number, '.jsonl')
+    
+    def sidecar_path(self, name):
+        return os.path.splitext(self.data_file)[0] + '.' + name
+    
+    def load(self):
+        snapshot = None
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'r') as f:
+                snapshot = json.load(f)
+            self.snapshot_seq = snapshot['journal_seq']
+        self._recover()
+        if snapshot is not None:
+            # Snapshots written before the aggregates were kept have none;
+            # replay() starts a compaction that counts them
+            if 'aggregates' in snapshot:
+                self.loaded_aggregates = Aggregates.from_state(snapshot['aggregates'])
+            return snapshot['accounts']
+        # No checkpoint yet: accounts.json is the starting state
+        if os.path.exists(self.data_file):
+            with open(self.data_file, 'r') as f:
+                return json.load(f)
+        self.loaded_aggregates = Aggregates()
+        return {}
+    
+    def aggregates(self):
+        return self.loaded_aggregates
+    
+    def replay(self):
+        # Unfolded segments in order, then a fresh segment for new writes
+        self.seq = self.snapshot_seq
+        for seq in self.segments():
+            if seq > self.snapshot_seq:
+                for record in Journal(self.segment_path(seq)).replay():
+                    self.tail += 1
+                    yield record
+                self.seq = seq
+        self.seq += 1
+        self.journal = self.open_segment(self.seq)
+        if self.tail >= self.checkpoint_every or self.loaded_aggregates is None:
+            self.checkpoint()
+    
+    def append(self, record):
+        commit = self.journal.append(record)
+        self.tail += 1
+        if self.tail >= self.checkpoint_every:
+            self.checkpoint()
+        return commit
+    
+    def history_reader(self, account_number, acc_data):
+        if 'history_bytes' not in acc_data:
+            return None
+        # Only the bytes folded before this process started belong to the
+        # file part; anything newer is already in the account's in-memory tail.
+        return FileHistoryReader(self.history_path(account_number), acc_data['history_bytes'],
+                                 acc_data['history_count'], folded_transaction, acc_data.get('history_skip', 0))
+    
+    def saved_histories(self, changed):
+        # Histories are written by compaction, not by save()
+        with self.folded_lock:
+            folded, self.folded = self.folded, {}
+        return folded
+    
+    def saved_history(self, account_number, history, acc_data):
+        # Only if nothing was archived since the compaction, so the file's
+        # lines still line up with the in-memory positions
+        if acc_data.get('history_archived', 0) != history.archived:
+            return None
+        return saved_file_history(history, self.history_path(account_number), acc_data['history_bytes'],
+                                  acc_data['history_count'], acc_data.get('history_skip', 0), folded_transaction)
+    
+    def checkpoint(self, wait=False):
+        # Start a new segment and fold the finished ones into a new snapshot
+        # on a background thread; only one compaction runs at a time. After
+        # a compaction that failed and could not be undone, none runs again
+        # in this process: the journal keeps growing and startup rolls the
+        # history files back.
+        if self.compact_failed:
+            return
+        if self.compactor is not None and self.compactor.is_alive():
+            if not wait:
+                return
+            self.compactor.join()
+        upto = self.seq - 1
+        if self.journal.count:
+            upto = self.seq
+            self.journal.close()
+            self.seq += 1
+            self.journal = self.open_segment(self.seq)
+        self.tail = 0
+        self.compactor = threading.Thread(target=self.compact, args=(upto,), daemon=True)
+        self.compactor.start()
+        if wait:
+            self.compactor.join()
+    
+    def compact(self, upto):
+        pending = {}
+        reset = set()
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'r') as f:
+                snapshot = json.load(f)
+            accounts = snapshot['accounts']
+            folded = snapshot['journal_seq']
+            counted = 'aggregates' not in snapshot
+            if counted:
+                aggregates = self._count(accounts)
+            else:
+                aggregates = Aggregates.from_state(snapshot['aggregates'])
+        else:
+            # First checkpoint: move the histories out of the legacy file
+            accounts = {}
+            folded = 0
+            counted = True
+            aggregates = Aggregates()
+            if os.path.exists(self.data_file):
+                with open(self.data_file, 'r') as f:
+                    accounts_data = json.load(f)
+                aggregates = Aggregates.count_data(accounts_data)
+                for acc_num, acc_data in accounts_data.items():
+                    history = acc_data.pop('transaction_history')
+                    acc_data['history_count'] = len(history)
+                    acc_data['history_bytes'] = 0
+                    accounts[acc_num] = acc_data
+                    pending[acc_num] = [[0, t] for t in history]
+                    reset.add(acc_num)
+        seqs = [seq for seq in self.segments() if folded < seq <= upto]
+        if not seqs and folded and not counted:
+            return
+        for seq in seqs:
+            for record in Journal(self.segment_path(seq)).replay():
+                self._fold(accounts, pending, reset, seq, record)
+                aggregates.apply(record)
+        
+        # Remember how long every touched history file was, so a crash
+        # before the new snapshot lands can be rolled back on startup.
+        sizes = {}
+        for acc_num in pending.keys() | reset:
+            path = self.history_path(acc_num)
+            if acc_num in reset or not os.path.exists(path):
+                sizes[acc_num] = 0
+            else:
+                sizes[acc_num] = os.path.getsize(path)
+        os.makedirs(self.history_dir, exist_ok=True)
+        write_atomic(self.undo_file, compact_json({'journal_seq': upto, 'sizes': sizes}))
+        try:
+            for acc_num in reset - pending.keys():
+                path = self.history_path(acc_num)
+                if os.path.exists(path):
+                    os.remove(path)
+            for acc_num, lines in pending.items():
+                path = self.history_path(acc_num)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                data = ''.join(compact_json(line) + '\n' for line in lines).encode()
+                with open(path, 'wb' if acc_num in reset else 'ab') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    METRICS.wrote('append', len(data))
+                    accounts[acc_num]['history_bytes'] = f.tell()
+            write_atomic(self.snapshot_file, compact_json({'journal_seq': upto, 'accounts': accounts,
+                                                           'aggregates': aggregates.state()}))
+        except Exception:
+            # The snapshot did not land: cut the history files back to where
+            # it says they end, as startup would, so the next compaction's
+            # lines line up. If that fails too, stop compacting.
+            try:
+                self._truncate(sizes)
+                os.remove(self.undo_file)
+            except Exception:
+                self.compact_failed = True
+            raise
+        os.remove(self.undo_file)
+        for seq in self.segments():
+            if seq <= upto:
+                os.remove(self.segment_path(seq))
+        with self.folded_lock:
+            for acc_num in pending:
+                self.folded[acc_num] = dict(accounts[acc_num])
+    
+    def _count(self, accounts):
+        # The aggregates of a snapshot written before they were kept, from
+        # its accounts and their history files (archived lines included)
+        aggregates = Aggregates()
+        for acc_num, acc_data in accounts.items():
+            transactions = []
+            if acc_data.get('history_bytes') and os.path.exists(self.history_path(acc_num)):
+                with open(self.history_path(acc_num), 'rb') as f:
+                    transactions = [folded_transaction(line) for line in f.read(acc_data['history_bytes']).splitlines()]
+            aggregates.add_account(acc_num, to_cents(acc_data['balance']), acc_data.get('locked', False), transactions)
+        return aggregates
+    
+    def _fold(self, accounts, pending, reset, seq, record):
+        op = record['op']
+        if op == 'import':
+            for acc_num, pin in record['accounts']:
+                self._fold(accounts, pending, reset, seq, {'op': 'open', 'account': acc_num, 'pin': pin, 'balance': 0})
+        if op in ('deposit', 'withdrawal', 'transfer', 'batch', 'import'):
+            for acc_num, transaction in record['postings']:
+                accounts[acc_num]['balance'] = transaction['balance_after']
+                accounts[acc_num]['history_count'] += 1
+                pending.setdefault(acc_num, []).append([seq, transaction])
+        elif op == 'open':
+            accounts[record['account']] = {
+                'pin': record['pin'],
+                'balance': record['balance'],
+                'is_active': True,
+                'pin_attempts': 0,
+                'locked': False,
+                'history_count': 0,
+                'history_bytes': 0
+            }
+            pending.pop(record['account'], None)
+            reset.add(record['account'])
+        elif op == 'pin':
+            accounts[record['account']]['pin'] = record['pin']
+            accounts[record['account']]['pin_attempts'] = 0
+        elif op == 'status':
+            accounts[record['account']]['pin_attempts'] = record['pin_attempts']
+            accounts[record['account']]['locked'] = record['locked']
+        elif op == 'archive':
+            # The lines stay in the history file and are skipped
+            for acc_num, count in record['accounts']:
+                acc_data = accounts[acc_num]
+                acc_data['history_count'] -= count
+                acc_data['history_skip'] = acc_data.get('history_skip', 0) + count
+                acc_data['history_archived'] = acc_data.get('history_archived', 0) + count
+        elif op == 'close':
+            del accounts[record['account']]
+            pending.pop(record['account'], None)
+            reset.add(record['account'])
+    
+    def _recover(self):
+        if not os.path.exists(self.undo_file):
+            return
+        with open(self.undo_file, 'r') as f:
+            undo = json.load(f)
+        if undo['journal_seq'] > self.snapshot_seq:
+            self._truncate(undo['sizes'])
+        os.remove(self.undo_file)
+    
+    def _truncate(self, sizes):
+        for acc_num, size in sizes.items():
+            path = self.history_path(acc_num)
+            if os.path.exists(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+    
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.join()
+        if self.journal is not None:
+            self.journal.close()
@@ -0,0 +1,196 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from money import amount_cents
+
+# Histogram bucket bounds in seconds, 10us to 10s
+BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Failure messages of the core, matched in order, and the reason counted
+REASONS = (
+    ('insufficient funds', 'insufficient_funds'),
+    ('too many incorrect', 'locked_out'),
+    ('incorrect pin', 'bad_pin'),
+    ('invalid account number', 'unknown_or_locked'),
+    ('locked', 'locked'),
+    ('inactive', 'inactive'),
+    ('closed', 'inactive'),
+    ('yourself', 'own_account'),
+    ('amount', 'invalid_amount'),
+)
+
+def failure_reason(message):
+    message = str(message).lower()
+    for text, reason in REASONS:
+        if text in message:
+            return reason
+    return 'other'
+
+def amount_failure(args, message):
+    # deposit, withdraw and transfer give one message for a bad amount and
+    # for another reason; the amount tells them apart
+    if args:
+        cents = amount_cents(args[0])
+        if cents is None or cents <= 0:
+            return 'invalid_amount'
+    return failure_reason(message)
+
+class Metrics:
+    # Latency histograms and failure counters for the core operations, and
+    # bytes written by the file-based storage backends (SQLite's own page
+    # writes are not seen). Operations are wrapped with
+    # timed(), which only reads the clock twice and appends the elapsed
+    # nanoseconds to a list (atomic under the GIL, so no lock); the samples
+    # are sorted into the histogram buckets FOLD at a time or when a
+    # snapshot is taken. Most samples fall in the first bucket, so only the
+    # rest are sorted. That keeps the cost well under a microsecond per call
+    # (see `python bench.py metrics`). Histograms are cumulative like
+    # Prometheus counters; log_line() reports what changed since the
+    # previous line, which gives the rolling view.
+    FOLD = 4096
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bounds = [round(bound * 1e9) for bound in BUCKETS]
+        self.histograms = {}  # operation -> [bucket counts..., +Inf count, total ns]
+        self.samples = {}  # operation -> elapsed ns not in the histogram yet
+        self.failures = {}  # (operation, reason) -> count
+        self.bytes = {}  # kind -> bytes written
+        self.last = None  # state at the previous log_line()
+    
+    def timed(self, operation, classify=None):
+        # Decorator for a core operation. Results of the form (falsy,
+        # message) count as failures, by the reason in the message (or
+        # classify(args, message)); exceptions count as 'error'.
+        with self.lock:
+            histogram = self.histograms.setdefault(operation, [0] * (len(self.bounds) + 2))
+            samples = self.samples.setdefault(operation, [])
+        append = samples.append
+        clock = time.perf_counter_ns
+        fold = self.FOLD
+        
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = clock()
+                try:
+                    result = function(*args, **kwargs)
+                except BaseException:
+                    self.fail(operation, 'error')
+                    raise
+                append(clock() - start)
+                if type(result) is tuple and not result[0]:
+                    self.fail(operation, classify(args[1:], result[1]) if classify else failure_reason(result[1]))
+                if len(samples) >= fold:
+                    self.fold(samples, histogram)
+                return result
+            return wrapper
+        return decorate
+    
+    def fold(self, samples, histogram):
+        # Moves the samples taken so far into the histogram; samples
+        # appended meanwhile stay for the next fold
+        with self.lock:
+            batch = samples[:]
+            del samples[:len(batch)]
+            first = self.bounds[0]
+            slower = [elapsed for elapsed in batch if elapsed > first]
+            histogram[0] += len(batch) - len(slower)
+            # Sorted, the rest split at the bucket bounds with one bisect each
+            slower.sort()
+            below = 0
+            for bucket, bound in enumerate(self.bounds[1:], 1):
+                upto = bisect.bisect_right(slower, bound, below)
+                histogram[bucket] += upto - below
+                below = upto
+            histogram[len(self.bounds)] += len(slower) - below
+            histogram[-1] += sum(batch)
+    
+    def fail(self, operation, reason):
+        with self.lock:
+            self.failures[operation, reason] = self.failures.get((operation, reason), 0) + 1
+    
+    def wrote(self, kind, count):
+        with self.lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + count
+    
+    def state(self):
+        for operation, samples in list(self.samples.items()):
+            self.fold(samples, self.histograms[operation])
+        with self.lock:
+            return ({operation: list(counts) for operation, counts in self.histograms.items()},
+                    dict(self.failures), dict(self.bytes))
+    
+    def snapshot(self):
+        # Prometheus text exposition format
+        histograms, failures, written = self.state()
+        lines = ["# HELP atm_operation_seconds Latency of ATM operations",
+                 "# TYPE atm_operation_seconds histogram"]
+        for operation, counts in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'atm_operation_seconds_bucket{{operation="{operation}",le="{bound}"}} {cumulative}')
+            lines.append(f'atm_operation_seconds_sum{{operation="{operation}"}} {counts[-1] / 1e9}')
+            lines.append(f'atm_operation_seconds_count{{operation="{operation}"}} {cumulative}')
+        lines += ["# HELP atm_operation_failures_total Operations refused, by reason",
+                  "# TYPE atm_operation_failures_total counter"]
+        for (operation, reason), count in sorted(failures.items()):
+            lines.append(f'atm_operation_failures_total{{operation="{operation}",reason="{reason}"}} {count}')
+        lines += ["# HELP atm_persistence_bytes_total Bytes written by the storage backend",
+                  "# TYPE atm_persistence_bytes_total counter"]
+        for kind, count in sorted(written.items()):
+            lines.append(f'atm_persistence_bytes_total{{kind="{kind}"}} {count}')
+        return "\n".join(lines) + "\n"
+    
+    def quantile(self, counts, q):
+        # Upper bound of the bucket holding the q-th quantile
+        total = sum(counts[:-1])
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), counts):
+            seen += count
+            if seen >= q * total:
+                return bound
+    
+    def log_line(self, seconds):
+        # One line on what happened since the previous call, `seconds` ago
+        state = self.state()
+        histograms, failures, written = state
+        if self.last is None:
+            last_histograms, last_failures, last_written = {}, {}, {}
+        else:
+            last_histograms, last_failures, last_written = self.last
+        self.last = state
+        parts = []
+        for operation, counts in sorted(histograms.items()):
+            previous = last_histograms.get(operation, [0] * len(counts))
+            delta = [now - then for now, then in zip(counts, previous)]
+            calls = sum(delta[:-1])
+            if calls:
+                parts.append(f"{operation} {calls / seconds:.1f}/s p50<={self.quantile(delta, 0.5) * 1e3:g}ms "
+                             f"p99<={self.quantile(delta, 0.99) * 1e3:g}ms")
+        refused = {key: count - last_failures.get(key, 0) for key, count in failures.items()}
+        if any(refused.values()):
+            parts.append("failures " + " ".join(f"{operation}:{reason}={count}"
+                                               for (operation, reason), count in sorted(refused.items()) if count))
+        parts.append(f"written {sum(written.values()) - sum(last_written.values())}B")
+        return "; ".join(parts)
+    
+    def log_every(self, interval, logger=None):
+        # Logs log_line() every `interval` seconds from a daemon thread
+        logger = logger or logging.getLogger('atm.metrics')
+        
+        def run():
+            while True:
+                time.sleep(interval)
+                logger.info(self.log_line(interval))
+        
+        threading.Thread(target=run, name="metrics-log", daemon=True).start()
+
+# The process-wide instance the core and the backends report to
+METRICS = Metrics()
@@ -0,0 +1,39 @@
+import decimal
+import math
+
+# Money inside the core is integer cents, so balances never drift however
+# many postings they see. Amounts cross the edges (method arguments, the
+# transaction dicts, storage files and records) as dollars: the float
+# nearest the exact cents, which converts back to the same cents.
+
+def to_cents(amount):
+    return round(amount * 100)
+
+def from_cents(cents):
+    return cents / 100
+
+def amount_cents(amount):
+    # Cents of an amount handed to an operation, or None when it is not a
+    # finite number
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount):
+        return None
+    return to_cents(amount)
+
+def parse_amount(text):
+    # Cents of a typed amount such as "25", "12.50" or "1,000"; ValueError
+    # for anything else, fractions of a cent included
+    try:
+        value = decimal.Decimal(text.strip().replace(',', ''))
+    except (AttributeError, decimal.InvalidOperation):
+        raise ValueError(f"Not an amount: {text!r}")
+    if not value.is_finite():
+        raise ValueError(f"Not an amount: {text!r}")
+    cents = value * 100
+    if cents != cents.to_integral_value():
+        raise ValueError("Amounts are in whole cents")
+    return int(cents)
+
+def format_amount(cents):
+    sign = '-' if cents < 0 else ''
+    dollars, cents = divmod(abs(cents), 100)
+    return f"{sign}{dollars}.{cents:02d}"
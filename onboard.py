@@ -0,0 +1,37 @@
+import argparse
+import csv
+import sys
+import time
+from bank import ATM, add_storage_arguments, make_storage
+from rowfile import read_rows
+
+def read_customers(path):
+    # CSV with pin,balance and optionally reference (the customer's id in
+    # the old system) columns, or JSON lines with the same keys (see
+    # rowfile.read_rows)
+    return read_rows(path, 'balance')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create accounts in bulk from a customer file")
+    parser.add_argument('file', help="CSV (pin,balance,...) or .jsonl file")
+    parser.add_argument('--out', required=True, help="CSV written with line,reference,account_number per account")
+    add_storage_arguments(parser)
+    parser.add_argument('--chunk', type=int, default=10000, help="accounts per storage write")
+    args = parser.parse_args()
+    atm_system = ATM(make_storage(args))
+    with open(args.out, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['line', 'reference', 'account_number'])
+        try:
+            start = time.perf_counter()
+            created, errors = atm_system.import_accounts(
+                read_customers(args.file), args.chunk,
+                lambda row, account_number: writer.writerow([row['line'], row.get('reference', ''), account_number]))
+            elapsed = time.perf_counter() - start
+        finally:
+            atm_system.close()
+    for line, message in errors:
+        print(f"line {line}: {message}", file=sys.stderr)
+    print(f"Created {created} account(s) in {elapsed:.2f}s ({created / max(elapsed, 1e-9):.0f}/s), "
+          f"{len(errors)} rejected")
+    sys.exit(1 if errors else 0)
\ No newline at end of file
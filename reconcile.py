@@ -0,0 +1,281 @@
+import argparse
+import array
+import sys
+import time
+import numpy as np
+from bank import ATM, add_storage_arguments, make_storage
+from history import TYPES, Transactions
+from money import format_amount
+from storage import SqliteStorage
+
+# Effect of each transaction type code (history.TYPES order) on the balance
+SIGNS = np.array([1, -1, 1, -1], dtype=np.int64)
+TRANSFER_IN, TRANSFER_OUT = 2, 3
+
+class Ledger:
+    # Every account's balance and transactions as NumPy columns, for checks
+    # that run as a few whole-array passes instead of a loop over dicts:
+    #
+    #   numbers, balances  one entry per account, balances in cents
+    #   starts, counts     where each account's transactions are
+    #   owners, types, amounts, after, counterparties
+    #                      one entry per transaction, grouped by account and
+    #                      oldest first: the owning account's position, the
+    #                      type code, amount and balance_after in cents and
+    #                      the other account of a transfer
+    #
+    # Transactions the history columns cannot hold (history.Transactions
+    # `irregular`) have type code -1 and are listed in `irregular`.
+    def __init__(self, numbers, balances, counts, types, amounts, after, counterparties, irregular=()):
+        self.numbers = np.asarray(numbers, dtype=np.int64)
+        self.balances = np.asarray(balances, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+        self.owners = np.repeat(np.arange(len(self.numbers), dtype=np.int64), self.counts)
+        self.types = np.asarray(types, dtype=np.int8)
+        self.amounts = np.asarray(amounts, dtype=np.int64)
+        self.after = np.asarray(after, dtype=np.int64)
+        self.counterparties = np.asarray(counterparties, dtype=np.int64)
+        self.irregular = list(irregular)  # (account number, position in its history)
+    
+    @classmethod
+    def from_atm(cls, atm):
+        # One pass over the accounts, each read under its own lock; run it
+        # against a quiet ATM, or transfers made meanwhile may show half
+        # done. Histories already in columns are copied as they are; the
+        # others (stored or archived) are read and put in columns first.
+        # SQLite databases are read in bulk instead (from_sqlite).
+        if isinstance(atm.storage, SqliteStorage):
+            return cls.from_sqlite(atm)
+        numbers = array.array('q')
+        balances = array.array('q')
+        counts = array.array('q')
+        types = array.array('b')
+        amounts = array.array('q')
+        after = array.array('q')
+        counterparties = array.array('q')
+        irregular = []
+        for acc_num in sorted(atm.accounts):
+            account = atm.accounts.get(acc_num)
+            if account is None:
+                continue
+            with account.lock:
+                history = account.transaction_history
+                columns = history.recent
+                if history.stored or history.archived:
+                    columns = Transactions(acc_num, history)
+                numbers.append(int(acc_num))
+                balances.append(account.cents)
+                counts.append(len(columns))
+                types.extend(columns.types)
+                amounts.extend(columns.amounts)
+                after.extend(columns.balances)
+                counterparties.extend(columns.counterparties)
+                if columns.irregular:
+                    irregular += [(acc_num, position) for position in sorted(columns.irregular)]
+        return cls(*(np.frombuffer(column, dtype=column.typecode)
+                     for column in (numbers, balances, counts, types, amounts, after, counterparties)), irregular)
+    
+    @classmethod
+    def from_sqlite(cls, atm):
+        # Every live transaction in one query, by account in the order they
+        # were recorded (id, which the balance_after chains follow and an
+        # index serves), converted to cents and type codes by SQLite and
+        # read into arrays a chunk of rows at a time. SQLite gets each transaction as it is
+        # recorded, so the rows are those of the in-memory accounts; rows of
+        # other accounts are skipped. Archived transactions are read from the
+        # archive and put in front of their account's rows. Types the
+        # columns cannot hold, and amounts in fractions of a cent, are
+        # irregular, with zeros as history.Transactions puts them.
+        keys = sorted(atm.accounts)
+        accounts = [atm.accounts[acc_num] for acc_num in keys]
+        numbers = np.array(keys, dtype=np.int64)
+        balances = np.fromiter((account.cents for account in accounts), dtype=np.int64, count=len(accounts))
+        codes = " ".join(f"WHEN '{name}' THEN {code}" for code, name in enumerate(TYPES))
+        rows = atm.storage.connect().execute(
+            "SELECT CAST(account_number AS INTEGER),"
+            f" CASE WHEN ROUND(amount * 100) / 100 = amount AND ROUND(balance_after * 100) / 100 = balance_after"
+            f" THEN CASE type {codes} ELSE -1 END ELSE -1 END,"
+            " CAST(ROUND(amount * 100) AS INTEGER), CAST(ROUND(balance_after * 100) AS INTEGER),"
+            " COALESCE(CAST(CASE type WHEN 'transfer_in' THEN from_account WHEN 'transfer_out' THEN to_account END"
+            " AS INTEGER), -1)"
+            " FROM transactions ORDER BY account_number, id")
+        chunks = []
+        while True:
+            chunk = rows.fetchmany(100000)
+            if not chunk:
+                break
+            chunks.append(np.array(chunk, dtype=np.int64))
+        table = np.concatenate(chunks) if chunks else np.zeros((0, 5), dtype=np.int64)
+        del chunks
+        owners = np.searchsorted(numbers, table[:, 0])
+        known = owners < len(numbers)
+        known[known] = numbers[owners[known]] == table[known, 0]
+        if not known.all():
+            table, owners = table[known], owners[known]
+        counts = np.bincount(owners, minlength=len(numbers)).astype(np.int64)
+        types = table[:, 1].astype(np.int8)
+        amounts, after, counterparties = (np.ascontiguousarray(table[:, column]) for column in (2, 3, 4))
+        del table
+        irregular = types < 0
+        amounts[irregular], after[irregular], counterparties[irregular] = 0, 0, -1
+        archived = [(position, account) for position, account in enumerate(accounts)
+                    if account.transaction_history.archived]
+        if archived:
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            at = array.array('q')
+            old = [array.array('b'), array.array('q'), array.array('q'), array.array('q')]
+            for position, account in archived:
+                history = account.transaction_history
+                columns = Transactions(account.account_number, history.slice(0, history.archived))
+                for column, values in zip(old, (columns.types, columns.amounts, columns.balances,
+                                                columns.counterparties)):
+                    column.extend(values)
+                at.extend([starts[position]] * len(columns))
+                counts[position] += len(columns)
+            at = np.frombuffer(at, dtype=np.int64)
+            types, amounts, after, counterparties = (
+                np.insert(column, at, np.frombuffer(values, dtype=values.typecode))
+                for column, values in zip((types, amounts, after, counterparties), old))
+        ledger = cls(numbers, balances, counts, types, amounts, after, counterparties)
+        irregular = np.flatnonzero(ledger.types < 0)
+        owners = ledger.owners[irregular]
+        ledger.irregular = [(keys[owner], position) for owner, position
+                            in zip(owners.tolist(), (irregular - ledger.starts[owners]).tolist())]
+        return ledger
+    
+    def signed(self):
+        # Each amount with the sign of its effect on the balance; irregular
+        # transactions count as 0
+        return np.where(self.types >= 0, SIGNS[self.types.clip(0)], 0) * self.amounts
+    
+    def balance_mismatches(self, signed):
+        # Accounts whose transactions do not add up to their balance:
+        # (positions, sums)
+        running = np.concatenate(([0], np.cumsum(signed)))
+        sums = running[self.starts + self.counts] - running[self.starts]
+        positions = np.flatnonzero(sums != self.balances)
+        return positions, sums[positions]
+    
+    def chain_breaks(self, signed):
+        # Transactions whose balance_after is not the previous one's (0
+        # before the first) plus their amount: (transaction positions,
+        # expected balances)
+        previous = np.empty_like(self.after)
+        previous[1:] = self.after[:-1]
+        previous[self.starts[self.counts > 0]] = 0
+        expected = previous + signed
+        positions = np.flatnonzero(self.after != expected)
+        return positions, expected[positions]
+    
+    def unmatched_transfers(self):
+        # Transfers whose two sides do not pair up: every transfer_out from
+        # A to B of an amount needs a transfer_in on B from A of the same
+        # amount. Sides are counted per (from, to, amount) key, +1 for out
+        # and -1 for in, after sorting the keys; keys not netting to zero
+        # come back as (senders, recipients, amounts, net counts). Dates are
+        # not compared, as older records could stamp the two sides a
+        # second apart.
+        #
+        # np.sort on one uint64 column is many times faster than lexsort or
+        # argsort, so each key is hashed and the row's position packed into
+        # the hash's low bits: sorting that column groups equal keys and
+        # gives their positions. Hash groups that hold more than one key (a
+        # collision in the bits kept) are put in key order with lexsort,
+        # which only sees their rows, so the result is exact.
+        transfers = np.flatnonzero(self.types >= TRANSFER_IN)
+        outs = self.types[transfers] == TRANSFER_OUT
+        own = self.numbers[self.owners[transfers]]
+        other = self.counterparties[transfers]
+        # 8-digit numbers, so a (from, to) pair packs into one int64
+        pairs = np.where(outs, own * 10**8 + other, other * 10**8 + own)
+        amounts = self.amounts[transfers]
+        del own, other
+        if not len(pairs):
+            return (np.zeros(0, np.int64),) * 4
+        hashes = pairs.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + amounts.astype(np.uint64)
+        hashes ^= hashes >> np.uint64(29)
+        hashes *= np.uint64(0xBF58476D1CE4E5B9)
+        hashes ^= hashes >> np.uint64(32)
+        bits = np.uint64((len(pairs) - 1).bit_length())
+        hashes = (hashes >> bits << bits) | np.arange(len(pairs), dtype=np.uint64)
+        hashes.sort()
+        order = (hashes & ((np.uint64(1) << bits) - np.uint64(1))).astype(np.int64)
+        hashes >>= bits
+        pairs, amounts = pairs[order], amounts[order]
+        changed = (pairs[1:] != pairs[:-1]) | (amounts[1:] != amounts[:-1])
+        collided = changed & (hashes[1:] == hashes[:-1])
+        if collided.any():
+            groups = np.concatenate(([0], np.cumsum(hashes[1:] != hashes[:-1])))
+            rows = np.flatnonzero(np.isin(groups, groups[1:][collided]))
+            resorted = rows[np.lexsort((amounts[rows], pairs[rows], groups[rows]))]
+            order[rows], pairs[rows], amounts[rows] = order[resorted], pairs[resorted], amounts[resorted]
+            changed = (pairs[1:] != pairs[:-1]) | (amounts[1:] != amounts[:-1])
+        first = np.flatnonzero(np.concatenate(([True], changed)))
+        net = np.add.reduceat(np.where(outs[order], 1, -1), first)
+        unmatched = first[net != 0]
+        return pairs[unmatched] // 10**8, pairs[unmatched] % 10**8, amounts[unmatched], net[net != 0]
+    
+    def reconcile(self, limit=20):
+        # All three checks; counts of each kind of discrepancy and the first
+        # `limit` of each, with account numbers and amounts in dollars
+        signed = self.signed()
+        positions, sums = self.balance_mismatches(signed)
+        breaks, expected = self.chain_breaks(signed)
+        senders, recipients, amounts, net = self.unmatched_transfers()
+        owners = self.owners[breaks[:limit]]
+        return {
+            'accounts': len(self.numbers),
+            'transactions': len(self.types),
+            'balance_mismatches': len(positions),
+            'chain_breaks': len(breaks),
+            'unmatched_transfers': int(np.abs(net).sum()),
+            'irregular': len(self.irregular),
+            'samples': {
+                'balance_mismatches': [
+                    {'account': f"{number:08d}", 'balance': format_amount(balance), 'transactions': format_amount(total)}
+                    for number, balance, total in zip(self.numbers[positions[:limit]].tolist(),
+                                                      self.balances[positions[:limit]].tolist(), sums[:limit].tolist())],
+                'chain_breaks': [
+                    {'account': f"{number:08d}", 'position': position, 'balance_after': format_amount(found),
+                     'expected': format_amount(should)}
+                    for number, position, found, should in zip(
+                        self.numbers[owners].tolist(), (breaks[:limit] - self.starts[owners]).tolist(),
+                        self.after[breaks[:limit]].tolist(), expected[:limit].tolist())],
+                'unmatched_transfers': [
+                    {'from': f"{sender:08d}", 'to': f"{recipient:08d}", 'amount': format_amount(amount),
+                     'missing': 'transfer_in' if count > 0 else 'transfer_out', 'count': abs(count)}
+                    for sender, recipient, amount, count in zip(senders[:limit].tolist(), recipients[:limit].tolist(),
+                                                                amounts[:limit].tolist(), net[:limit].tolist())],
+                'irregular': [{'account': acc_num, 'position': position}
+                              for acc_num, position in self.irregular[:limit]]
+            }
+        }
+
+def print_report(report):
+    for kind in ('balance_mismatches', 'chain_breaks', 'unmatched_transfers', 'irregular'):
+        if report[kind]:
+            print(f"{report[kind]} {kind.replace('_', ' ')}:")
+            for sample in report['samples'][kind]:
+                print("  " + " ".join(f"{key}={value}" for key, value in sample.items()))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check every balance, balance_after chain and transfer pair")
+    add_storage_arguments(parser)
+    parser.add_argument('--limit', type=int, default=20, help="discrepancies of each kind to list")
+    args = parser.parse_args()
+    atm_system = ATM(make_storage(args))
+    try:
+        start = time.perf_counter()
+        ledger = Ledger.from_atm(atm_system)
+        loaded = time.perf_counter()
+        report = ledger.reconcile(args.limit)
+        checked = time.perf_counter()
+    finally:
+        atm_system.close()
+    print_report(report)
+    problems = sum(report[kind] for kind in ('balance_mismatches', 'chain_breaks', 'unmatched_transfers', 'irregular'))
+    print(f"{report['accounts']} account(s), {report['transactions']} transaction(s): "
+          f"{'no discrepancies' if not problems else f'{problems} discrepancies'} "
+          f"(loaded in {loaded - start:.2f}s, checked in {checked - loaded:.2f}s)")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,38 @@
+import csv
+import json
+from money import from_cents, parse_amount
+
+def read_rows(path, amount):
+    # The rows of a CSV file with a header, or of a JSON-lines file (.jsonl
+    # or .json) with the same keys, read one at a time, each with its line
+    # number in 'line' for error reports. CSV values lose surrounding
+    # whitespace. The `amount` column goes through money.parse_amount, as
+    # text, and is read in dollars; one it rejects (a fraction of a cent
+    # included) is read as None, so validation reports the line.
+    for row in read_lines(path):
+        try:
+            row[amount] = from_cents(parse_amount(str(row.get(amount))))
+        except ValueError:
+            row[amount] = None
+        yield row
+
+def read_lines(path):
+    with open(path, 'r', newline='') as f:
+        if path.endswith('.jsonl') or path.endswith('.json'):
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = {}
+                if not isinstance(row, dict):
+                    row = {}
+                row['line'] = line_number
+                yield row
+        else:
+            # The header is line 1
+            for line_number, row in enumerate(csv.DictReader(f), 2):
+                row = {key: value.strip() if isinstance(value, str) else value for key, value in row.items()}
+                row['line'] = line_number
+                yield row
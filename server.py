@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import itertools
+import json
+import logging
+from bank import ATM, add_storage_arguments, make_storage
+from metrics import METRICS
+from money import from_cents, parse_amount
+from storage import compact_json
+
+def request_amount(request, key, default=None):
+    # Amounts go through money.parse_amount like typed ones: a JSON number
+    # or string in whole cents, returned in dollars
+    value = request[key] if default is None else request.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"Not an amount: {value!r}")
+    return from_cents(parse_amount(str(value)))
+
+class Connection:
+    # Per-terminal state: the session opened by login/admin_login
+    def __init__(self):
+        self.session = None
+
+class ATMServer:
+    # One process owns the ATM state; terminals talk to it over TCP, one JSON
+    # object per line each way:
+    #
+    #   -> {"id": 1, "op": "deposit", "amount": 50}
+    #   <- {"id": 1, "ok": true, "message": "Deposit successful"}
+    #
+    # Connections are coroutines on one event loop. ATM calls can block on
+    # disk, so they run on a small shared thread pool; the core is
+    # thread-safe, so that pool does not need to be one thread per terminal.
+    #
+    # With metrics_port, plain HTTP requests to that port get the metrics
+    # snapshot in Prometheus text format, for scraping.
+    MAX_PAGE = 1000
+    MAX_DAYS = 366
+    
+    def __init__(self, atm, host='127.0.0.1', port=8765, workers=8, metrics_port=None):
+        self.atm = atm
+        self.host = host
+        self.port = port
+        self.metrics_port = metrics_port
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    
+    async def serve(self, ready=None):
+        server = await asyncio.start_server(self.handle, self.host, self.port, limit=1 << 20)
+        self.port = server.sockets[0].getsockname()[1]
+        if self.metrics_port is not None:
+            metrics_server = await asyncio.start_server(self.handle_metrics, self.host, self.metrics_port)
+            self.metrics_port = metrics_server.sockets[0].getsockname()[1]
+        if ready is not None:
+            ready()
+        async with server:
+            await server.serve_forever()
+    
+    async def handle_metrics(self, reader, writer):
+        # Whatever the request, the answer is the snapshot
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            body = METRICS.snapshot().encode()
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: %d\r\n\r\n" % len(body) + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    
+    async def handle(self, reader, writer):
+        connection = Connection()
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = {}
+                try:
+                    request = json.loads(line)
+                    handler = getattr(self, 'op_' + str(request.get('op')), None)
+                    if handler is None:
+                        response = {'ok': False, 'message': f"Unknown operation: {request.get('op')}"}
+                    else:
+                        response = await loop.run_in_executor(self.executor, handler, connection, request)
+                except PermissionError as e:
+                    response = {'ok': False, 'message': str(e)}
+                except (ValueError, TypeError, KeyError, AttributeError) as e:
+                    response = {'ok': False, 'message': f"Bad request: {e}"}
+                except OSError as e:
+                    # A save that failed; the operation's own changes are rolled back or kept for the next save
+                    response = {'ok': False, 'message': f"Storage error: {e}"}
+                if not isinstance(request, dict):
+                    request = {}
+                response['id'] = request.get('id')
+                writer.write((compact_json(response) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    def close(self):
+        self.executor.shutdown()
+    
+    def customer(self, connection):
+        session = connection.session
+        if session is None or session.account is None:
+            raise PermissionError("Not logged in")
+        return session.account
+    
+    def readable_account(self, connection, request):
+        # Customers see their own account; admins may name any account
+        session = connection.session
+        if session is not None and session.admin is not None and 'account' in request:
+            return self.atm.get_account(request['account'])
+        if session is not None and session.account is not None:
+            if request.get('account', session.account.account_number) == session.account.account_number:
+                return session.account
+        return None
+    
+    def page_limit(self, request, default):
+        # Clients choose the page size, up to MAX_PAGE
+        limit = request.get('limit', default)
+        if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+            raise ValueError("limit must be a positive integer")
+        return min(limit, self.MAX_PAGE)
+    
+    def transaction_page(self, transactions, request, skip=0, cursor=None):
+        # The first page of `transactions` (oldest first) after skipping
+        # `skip`, and a cursor for 'between' to go on from: the date of the
+        # last one sent and how many were sent with that date, as dates are
+        # only to the second
+        limit = self.page_limit(request, self.MAX_PAGE)
+        page = transactions[skip:skip + limit]
+        if len(transactions) <= skip + limit:
+            return page, None
+        date = page[-1]['date']
+        sent = sum(1 for _ in itertools.takewhile(lambda t: t['date'] == date, reversed(page)))
+        if cursor is not None and cursor[0] == date and sent == len(page):
+            sent += cursor[1]
+        return page, [date, sent]
+    
+    def admin(self, connection):
+        session = connection.session
+        if session is None or session.admin is None:
+            raise PermissionError("Admin login required")
+        return session.admin
+    
+    def op_login(self, connection, request):
+        connection.session, message = self.atm.authenticate(request['account'], request['pin'])
+        return {'ok': connection.session is not None, 'message': message}
+    
+    def op_admin_login(self, connection, request):
+        connection.session = self.atm.authenticate_admin(request['username'], request['password'])
+        if connection.session is None:
+            return {'ok': False, 'message': "Invalid admin credentials"}
+        return {'ok': True, 'message': "Authentication successful"}
+    
+    def op_logout(self, connection, request):
+        connection.session = None
+        return {'ok': True, 'message': "Logged out"}
+    
+    def op_create_account(self, connection, request):
+        initial_deposit = request_amount(request, 'initial_deposit', 0)
+        if initial_deposit < 0:
+            return {'ok': False, 'message': "Invalid deposit amount"}
+        account_number = self.atm.create_account(request.get('name', ''), request['pin'], initial_deposit)
+        return {'ok': True, 'message': "Account created successfully", 'account': account_number}
+    
+    def op_balance(self, connection, request):
+        return {'ok': True, 'balance': self.customer(connection).get_balance()}
+    
+    def op_deposit(self, connection, request):
+        success, message = self.customer(connection).deposit(request_amount(request, 'amount'))
+        if success:
+            self.atm.save_accounts()
+        return {'ok': success, 'message': message}
+    
+    def op_withdraw(self, connection, request):
+        success, message = self.customer(connection).withdraw(request_amount(request, 'amount'))
+        if success:
+            self.atm.save_accounts()
+        return {'ok': success, 'message': message}
+    
+    def op_transfer(self, connection, request):
+        account = self.customer(connection)
+        recipient = self.atm.get_account(request['to'])
+        if recipient is None:
+            return {'ok': False, 'message': "Recipient account not found"}
+        success, message = account.transfer(request_amount(request, 'amount'), recipient)
+        if success:
+            self.atm.save_accounts()
+        return {'ok': success, 'message': message}
+    
+    def op_change_pin(self, connection, request):
+        success, message = self.customer(connection).change_pin(request['old_pin'], request['new_pin'])
+        self.atm.save_accounts()
+        return {'ok': success, 'message': message}
+    
+    def op_receipt(self, connection, request):
+        account = self.customer(connection)
+        receipt = account.generate_receipt(request['type'], request['amount'], request.get('other'))
+        return {'ok': True, 'receipt': receipt}
+    
+    def op_history(self, connection, request):
+        account = self.readable_account(connection, request)
+        if account is None:
+            return {'ok': False, 'message': "Account not found"}
+        transactions, cursor = account.get_transaction_page(request.get('cursor'), self.page_limit(request, 10))
+        return {'ok': True, 'transactions': transactions, 'cursor': cursor}
+    
+    def op_between(self, connection, request):
+        account = self.readable_account(connection, request)
+        if account is None:
+            return {'ok': False, 'message': "Account not found"}
+        start = datetime.datetime.fromisoformat(request['start'])
+        end = datetime.datetime.fromisoformat(request['end'])
+        cursor = request.get('cursor')
+        skip = 0
+        if cursor is not None:
+            start = max(start, datetime.datetime.fromisoformat(cursor[0]))
+            skip = cursor[1]
+        transactions, cursor = self.transaction_page(
+            account.get_transactions_between(start, end, request.get('types')), request, skip, cursor)
+        return {'ok': True, 'transactions': transactions, 'cursor': cursor}
+    
+    def op_statement(self, connection, request):
+        account = self.readable_account(connection, request)
+        if account is None:
+            return {'ok': False, 'message': "Account not found"}
+        # The transactions beyond the first page come from 'between' with the
+        # cursor, for the month
+        statement = account.get_statement(request['year'], request['month'])
+        cursor = None
+        if statement is not None:
+            statement['transactions'], cursor = self.transaction_page(statement['transactions'], request)
+        return {'ok': True, 'statement': statement, 'cursor': cursor}
+    
+    def op_dashboard(self, connection, request):
+        self.admin(connection)
+        days = request.get('days', 7)
+        if isinstance(days, bool) or not isinstance(days, int):
+            raise ValueError("days must be an integer")
+        return {'ok': True, 'dashboard': self.atm.dashboard(min(max(days, 1), self.MAX_DAYS))}
+    
+    def op_metrics(self, connection, request):
+        self.admin(connection)
+        return {'ok': True, 'metrics': METRICS.snapshot()}
+    
+    def op_accounts(self, connection, request):
+        # Paged like query_accounts, in number order
+        self.admin(connection)
+        accounts, cursor = self.atm.query_accounts(cursor=request.get('cursor'),
+                                                   limit=self.page_limit(request, self.MAX_PAGE))
+        return {'ok': True, 'accounts': accounts, 'cursor': cursor}
+    
+    def op_query_accounts(self, connection, request):
+        self.admin(connection)
+        accounts, cursor = self.atm.query_accounts(
+            request.get('prefix'), request.get('locked'), request.get('min_balance'),
+            request.get('max_balance'), request.get('sort', 'number'), request.get('descending', False),
+            request.get('cursor'), self.page_limit(request, 20))
+        return {'ok': True, 'accounts': accounts, 'cursor': cursor}
+    
+    def op_account_info(self, connection, request):
+        self.admin(connection)
+        return {'ok': True, 'account': self.atm.account_info(request['account'])}
+    
+    def op_unlock(self, connection, request):
+        admin = self.admin(connection)
+        success, message = self.atm.unlock_account(request['account'], admin)
+        return {'ok': success, 'message': message}
+    
+    def op_close(self, connection, request):
+        admin = self.admin(connection)
+        success, message = self.atm.close_account(request['account'], admin)
+        return {'ok': success, 'message': message}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ATM server for networked terminals")
+    add_storage_arguments(parser)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=8, help="threads running ATM operations")
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics over HTTP on this port")
+    parser.add_argument('--metrics-log', type=float, metavar='SECONDS',
+                        help="log operation rates, latencies and failures this often")
+    args = parser.parse_args()
+    if args.metrics_log:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+        METRICS.log_every(args.metrics_log)
+    atm_system = ATM(make_storage(args))
+    server = ATMServer(atm_system, args.host, args.port, args.workers, args.metrics_port)
+    try:
+        asyncio.run(server.serve(lambda: print(f"Serving on {server.host}:{server.port}")))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        atm_system.close()
\ No newline at end of file
@@ -0,0 +1,771 @@
+import array
+import bisect
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+from aggregates import Aggregates
+from history import format_timestamp, to_timestamp
+from metrics import METRICS
+from money import to_cents
+
+def compact_json(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+def write_atomic(path, data, sync=True):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    METRICS.wrote('rewrite', len(data))
+
+def write_aggregates(path, aggregates, evidence):
+    # Not synced: the evidence ties them to the saved data they match, so a
+    # file lost or left behind by a crash is only ever not valid
+    write_atomic(path, compact_json({'evidence': evidence, 'aggregates': aggregates.state()}), sync=False)
+
+def read_aggregates(path, valid):
+    # The aggregates at path if valid(their evidence), else None
+    try:
+        with open(path, 'r') as f:
+            saved = json.load(f)
+        if valid(saved['evidence']):
+            return Aggregates.from_state(saved['aggregates'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def account_path(directory, account_number, suffix):
+    # Spread per-account files over subdirectories by account-number prefix
+    return os.path.join(directory, account_number[:2], account_number + suffix)
+
+def append_lines(path, size, transactions):
+    # Writes transactions as JSON lines after the first `size` bytes of
+    # path, cutting anything a crash left beyond them, and returns the new
+    # size once it is on disk
+    data = ''.join(compact_json(t) + '\n' for t in transactions).encode()
+    with open(path, 'r+b' if size else 'wb') as f:
+        f.seek(size)
+        f.truncate()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        METRICS.wrote('append', len(data))
+        return f.tell()
+
+def read_lines(path, size, count, start, stop):
+    # Lines [start, stop) among the first `size` bytes of a file that holds
+    # `count` lines there. Ranges near the end are read backwards, so the
+    # newest page of a history costs the same however long the file is.
+    with open(path, 'rb') as f:
+        if start < count - stop:
+            lines = []
+            for index, line in enumerate(f):
+                if index >= stop:
+                    break
+                if index >= start:
+                    lines.append(line)
+            return lines
+        data = b''
+        pos = size
+        while pos > 0 and data.count(b'\n') <= count - start:
+            step = min(65536, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+        lines = data[:size - pos].splitlines()
+        if pos > 0:
+            lines = lines[1:]
+        first = count - len(lines)
+        return lines[start - first:stop - first]
+
+class FileHistoryReader:
+    # Stored part of one account's history: `count` lines of its JSON-lines
+    # file after the first `skip` (lines since moved to the archive), within
+    # its first `size` bytes. Date-range lookups use a sparse (timestamp,
+    # offset) index over every INDEX_STEP-th of those lines, built on the
+    # first query and extended over lines appended since, so a range costs
+    # O(log n + k) after that.
+    INDEX_STEP = 64
+    
+    def __init__(self, path, size, count, parse=json.loads, skip=0):
+        self.path = path
+        self.size = size
+        self.count = count
+        self.parse = parse
+        self.skip = skip
+        self.index = None
+        self.indexed = (0, 0)  # bytes and lines the index has looked at
+    
+    def __call__(self, start, stop):
+        return [self.parse(line) for line in read_lines(self.path, self.size, self.skip + self.count,
+                                                        self.skip + start, self.skip + stop)]
+    
+    def drop(self, count):
+        # The first `count` lines have been archived
+        self.skip += count
+        self.count -= count
+        self.index = None
+    
+    def _index(self):
+        if self.index is None:
+            self.index = (array.array('q'), array.array('q'))
+            self.indexed = (0, 0)
+        times, offsets = self.index
+        offset, number = self.indexed
+        if offset < self.size:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if offset >= self.size:
+                        break
+                    if number >= self.skip and (number - self.skip) % self.INDEX_STEP == 0:
+                        times.append(to_timestamp(self.parse(line)['date']))
+                        offsets.append(offset)
+                    offset += len(line)
+                    number += 1
+            self.indexed = (offset, number)
+        return self.index
+    
+    def _scan(self, block):
+        times, offsets = self._index()
+        with open(self.path, 'rb') as f:
+            f.seek(offsets[block])
+            offset = offsets[block]
+            for line in f:
+                if offset >= self.size:
+                    break
+                offset += len(line)
+                transaction = self.parse(line)
+                yield to_timestamp(transaction['date']), transaction
+    
+    def between(self, start, end):
+        # Transactions with start <= timestamp < end, oldest first
+        times, offsets = self._index()
+        if not times:
+            return []
+        transactions = []
+        for timestamp, transaction in self._scan(max(bisect.bisect_left(times, start) - 1, 0)):
+            if timestamp >= end:
+                break
+            if timestamp >= start:
+                transactions.append(transaction)
+        return transactions
+    
+    def last_before(self, timestamp):
+        times, offsets = self._index()
+        block = bisect.bisect_left(times, timestamp) - 1
+        if block < 0:
+            return None
+        last = None
+        for moment, transaction in self._scan(block):
+            if moment >= timestamp:
+                break
+            last = transaction
+        return last
+
+def saved_file_history(history, path, size, count, skip, parse=json.loads):
+    # Storage.saved_history() for histories kept in JSON-lines files. Lines
+    # are only ever appended, so the date index of the reader the account
+    # has is still good for the new one.
+    reader = FileHistoryReader(path, size, count, parse, skip)
+    previous = history.reader
+    if isinstance(previous, FileHistoryReader) and (previous.path, previous.skip) == (path, skip):
+        reader.index, reader.indexed = previous.index, previous.indexed
+    return reader, count
+
+class Storage:
+    # Persistence interface behind ATM.load_accounts/save_accounts.
+    #
+    # load() returns {account_number: account data} in the accounts.json
+    # shape. 'transaction_history' may be left out and replaced by
+    # 'history_count', in which case history_reader() must return a
+    # callable reader(start, stop) giving that slice of the stored history.
+    # replay() yields change records to apply on top of what load() returned.
+    # append() receives every change record as it happens; it either makes
+    # the record durable before returning or returns an object whose wait()
+    # does (group commit). save() is called at the points where the GUI used
+    # to rewrite accounts.json, with the numbers of the accounts changed (or
+    # closed) since the previous save. Backends whose save() reads the
+    # account objects set reads_accounts, so they are saved between
+    # operations rather than halfway through one.
+    #
+    # 'history_archived' counts the oldest transactions moved to the archive
+    # by 'archive' records; 'history_count' and the reader cover only the
+    # ones after them.
+    #
+    # After a save, saved_histories(changed) names the accounts whose stored
+    # history may have grown, as {account number: anything the backend
+    # needs back}, and saved_history() is called for each with that
+    # account's lock held. It returns (reader, count) for the first `count`
+    # live transactions as storage now holds them, and History.persisted()
+    # stops keeping those in memory.
+    #
+    # Backends that set lazy return {} from load() and instead look up one
+    # account at a time: lookup(account_number) returns its data (None if
+    # there is no such account), account_numbers() lists them all and
+    # account_summaries() yields (number, balance, locked) for each as
+    # saved, without loading them, for the admin search indexes.
+    #
+    # Backends that set ranged have nothing to replay and can read one
+    # range of accounts on its own: load_range(first, last) returns the
+    # data of the accounts numbered first..last, in the shape of load(),
+    # reading only those, for the end-of-day workers.
+    #
+    # aggregates() returns the dashboard Aggregates as of load() (the ATM
+    # applies the records of replay() on top), or None if storage did not
+    # keep them and the ATM has to count them. settled(aggregates) is
+    # called, under the ATM's lock, whenever everything recorded has been
+    # saved, for backends that keep them next to what save() wrote.
+    reads_accounts = False
+    lazy = False
+    ranged = False
+    
+    def load(self):
+        raise NotImplementedError
+    
+    def load_range(self, first, last):
+        raise NotImplementedError
+    
+    def replay(self):
+        return iter(())
+    
+    def history_reader(self, account_number, acc_data):
+        return None
+    
+    def saved_histories(self, changed):
+        return dict.fromkeys(changed)
+    
+    def saved_history(self, account_number, history, saved):
+        return None
+    
+    def aggregates(self):
+        return None
+    
+    def settled(self, aggregates):
+        pass
+    
+    def sidecar_path(self, name):
+        # Where the ATM keeps small state files of its own (the account
+        # number allocator) next to this backend's data; None keeps that
+        # state in memory only
+        return None
+    
+    def append(self, record):
+        pass
+    
+    def save(self, accounts, changed):
+        pass
+    
+    def checkpoint(self, wait=False):
+        pass
+    
+    def close(self):
+        pass
+
+class JsonStorage(Storage):
+    # The original format: everything in one accounts.json, rewritten on
+    # save. The aggregates go to accounts.aggregates.json after each save,
+    # with the digest of the accounts.json they match.
+    reads_accounts = True
+    
+    def __init__(self, data_file='accounts.json'):
+        self.data_file = data_file
+        self.digest = None  # of accounts.json as last read or written
+    
+    def load(self):
+        if not os.path.exists(self.data_file):
+            return {}
+        with open(self.data_file, 'rb') as f:
+            data = f.read()
+        self.digest = hashlib.blake2b(data).hexdigest()
+        return json.loads(data)
+    
+    def aggregates(self):
+        if self.digest is None:
+            return Aggregates()
+        return read_aggregates(self.sidecar_path('aggregates.json'), lambda digest: digest == self.digest)
+    
+    def settled(self, aggregates):
+        if self.digest is not None:
+            write_aggregates(self.sidecar_path('aggregates.json'), aggregates, self.digest)
+    
+    def sidecar_path(self, name):
+        return os.path.splitext(self.data_file)[0] + '.' + name
+    
+    def save(self, accounts, changed):
+        if not changed:
+            return
+        accounts_data = {}
+        for acc_num, account in accounts.items():
+            accounts_data[acc_num] = {
+                'pin': account.pin,
+                'balance': account.balance,
+                'transaction_history': list(account.transaction_history.live()),
+                'is_active': account.is_active,
+                'pin_attempts': account.pin_attempts,
+                'locked': account.locked
+            }
+            if account.transaction_history.archived:
+                accounts_data[acc_num]['history_archived'] = account.transaction_history.archived
+        data = json.dumps(accounts_data, indent=2).encode()
+        with open(self.data_file, 'wb') as f:
+            f.write(data)
+            METRICS.wrote('rewrite', len(data))
+        self.digest = hashlib.blake2b(data).hexdigest()
+
+class SqliteStorage(Storage):
+    # One row per account and one per transaction. Every change record is
+    # committed as a single SQLite transaction, so a transfer updates both
+    # balances and inserts both history rows or does nothing at all. The
+    # dashboard's daily volumes are a table updated in that same
+    # transaction; its other figures come from the account rows load() reads.
+    ranged = True
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            account_number TEXT PRIMARY KEY,
+            pin TEXT NOT NULL,
+            balance REAL NOT NULL,
+            is_active INTEGER NOT NULL DEFAULT 1,
+            pin_attempts INTEGER NOT NULL DEFAULT 0,
+            locked INTEGER NOT NULL DEFAULT 0,
+            history_count INTEGER NOT NULL DEFAULT 0,
+            history_archived INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            account_number TEXT NOT NULL,
+            date TEXT NOT NULL,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            balance_after REAL NOT NULL,
+            from_account TEXT,
+            to_account TEXT
+        );
+        CREATE INDEX IF NOT EXISTS transactions_account_date
+            ON transactions (account_number, date);
+        CREATE INDEX IF NOT EXISTS transactions_account_id
+            ON transactions (account_number, id);
+        CREATE TABLE IF NOT EXISTS volumes (
+            day TEXT NOT NULL,
+            type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            cents INTEGER NOT NULL,
+            PRIMARY KEY (day, type)
+        );
+    """
+    
+    def __init__(self, db_file='accounts.db', import_file='accounts.json'):
+        self.db_file = db_file
+        self.import_file = import_file
+        self.conn = None
+        self.loaded_upto = 0
+        self.loaded_aggregates = None
+    
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=FULL")
+            counted = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'volumes'").fetchone()
+            self.conn.executescript(self.SCHEMA)
+            if not counted:
+                # Databases created before the volumes were kept: counted
+                # once from the transactions still in the database
+                self.conn.execute(
+                    "INSERT INTO volumes SELECT substr(date, 1, 10), type, COUNT(*),"
+                    " SUM(CAST(ROUND(amount * 100) AS INTEGER)) FROM transactions GROUP BY 1, 2")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(accounts)")]
+            if 'history_count' not in columns:
+                # Databases created before history_count was tracked
+                self.conn.executescript("""
+                    ALTER TABLE accounts ADD COLUMN history_count INTEGER NOT NULL DEFAULT 0;
+                    UPDATE accounts SET history_count =
+                        (SELECT COUNT(*) FROM transactions t WHERE t.account_number = accounts.account_number);
+                """)
+            if 'history_archived' not in columns:
+                self.conn.execute("ALTER TABLE accounts ADD COLUMN history_archived INTEGER NOT NULL DEFAULT 0")
+        return self.conn
+    
+    def load(self):
+        conn = self.connect()
+        if not conn.execute("SELECT 1 FROM accounts LIMIT 1").fetchone():
+            self._import_json()
+        aggregates = Aggregates()
+        accounts_data = self._read_accounts("", ())
+        for acc_num, acc_data in accounts_data.items():
+            aggregates.add_account(acc_num, to_cents(acc_data['balance']), acc_data['locked'], ())
+        for day, type_, count, cents in conn.execute("SELECT day, type, count, cents FROM volumes"):
+            aggregates.volumes.setdefault(day, {})[type_] = [count, cents]
+        self.loaded_aggregates = aggregates
+        return accounts_data
+    
+    def load_range(self, first, last):
+        # A range scan of the primary key
+        return self._read_accounts("WHERE account_number BETWEEN ? AND ?", (first, last))
+    
+    def _read_accounts(self, where, params):
+        conn = self.connect()
+        self.loaded_upto = conn.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
+        accounts_data = {}
+        for row in conn.execute("SELECT account_number, pin, balance, is_active, pin_attempts, locked, history_count,"
+                                f" history_archived FROM accounts {where}", params):
+            accounts_data[row[0]] = {
+                'pin': row[1],
+                'balance': row[2],
+                'is_active': bool(row[3]),
+                'pin_attempts': row[4],
+                'locked': bool(row[5]),
+                'history_count': row[6],
+                'history_archived': row[7]
+            }
+        return accounts_data
+    
+    def aggregates(self):
+        return self.loaded_aggregates
+    
+    def _import_json(self):
+        # First start on an existing accounts.json: copy it in once
+        if not self.import_file or not os.path.exists(self.import_file):
+            return
+        with open(self.import_file, 'r') as f:
+            accounts_data = json.load(f)
+        with self._transaction() as conn:
+            for acc_num, acc_data in accounts_data.items():
+                self._open(conn, acc_num, acc_data['pin'], acc_data['balance'],
+                           acc_data.get('is_active', True), acc_data.get('pin_attempts', 0),
+                           acc_data.get('locked', False), acc_data.get('history_archived', 0))
+                self._insert_transactions(conn, [(acc_num, t) for t in acc_data['transaction_history']])
+    
+    def history_reader(self, account_number, acc_data):
+        # Rows added after load() are already in the account's in-memory tail
+        return SqliteHistoryReader(self, account_number, self.loaded_upto, acc_data['history_count'])
+    
+    def saved_history(self, account_number, history, saved):
+        # append() wrote every transaction as it happened, so the rows cover
+        # all of the live history; only the id bound moves
+        count = len(history) - history.archived
+        if count == history.stored:
+            return None
+        upto = self.connect().execute("SELECT MAX(id) FROM transactions WHERE account_number = ?",
+                                      (account_number,)).fetchone()[0]
+        if upto is None:
+            return None
+        return SqliteHistoryReader(self, account_number, upto, count), count
+    
+    def sidecar_path(self, name):
+        return os.path.splitext(self.db_file)[0] + '.' + name
+    
+    def query_history(self, where, params, order="ORDER BY date, id", limit=""):
+        return [transaction for row_id, transaction in self.query_rows(where, params, order, limit)]
+    
+    def query_rows(self, where, params, order="ORDER BY date, id", limit=""):
+        # (id, transaction) pairs
+        rows = self.connect().execute(
+            "SELECT id, date, type, amount, balance_after, from_account, to_account FROM transactions"
+            f" WHERE {where} {order} {limit}", params)
+        history = []
+        for row_id, date, type_, amount, balance_after, from_account, to_account in rows:
+            transaction = {'type': type_, 'amount': amount, 'date': date, 'balance_after': balance_after}
+            if from_account is not None:
+                transaction['from_account'] = from_account
+            if to_account is not None:
+                transaction['to_account'] = to_account
+            history.append((row_id, transaction))
+        return history
+    
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    
+    def _open(self, conn, acc_num, pin, balance, is_active=True, pin_attempts=0, locked=False, archived=0):
+        conn.execute("DELETE FROM transactions WHERE account_number = ?", (acc_num,))
+        conn.execute("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (acc_num, pin, balance, int(is_active), pin_attempts, int(locked), 0, archived))
+    
+    def _insert_transactions(self, conn, postings):
+        counts = {}
+        for acc_num, transaction in postings:
+            counts[acc_num] = counts.get(acc_num, 0) + 1
+        conn.executemany("UPDATE accounts SET history_count = history_count + ? WHERE account_number = ?",
+                         [(count, acc_num) for acc_num, count in counts.items()])
+        volumes = {}
+        for acc_num, transaction in postings:
+            volume = volumes.setdefault((transaction['date'][:10], transaction['type']), [0, 0])
+            volume[0] += 1
+            volume[1] += to_cents(transaction['amount'])
+        conn.executemany("INSERT INTO volumes VALUES (?, ?, ?, ?) ON CONFLICT (day, type)"
+                         " DO UPDATE SET count = count + excluded.count, cents = cents + excluded.cents",
+                         [(day, type_, count, cents) for (day, type_), (count, cents) in volumes.items()])
+        conn.executemany(
+            "INSERT INTO transactions (account_number, date, type, amount, balance_after, from_account, to_account)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(acc_num, t['date'], t['type'], t['amount'], t['balance_after'], t.get('from_account'), t.get('to_account'))
+             for acc_num, t in postings])
+    
+    def append(self, record):
+        op = record['op']
+        with self._transaction() as conn:
+            if op == 'import':
+                for acc_num, pin in record['accounts']:
+                    self._open(conn, acc_num, pin, 0)
+            if op in ('deposit', 'withdrawal', 'transfer', 'batch', 'import'):
+                # The last posting of each account carries its new balance
+                balances = {acc_num: transaction['balance_after'] for acc_num, transaction in record['postings']}
+                conn.executemany("UPDATE accounts SET balance = ? WHERE account_number = ?",
+                                 [(balance, acc_num) for acc_num, balance in balances.items()])
+                self._insert_transactions(conn, record['postings'])
+            elif op == 'open':
+                self._open(conn, record['account'], record['pin'], record['balance'])
+            elif op == 'pin':
+                conn.execute("UPDATE accounts SET pin = ?, pin_attempts = 0 WHERE account_number = ?",
+                             (record['pin'], record['account']))
+            elif op == 'status':
+                conn.execute("UPDATE accounts SET pin_attempts = ?, locked = ? WHERE account_number = ?",
+                             (record['pin_attempts'], int(record['locked']), record['account']))
+            elif op == 'archive':
+                # The rows are in the archive now; the oldest go first
+                for acc_num, count in record['accounts']:
+                    conn.execute("DELETE FROM transactions WHERE id IN (SELECT id FROM transactions"
+                                 " WHERE account_number = ? ORDER BY id LIMIT ?)", (acc_num, count))
+                    conn.execute("UPDATE accounts SET history_count = history_count - ?,"
+                                 " history_archived = history_archived + ? WHERE account_number = ?",
+                                 (count, count, acc_num))
+            elif op == 'close':
+                conn.execute("DELETE FROM transactions WHERE account_number = ?", (record['account'],))
+                conn.execute("DELETE FROM accounts WHERE account_number = ?", (record['account'],))
+    
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+class SqliteHistoryReader:
+    # Stored part of one account's history: its `count` rows with id <= upto,
+    # served from the (account_number, id) index for positions (rows are
+    # added in history order) and the (account_number, date) one for dates.
+    # The ids of the first and last row of recent reads are kept, so a range
+    # next to one already read starts from that row (keyset paging: every
+    # page of History.page() costs what the page does). Other ranges are
+    # counted from whichever end of the rows is nearer, which makes the
+    # newest page cheap as well.
+    EDGES = 64
+    
+    def __init__(self, storage, account_number, upto, count):
+        self.storage = storage
+        self.account_number = account_number
+        self.upto = upto
+        self.count = count
+        self.edges = {}  # position -> id, for rows at the edges of recent reads
+    
+    def __call__(self, start, stop):
+        if stop <= start:
+            return []
+        if stop in self.edges:
+            rows = self.storage.query_rows("account_number = ? AND id < ?",
+                                           (self.account_number, self.edges[stop], stop - start),
+                                           order="ORDER BY id DESC", limit="LIMIT ?")
+            rows.reverse()
+        elif start - 1 in self.edges:
+            rows = self.storage.query_rows("account_number = ? AND id > ? AND id <= ?",
+                                           (self.account_number, self.edges[start - 1], self.upto, stop - start),
+                                           order="ORDER BY id", limit="LIMIT ?")
+        elif self.count - stop < start:
+            rows = self.storage.query_rows("account_number = ? AND id <= ?",
+                                           (self.account_number, self.upto, stop - start, self.count - stop),
+                                           order="ORDER BY id DESC", limit="LIMIT ? OFFSET ?")
+            rows.reverse()
+        else:
+            rows = self.storage.query_rows("account_number = ? AND id <= ?",
+                                           (self.account_number, self.upto, stop - start, start),
+                                           order="ORDER BY id", limit="LIMIT ? OFFSET ?")
+        if rows:
+            if len(self.edges) >= self.EDGES:
+                self.edges = {}
+            self.edges[start] = rows[0][0]
+            self.edges[start + len(rows) - 1] = rows[-1][0]
+        return [transaction for row_id, transaction in rows]
+    
+    def drop(self, count):
+        # Archived rows are deleted, so positions move down by `count`
+        self.count -= count
+        self.edges = {position - count: row_id for position, row_id in self.edges.items() if position >= count}
+    
+    def between(self, start, end):
+        return self.storage.query_history("account_number = ? AND id <= ? AND date >= ? AND date < ?",
+                                          (self.account_number, self.upto,
+                                           format_timestamp(start), format_timestamp(end)))
+    
+    def last_before(self, timestamp):
+        history = self.storage.query_history("account_number = ? AND id <= ? AND date < ?",
+                                             (self.account_number, self.upto, format_timestamp(timestamp)),
+                                             order="ORDER BY date DESC, id DESC", limit="LIMIT 1")
+        return history[0] if history else None
+
+class ShardedStorage(Storage):
+    # One header file per account under accounts.d/<prefix>/ plus an
+    # append-only history file next to it. save() only writes the accounts
+    # changed since the previous save and only appends their new
+    # transactions, so its cost does not grow with the number of accounts.
+    #
+    # Every save numbers the headers it writes with a new generation; the
+    # aggregates in accounts.d/aggregates.json are valid for a generation
+    # at least that of every header and the same number of accounts, so
+    # any header written or removed after them makes them stale.
+    reads_accounts = True
+    ranged = True
+    
+    def __init__(self, directory='accounts.d', import_file='accounts.json'):
+        self.directory = directory
+        self.import_file = import_file
+        self.saved = {}  # account number -> (bytes, live lines, archived lines) of history on disk
+        self.unsaved = {}  # account number -> transactions recorded since the last save
+        self.dropped = {}  # account number -> lines archived since the last save
+        self.generation = 0  # the newest in any header or aggregates file
+        self.loaded_aggregates = None
+    
+    def load(self):
+        if not os.path.isdir(self.directory):
+            self._import_json()
+        accounts_data = {}
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                self._read_headers(shard.path, accounts_data)
+        newest = self.generation
+        
+        def valid(evidence):
+            generation, accounts = evidence
+            self.generation = max(self.generation, generation)
+            return generation >= newest and accounts == len(accounts_data)
+        
+        self.loaded_aggregates = read_aggregates(self.sidecar_path('aggregates.json'), valid)
+        return accounts_data
+    
+    def load_range(self, first, last):
+        # Only the subdirectories whose prefix the range covers
+        accounts_data = {}
+        for prefix in range(int(first[:2]), int(last[:2]) + 1):
+            path = os.path.join(self.directory, f"{prefix:02d}")
+            if os.path.isdir(path):
+                self._read_headers(path, accounts_data, first, last)
+        return accounts_data
+    
+    def _read_headers(self, path, accounts_data, first=None, last=None):
+        for entry in os.scandir(path):
+            if entry.name.endswith('.json'):
+                acc_num = entry.name[:-len('.json')]
+                if first is not None and not first <= acc_num <= last:
+                    continue
+                with open(entry.path, 'r') as f:
+                    acc_data = json.load(f)
+                self.saved[acc_num] = (acc_data.pop('history_bytes'), acc_data['history_count'],
+                                       acc_data.pop('history_skip', 0))
+                self.generation = max(self.generation, acc_data.pop('generation', 0))
+                accounts_data[acc_num] = acc_data
+    
+    def _import_json(self):
+        os.makedirs(self.directory, exist_ok=True)
+        accounts_data = {}
+        if self.import_file and os.path.exists(self.import_file):
+            accounts_data = JsonStorage(self.import_file).load()
+        aggregates = Aggregates.count_data(accounts_data)
+        for acc_num, acc_data in accounts_data.items():
+            self.unsaved[acc_num] = acc_data.pop('transaction_history')
+            self._write(acc_num, acc_data)
+        write_aggregates(self.sidecar_path('aggregates.json'), aggregates, [self.generation, len(accounts_data)])
+    
+    def aggregates(self):
+        return self.loaded_aggregates
+    
+    def settled(self, aggregates):
+        write_aggregates(self.sidecar_path('aggregates.json'), aggregates, [self.generation, len(self.saved)])
+    
+    def history_reader(self, account_number, acc_data):
+        size, count, skip = self.saved[account_number]
+        return FileHistoryReader(account_path(self.directory, account_number, '.jsonl'), size, count, skip=skip)
+    
+    def saved_history(self, account_number, history, saved):
+        if account_number not in self.saved:
+            return None
+        size, count, skip = self.saved[account_number]
+        return saved_file_history(history, account_path(self.directory, account_number, '.jsonl'), size, count, skip)
+    
+    def sidecar_path(self, name):
+        # load() only looks at the shard subdirectories
+        return os.path.join(self.directory, name)
+    
+    def append(self, record):
+        op = record['op']
+        if op == 'import':
+            for acc_num, pin in record['accounts']:
+                self.saved[acc_num] = (0, 0, 0)
+                self.unsaved.pop(acc_num, None)
+                self.dropped.pop(acc_num, None)
+        if op in ('deposit', 'withdrawal', 'transfer', 'batch', 'import'):
+            for acc_num, transaction in record['postings']:
+                self.unsaved.setdefault(acc_num, []).append(transaction)
+        elif op == 'open':
+            self.saved[record['account']] = (0, 0, 0)
+            self.unsaved.pop(record['account'], None)
+            self.dropped.pop(record['account'], None)
+        elif op == 'archive':
+            for acc_num, count in record['accounts']:
+                self.dropped[acc_num] = self.dropped.get(acc_num, 0) + count
+        elif op == 'close':
+            self.saved.pop(record['account'], None)
+            self.unsaved.pop(record['account'], None)
+            self.dropped.pop(record['account'], None)
+    
+    def save(self, accounts, changed):
+        if changed:
+            self.generation += 1
+        for acc_num in changed:
+            account = accounts.get(acc_num)
+            if account is None:
+                for suffix in ('.json', '.jsonl'):
+                    path = account_path(self.directory, acc_num, suffix)
+                    if os.path.exists(path):
+                        os.remove(path)
+                continue
+            self._write(acc_num, {
+                'pin': account.pin,
+                'balance': account.balance,
+                'is_active': account.is_active,
+                'pin_attempts': account.pin_attempts,
+                'locked': account.locked,
+                'history_archived': account.transaction_history.archived
+            })
+    
+    def _write(self, acc_num, acc_data):
+        # History first, header last: the header's history_bytes is what
+        # makes appended lines visible, so a crash in between loses nothing
+        # that was acknowledged and the stray bytes are cut on the next save.
+        # Archived lines stay in the file; history_skip says how many of
+        # the first lines to pass over.
+        header = account_path(self.directory, acc_num, '.json')
+        os.makedirs(os.path.dirname(header), exist_ok=True)
+        size, count, skip = self.saved.get(acc_num, (0, 0, 0))
+        transactions = self.unsaved.pop(acc_num, None)
+        if transactions:
+            size = append_lines(account_path(self.directory, acc_num, '.jsonl'), size, transactions)
+            count += len(transactions)
+        dropped = self.dropped.pop(acc_num, 0)
+        count -= dropped
+        skip += dropped
+        self.saved[acc_num] = (size, count, skip)
+        acc_data['history_bytes'] = size
+        acc_data['history_count'] = count
+        acc_data['history_skip'] = skip
+        acc_data['generation'] = self.generation
+        write_atomic(header, compact_json(acc_data))
@@ -0,0 +1,325 @@
+import argparse
+import bisect
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from bank import ATM
+from benchutil import SUITE_STORAGES, latency_stats, suite_storage, synthetic_number
+from metrics import failure_reason
+from storage import compact_json
+
+# Operation mixes (relative weights) for the peak hours being sized
+MIXES = {
+    'lunch': {'withdraw': 70, 'balance': 20, 'deposit': 5, 'transfer': 5},
+    'payday': {'deposit': 60, 'withdraw': 20, 'balance': 15, 'transfer': 5},
+    'transfers': {'transfer': 70, 'balance': 20, 'withdraw': 10},
+    'mixed': {'withdraw': 40, 'balance': 25, 'deposit': 20, 'transfer': 15},
+}
+
+def parse_mix(text):
+    # A preset name or weights like withdraw=50,deposit=20,transfer=20,balance=10
+    if text in MIXES:
+        return MIXES[text]
+    mix = {}
+    for part in text.split(','):
+        op, weight = part.split('=')
+        if op not in MIXES['mixed']:
+            raise ValueError(f"Unknown operation in mix: {op}")
+        mix[op] = float(weight)
+    return mix
+
+class Zipf:
+    # Items drawn with probability proportional to 1 / rank**s, the ranks
+    # being a shuffle of the items: a few hot accounts take most of the
+    # traffic. One bisect per draw.
+    def __init__(self, items, s, rng):
+        self.items = rng.sample(items, len(items))
+        self.cumulative = list(itertools.accumulate(1 / rank ** s for rank in range(1, len(items) + 1)))
+        self.rng = rng
+    
+    def draw(self):
+        position = bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+        return self.items[min(position, len(self.items) - 1)]
+
+def generate(accounts, terminals, sessions, mix, zipf, bad_pin, retry_miss, seed, unlock_after=50):
+    # The header (with the opening accounts) and the events of `sessions`
+    # customer sessions, dealt round-robin to the terminals. A session is
+    # a login, one to four operations and a logout; with probability
+    # bad_pin the PIN is mistyped first, and each retry is mistyped again
+    # with probability retry_miss, up to the third miss that locks the
+    # account. Staff unlock it from the same terminal unlock_after
+    # sessions later (never if 0).
+    rng = random.Random(seed)
+    opening = [[synthetic_number(i), '1234', round(rng.lognormvariate(6, 1.2), 2)] for i in range(accounts)]
+    header = {
+        'workload': 1,
+        'seed': seed,
+        'terminals': terminals,
+        'mix': mix,
+        'zipf': zipf,
+        'bad_pin': bad_pin,
+        'retry_miss': retry_miss,
+        'unlock_after': unlock_after,
+        'accounts': opening
+    }
+    numbers = [number for number, pin, balance in opening]
+    popularity = Zipf(numbers, zipf, rng)
+    ops = list(mix)
+    weights = [mix[op] for op in ops]
+    events = []
+    unlocks = {}  # session -> [(terminal, account)]
+    for session in range(sessions):
+        for terminal, account in unlocks.pop(session, []):
+            events.append({'t': terminal, 'op': 'unlock', 'account': account})
+        terminal = session % terminals
+        account = popularity.draw()
+        misses = 0
+        if rng.random() < bad_pin:
+            misses = 1
+            while misses < 3 and rng.random() < retry_miss:
+                misses += 1
+        for _ in range(misses):
+            events.append({'t': terminal, 'op': 'login', 'account': account, 'pin': f"{rng.randrange(10000):04d}"})
+        if misses < 3:
+            events.append({'t': terminal, 'op': 'login', 'account': account, 'pin': '1234'})
+            count = 1
+            while count < 4 and rng.random() < 0.4:
+                count += 1
+            for op in rng.choices(ops, weights, k=count):
+                event = {'t': terminal, 'op': op}
+                if op == 'withdraw':
+                    event['amount'] = rng.choice((20, 40, 60, 100, 200))
+                elif op == 'deposit':
+                    event['amount'] = round(rng.lognormvariate(5, 1), 2)
+                elif op == 'transfer':
+                    recipient = popularity.draw()
+                    while recipient == account:
+                        recipient = rng.choice(numbers)
+                    event['amount'] = round(rng.uniform(1, 500), 2)
+                    event['to'] = recipient
+                events.append(event)
+        elif unlock_after:
+            unlocks.setdefault(session + unlock_after, []).append((terminal, account))
+        events.append({'t': terminal, 'op': 'logout'})
+    return header, events
+
+def write_workload(path, header, events):
+    with open(path, 'w') as f:
+        f.write(compact_json(header) + '\n')
+        for event in events:
+            f.write(compact_json(event) + '\n')
+
+def read_workload(path):
+    with open(path, 'r') as f:
+        header = json.loads(f.readline())
+        if header.get('workload') != 1:
+            raise ValueError(f"{path} is not a workload file")
+        return header, [json.loads(line) for line in f if line.strip()]
+
+class Terminal:
+    # Plays one terminal's events in order against the ATM, as the server
+    # would for one connection: operations need a logged-in session and
+    # successful money movements are saved before the next event.
+    def __init__(self, atm, save):
+        self.atm = atm
+        self.save = save
+        self.session = None
+        self.times = {}  # op -> [seconds]
+        self.outcomes = {}  # (op, outcome) -> count
+    
+    def play(self, event):
+        op = event['op']
+        start = time.perf_counter()
+        outcome = self.execute(op, event)
+        self.times.setdefault(op, []).append(time.perf_counter() - start)
+        self.outcomes[op, outcome] = self.outcomes.get((op, outcome), 0) + 1
+    
+    def execute(self, op, event):
+        if op == 'login':
+            self.session, message = self.atm.authenticate(event['account'], event['pin'])
+            return 'ok' if self.session is not None else failure_reason(message)
+        if op == 'logout':
+            self.session = None
+            return 'ok'
+        if op == 'unlock':
+            success, message = self.atm.unlock_account(event['account'], next(iter(self.atm.admin_users)))
+            return 'ok' if success else failure_reason(message)
+        if self.session is None:
+            return 'no_session'
+        account = self.session.account
+        if op == 'balance':
+            account.get_balance()
+            return 'ok'
+        if op == 'deposit':
+            success, message = account.deposit(event['amount'])
+        elif op == 'withdraw':
+            success, message = account.withdraw(event['amount'])
+        else:
+            recipient = self.atm.get_account(event['to'])
+            if recipient is None:
+                return 'unknown_account'
+            success, message = account.transfer(event['amount'], recipient)
+        if not success:
+            return failure_reason(message)
+        if self.save:
+            self.atm.save_accounts()
+        return 'ok'
+
+def replay(atm, events, terminals, serial=False, save=True):
+    # Plays the events and reports throughput, latency per operation and
+    # outcomes. serial plays them in file order on one thread, which makes
+    # the end state the same on every replay; otherwise each terminal is a
+    # thread playing its own events in order, as fast as it can.
+    players = [Terminal(atm, save) for _ in range(terminals)]
+    start = time.perf_counter()
+    if serial:
+        for event in events:
+            players[event['t']].play(event)
+    else:
+        queues = [[] for _ in range(terminals)]
+        for event in events:
+            queues[event['t']].append(event)
+        threads = [threading.Thread(target=lambda player, queue: [player.play(event) for event in queue],
+                                    args=(player, queue)) for player, queue in zip(players, queues)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+    times = {}
+    outcomes = {}
+    for player in players:
+        for op, samples in player.times.items():
+            times.setdefault(op, []).extend(samples)
+        for (op, outcome), count in player.outcomes.items():
+            outcomes.setdefault(op, {})
+            outcomes[op][outcome] = outcomes[op].get(outcome, 0) + count
+    operations = {}
+    for op, samples in sorted(times.items()):
+        operations[op] = latency_stats(samples, sum(count for outcome, count in outcomes[op].items()
+                                                    if outcome != 'ok'))
+        operations[op]['outcomes'] = outcomes[op]
+    return {
+        'events': len(events),
+        'terminals': terminals,
+        'serial': serial,
+        'seconds': elapsed,
+        'events_per_sec': len(events) / elapsed if elapsed else None,
+        'operations': operations
+    }
+
+def state_digest(atm):
+    # Balances and lock states of every account, hashed: equal digests mean
+    # two replays ended in the same state
+    digest = hashlib.sha256()
+    for acc_num in sorted(atm.accounts):
+        account = atm.accounts[acc_num]
+        digest.update(f"{acc_num}:{account.balance:.2f}:{int(account.locked)}\n".encode())
+    return digest.hexdigest()
+
+def run(header, events, storage, serial, save, keep=None):
+    # Replays against a fresh dataset made from the header's accounts, in
+    # `keep` if given and otherwise in a temporary directory. Opening
+    # balances are posted as deposits, as import_accounts() does.
+    directory = keep or tempfile.mkdtemp()
+    date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        os.makedirs(os.path.join(directory, storage), exist_ok=False)
+        source = os.path.join(directory, 'accounts.json')
+        with open(source, 'w') as f:
+            json.dump({number: {'pin': pin, 'balance': balance, 'is_active': True, 'pin_attempts': 0, 'locked': False,
+                                'transaction_history': [{'type': 'deposit', 'amount': balance, 'date': date,
+                                                         'balance_after': balance, 'to_account': number}]}
+                       for number, pin, balance in header['accounts']}, f)
+        atm = ATM(suite_storage(storage, os.path.join(directory, storage), source))
+        try:
+            report = replay(atm, events, header['terminals'], serial, save)
+            report['storage'] = storage
+            report['accounts'] = len(header['accounts'])
+            report['state_digest'] = state_digest(atm)
+        finally:
+            atm.close()
+        return report
+    finally:
+        if keep is None:
+            shutil.rmtree(directory)
+
+def print_report(report):
+    print(f"{report['events']} events on {report['terminals']} terminal(s) against {report['accounts']} "
+          f"account(s), {report['storage']} storage: {report['seconds']:.2f}s, {report['events_per_sec']:.0f} events/s",
+          file=sys.stderr)
+    print(f"{'operation':>10} {'count':>8} {'p50':>9} {'p99':>9} {'max':>9}  outcomes", file=sys.stderr)
+    for op, stats in report['operations'].items():
+        outcomes = " ".join(f"{outcome}={count}" for outcome, count in sorted(stats['outcomes'].items()))
+        print(f"{op:>10} {stats['ops']:>8} {stats['p50_ms']:>7.3f}ms {stats['p99_ms']:>7.3f}ms "
+              f"{stats['max_ms']:>7.2f}ms  {outcomes}", file=sys.stderr)
+    print(f"end state {report['state_digest'][:16]}", file=sys.stderr)
+
+def add_generate_arguments(parser):
+    parser.add_argument('--accounts', type=int, default=10000)
+    parser.add_argument('--terminals', type=int, default=16)
+    parser.add_argument('--sessions', type=int, default=20000)
+    parser.add_argument('--mix', type=parse_mix, default='mixed',
+                        help=f"one of {', '.join(MIXES)} or weights like withdraw=50,deposit=20,transfer=30")
+    parser.add_argument('--zipf', type=float, default=1.1, help="account popularity skew; 0 is uniform")
+    parser.add_argument('--bad-pin', type=float, default=0.05, help="share of sessions that mistype the PIN")
+    parser.add_argument('--retry-miss', type=float, default=0.3,
+                        help="chance each retry is mistyped again (the third miss locks the account)")
+    parser.add_argument('--unlock-after', type=int, default=50,
+                        help="sessions before staff unlock a locked-out account; 0 never unlocks")
+    parser.add_argument('--seed', type=int, default=1)
+
+def add_replay_arguments(parser):
+    parser.add_argument('--storage', choices=SUITE_STORAGES, default='journal')
+    parser.add_argument('--serial', action='store_true',
+                        help="play events in file order on one thread, for a reproducible end state")
+    parser.add_argument('--no-save', dest='save', action='store_false',
+                        help="skip save_accounts() after each successful operation")
+    parser.add_argument('--keep', metavar='DIR', help="replay into DIR and keep the data there")
+    parser.add_argument('--output', help="write the report as JSON here")
+
+def generate_from(args):
+    return generate(args.accounts, args.terminals, args.sessions, args.mix, args.zipf, args.bad_pin,
+                    args.retry_miss, args.seed, args.unlock_after)
+
+def finish(report, args):
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic multi-terminal workloads: generate, record, replay")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    generate_parser = commands.add_parser('generate', help="write a workload file")
+    generate_parser.add_argument('--out', required=True)
+    add_generate_arguments(generate_parser)
+    
+    replay_parser = commands.add_parser('replay', help="replay a workload file against a fresh dataset")
+    replay_parser.add_argument('file')
+    add_replay_arguments(replay_parser)
+    
+    run_parser = commands.add_parser('run', help="generate and replay without writing a file")
+    add_generate_arguments(run_parser)
+    add_replay_arguments(run_parser)
+    
+    args = parser.parse_args()
+    if args.command == 'generate':
+        header, events = generate_from(args)
+        write_workload(args.out, header, events)
+        print(f"Wrote {len(events)} events for {args.terminals} terminal(s) to {args.out}")
+    elif args.command == 'replay':
+        header, events = read_workload(args.file)
+        finish(run(header, events, args.storage, args.serial, args.save, args.keep), args)
+    else:
+        header, events = generate_from(args)
+        finish(run(header, events, args.storage, args.serial, args.save, args.keep), args)